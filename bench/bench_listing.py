@@ -0,0 +1,81 @@
+"""Micro-benchmarks for directory listings.
+
+Builds throwaway folders of 1k, 10k and 100k entries (a mix of folders,
+documents, media and subtitles) and times each stage of a listing: the
+directory scan, sorting, rendering the first HTML page, rendering every
+entry as HTML, and a ?format=json page.
+
+    python bench/bench_listing.py                # 1000 10000 100000
+    python bench/bench_listing.py 5000 --repeat 10
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+
+import server  # noqa: E402
+
+EXTENSIONS = ('.txt', '.pdf', '.docx', '.mp4', '.mkv', '.jpg', '.png', '.mp3', '.zip', '.py', '.json', '.xyz')
+SUBTITLE_EVERY = 20  # one .srt per this many files, so big folders carry many subtitles
+
+
+def build_tree(root, count):
+    for i in range(count):
+        if i % 50 == 0:
+            os.mkdir(os.path.join(root, f"folder{i}"))
+        elif i % SUBTITLE_EVERY == 0:
+            open(os.path.join(root, f"video{i - 1}.srt"), 'w').close()
+        else:
+            ext = EXTENSIONS[i % len(EXTENSIONS)]
+            open(os.path.join(root, f"file{i}{ext}"), 'w').close()
+
+
+def best_of(repeat, func):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(count, repeat):
+    root = tempfile.mkdtemp(prefix='listing-bench-')
+    try:
+        build_tree(root, count)
+        # No version: nothing is cached, so every call does the full work
+        file_data, subtitles = server.scan_directory(root)
+        ordered = server.sort_entries(file_data, 'name')
+        params = {'limit': [str(server.LISTING_MAX_PAGE_SIZE)]}
+
+        results = [
+            ('scan', best_of(repeat, lambda: server.scan_directory(root))),
+            ('sort', best_of(repeat, lambda: server.sort_entries(file_data, 'name'))),
+            ('page', best_of(repeat, lambda: server.render_listing('/bench/', ordered, subtitles, 'name'))),
+            ('all items', best_of(repeat, lambda: server.render_items(ordered, '/__thumb/bench/'))),
+            ('json page', best_of(repeat, lambda: server.build_listing_json(root, '/bench/', None, 'name', params))),
+        ]
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    print(f"{len(file_data)} entries, {len(subtitles)} subtitles")
+    for name, seconds in results:
+        per_entry = seconds / max(len(file_data), 1) * 1e6
+        print(f"  {name:<10} {seconds * 1000:9.2f} ms  {per_entry:7.2f} us/entry")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('sizes', nargs='*', type=int, default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5, help="runs per stage; the best is reported")
+    args = parser.parse_args()
+    for count in args.sizes:
+        run(count, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
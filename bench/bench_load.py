@@ -0,0 +1,583 @@
+"""Load tests for the whole server.
+
+Builds a throwaway tree, starts the server on it in a subprocess (a fresh
+one per scenario) and drives it with concurrent clients:
+
+  listing  a folder of 20k entries: HTML pages, other sort orders, JSON pages
+  range    many players streaming a large file in sequential Range requests
+  small    a storm of small-file requests over keep-alive connections
+  upload   large multipart uploads
+  slow     slow readers holding large downloads open while other clients
+           fetch small files (their latency is the one reported)
+
+Each scenario reports throughput, latency percentiles, and the server's CPU
+time and peak RSS (from /proc, so Linux only) as JSON. Given a baseline (the
+JSON of an earlier run), it also flags every measure that got worse by more
+than --tolerance and exits with status 1.
+
+    python bench/bench_load.py                             # all scenarios, JSON on stdout
+    python bench/bench_load.py range small --engine asyncio --duration 10
+    python bench/bench_load.py --output before.json
+    python bench/bench_load.py --baseline before.json --set BLOCK_CACHE_MB=256
+
+The clients are threads in this process, so on a small machine they compete
+with the server for CPU; compare runs made on the same machine only.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from bench_listing import build_tree
+
+CODE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code')
+
+# Run with python -c: applies config overrides, then starts the server
+BOOTSTRAP = """
+import json, sys
+sys.path.insert(0, sys.argv[1])
+import config
+for name, value in json.loads(sys.argv[2]).items():
+    setattr(config, name, value)
+import server
+server.run_server()
+"""
+
+READ_SIZE = 256 * 1024
+SLOW_READ_SIZE = 16 * 1024
+SLOW_READ_INTERVAL = 0.05  # seconds between a slow client's reads (~320 KB/s)
+RANGE_RESTART_EVERY = 16  # chunks a player streams before seeking elsewhere
+STARTUP_TIMEOUT = 30
+
+# Compared with the baseline: (key, True if higher is better)
+COMPARED = (
+    ('requests_per_sec', True),
+    ('mb_per_sec', True),
+    ('latency_ms.p50', False),
+    ('latency_ms.p99', False),
+    ('server.cpu_ms_per_request', False),
+    ('server.peak_rss_mb', False),
+)
+
+
+class BenchError(Exception):
+    pass
+
+
+# --- The tree ---
+
+def build_bench_tree(root, args):
+    huge = os.path.join(root, 'huge')
+    os.mkdir(huge)
+    build_tree(huge, args.entries)
+
+    small = os.path.join(root, 'small')
+    os.mkdir(small)
+    for i in range(args.small_files):
+        with open(os.path.join(small, f"file{i}.txt"), 'w') as f:
+            f.write(os.urandom(args.small_kb * 512).hex())  # text that compresses about as well as real text
+
+    media = os.path.join(root, 'media')
+    os.mkdir(media)
+    with open(os.path.join(media, 'movie.mp4'), 'wb') as f:
+        block = os.urandom(1024 * 1024)  # random, so nothing along the way can compress it
+        for _ in range(args.file_mb):
+            f.write(block)
+
+    os.mkdir(os.path.join(root, 'uploads'))
+
+
+# --- The server process ---
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class ServerProcess:
+    def __init__(self, root, data_dir, args):
+        self.port = free_port()
+        overrides = {
+            'PORT': self.port,
+            'FOLDER_TO_SERVE': root,
+            'SERVER_ENGINE': args.engine,
+            'SERVER_WORKERS': args.workers,
+            'RATE_LIMIT_MAX_REQUESTS': 0,
+            'ACCESS_LOG_CONSOLE': False,
+            'ACCESS_LOG_FILE': os.path.join(data_dir, 'logs', 'access.log'),
+            'UPLOAD_STATE_DIR': os.path.join(data_dir, 'uploads'),
+            'THUMB_CACHE_DIR': os.path.join(data_dir, 'thumbs'),
+        }
+        overrides.update(args.set)
+        self.log_path = os.path.join(data_dir, 'server.log')
+        self.log = open(self.log_path, 'wb')
+        self.process = subprocess.Popen([sys.executable, '-c', BOOTSTRAP, CODE_DIR, json.dumps(overrides)],
+                                        stdout=self.log, stderr=subprocess.STDOUT)
+
+    def wait_ready(self):
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+                conn.request('GET', '/media/')
+                conn.getresponse().read()
+                conn.close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        self.stop()
+        with open(self.log_path, 'rb') as f:
+            output = f.read().decode('utf-8', 'replace')
+        raise BenchError(f"Server didn't start:\n{output[-2000:]}")
+
+    def pids(self):
+        # The server and every process below it (worker processes, thumbnail renderers)
+        pids, todo = [], [self.process.pid]
+        while todo:
+            pid = todo.pop()
+            pids.append(pid)
+            try:
+                for task in os.listdir(f'/proc/{pid}/task'):
+                    with open(f'/proc/{pid}/task/{task}/children') as f:
+                        todo.extend(int(child) for child in f.read().split())
+            except OSError:
+                pass
+        return pids
+
+    def cpu_seconds(self):
+        """User + system CPU time of the process tree, or None without /proc."""
+        total = None
+        for pid in self.pids():
+            try:
+                with open(f'/proc/{pid}/stat') as f:
+                    fields = f.read().rpartition(')')[2].split()
+            except OSError:
+                continue
+            # utime and stime are fields 14 and 15; the split starts at field 3
+            total = (total or 0) + (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        return total
+
+    def peak_rss_mb(self):
+        """Sum of each process's peak resident set, or None without /proc."""
+        total = None
+        for pid in self.pids():
+            try:
+                with open(f'/proc/{pid}/status') as f:
+                    for line in f:
+                        if line.startswith('VmHWM:'):
+                            total = (total or 0) + int(line.split()[1]) / 1024
+            except OSError:
+                continue
+        return total
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.log.close()
+
+
+# --- Clients ---
+
+class Client:
+    """One keep-alive connection, reopened after errors."""
+
+    def __init__(self, port, rng, deadline):
+        self.port = port
+        self.rng = rng
+        self.deadline = deadline
+        self.conn = None
+        self.buffer = bytearray(READ_SIZE)
+
+    def request(self, method, path, headers=None, body=None, expect=(200,), read_size=READ_SIZE, pause=0):
+        """Send a request and read the whole response; returns the body size.
+        With a pause between reads, the download is cut off at the deadline."""
+        reused = self.conn is not None
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        try:
+            try:
+                self.conn.request(method, path, body=body, headers=headers or {})
+                response = self.conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The server may close idle keep-alive connections; browsers retry those on a new one
+                if not reused or body is not None:
+                    raise
+                self.close()
+                self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+                self.conn.request(method, path, headers=headers or {})
+                response = self.conn.getresponse()
+            view = memoryview(self.buffer)[:read_size]
+            size = 0
+            while True:
+                n = response.readinto(view)
+                if not n:
+                    break
+                size += n
+                if pause:
+                    if time.monotonic() >= self.deadline:
+                        self.close()
+                        return size
+                    time.sleep(pause)
+            if response.status not in expect:
+                raise BenchError(f"{method} {path}: {response.status}")
+            if response.will_close:
+                self.close()
+            return size
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class Worker(threading.Thread):
+    def __init__(self, port, seed, deadline, action):
+        super().__init__(daemon=True)
+        self.client = Client(port, random.Random(seed), deadline)
+        self.deadline = deadline
+        self.action = action
+        self.latencies = []
+        self.bytes = 0
+        self.errors = 0
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            started = time.perf_counter()
+            try:
+                self.bytes += self.action(self.client)
+            except (OSError, http.client.HTTPException, BenchError):
+                self.errors += 1
+                time.sleep(0.01)  # don't spin on a server that refuses everything
+                continue
+            self.latencies.append(time.perf_counter() - started)
+        self.client.close()
+
+
+def percentile(ordered, share):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def run_workers(port, actions, seconds):
+    deadline = time.monotonic() + seconds
+    workers = [Worker(port, i, deadline, action) for i, action in enumerate(actions)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return workers, time.perf_counter() - started
+
+
+def summarize(workers, elapsed):
+    latencies = sorted(latency for worker in workers for latency in worker.latencies)
+    total_bytes = sum(worker.bytes for worker in workers)
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'clients': len(workers),
+        'seconds': round(elapsed, 3),
+        'requests': len(latencies),
+        'errors': sum(worker.errors for worker in workers),
+        'requests_per_sec': round(len(latencies) / elapsed, 2),
+        'mb_per_sec': round(total_bytes / elapsed / (1024 * 1024), 2),
+        'latency_ms': {
+            'mean': ms(sum(latencies) / len(latencies)) if latencies else None,
+            'p50': ms(percentile(latencies, 0.5)),
+            'p90': ms(percentile(latencies, 0.9)),
+            'p99': ms(percentile(latencies, 0.99)),
+            'max': ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+# --- Scenarios ---
+# Each returns (actions of the measured clients, actions of background clients).
+
+GZIP = {'Accept-Encoding': 'gzip'}
+
+
+def listing_scenario(args):
+    pages = max(1, args.entries // 100)
+
+    def action(client):
+        choice = client.rng.random()
+        if choice < 0.5:
+            return client.request('GET', '/huge/', GZIP)
+        if choice < 0.7:
+            return client.request('GET', '/huge/?sort=' + client.rng.choice(('size', 'date', 'type')), GZIP)
+        return client.request('GET', f'/huge/?format=json&cursor={client.rng.randrange(pages) * 100}', GZIP)
+
+    return [action] * args.clients, []
+
+
+def range_scenario(args):
+    size = args.file_mb * 1024 * 1024
+    chunk = args.range_kb * 1024
+    chunks = max(1, size // chunk)
+
+    def player():
+        position = [None, 0]  # next chunk, chunks left before seeking
+
+        def action(client):
+            if not position[1]:
+                position[:] = [client.rng.randrange(chunks), RANGE_RESTART_EVERY]
+            start = position[0] * chunk
+            position[0] = (position[0] + 1) % chunks
+            position[1] -= 1
+            return client.request('GET', '/media/movie.mp4', {'Range': f'bytes={start}-{start + chunk - 1}'},
+                                  expect=(206,))
+        return action
+
+    return [player() for _ in range(args.many_clients)], []
+
+
+def small_scenario(args):
+    def action(client):
+        return client.request('GET', f'/small/file{client.rng.randrange(args.small_files)}.txt', GZIP)
+
+    return [action] * args.many_clients, []
+
+
+def upload_scenario(args):
+    size = args.upload_mb * 1024 * 1024
+    block = os.urandom(1024 * 1024)
+    uploads_dir = os.path.join(args.root, 'uploads')
+    counter = iter(range(1 << 30))
+    lock = threading.Lock()
+
+    def action(client):
+        with lock:
+            name = f"upload{next(counter)}.bin"
+        boundary = 'benchboundary' + name
+        head = (f'--{boundary}\r\nContent-Disposition: form-data; name="files[]"; filename="{name}"\r\n'
+                'Content-Type: application/octet-stream\r\n\r\n').encode()
+        tail = f'\r\n--{boundary}--\r\n'.encode()
+
+        def body():
+            yield head
+            for _ in range(size // len(block)):
+                yield block
+            yield block[:size % len(block)]
+            yield tail
+
+        client.close()  # a streamed body can't be sent again, so don't risk a keep-alive connection closing under it
+        client.request('POST', '/uploads/', {
+            'Content-Type': f'multipart/form-data; boundary={boundary}',
+            'Content-Length': str(len(head) + size + len(tail)),
+        }, body(), expect=(303,))
+        try:
+            os.remove(os.path.join(uploads_dir, name))  # keep the disk from filling up
+        except OSError:
+            pass
+        return size
+
+    return [action] * args.upload_clients, []
+
+
+def slow_scenario(args):
+    def slow_reader(client):
+        return client.request('GET', '/media/movie.mp4', read_size=SLOW_READ_SIZE, pause=SLOW_READ_INTERVAL)
+
+    measured, _ = small_scenario(args)
+    return measured[:args.clients], [slow_reader] * args.slow_clients
+
+
+SCENARIOS = {
+    'listing': listing_scenario,
+    'range': range_scenario,
+    'small': small_scenario,
+    'upload': upload_scenario,
+    'slow': slow_scenario,
+}
+
+
+def run_scenario(name, args):
+    measured, background = SCENARIOS[name](args)
+    data_dir = tempfile.mkdtemp(prefix='load-bench-data-')
+    server = ServerProcess(args.root, data_dir, args)
+    try:
+        server.wait_ready()
+        if args.warmup:
+            run_workers(server.port, measured + background, args.warmup)
+        cpu_before = server.cpu_seconds()
+        deadline = time.monotonic() + args.duration
+        # Background clients keep going a little past the measured ones, so the load lasts the whole measurement
+        extra = [Worker(server.port, 1000 + i, deadline + 1, action) for i, action in enumerate(background)]
+        for worker in extra:
+            worker.start()
+        workers, elapsed = run_workers(server.port, measured, args.duration)
+        cpu_after = server.cpu_seconds()
+        result = summarize(workers, elapsed)
+        for worker in extra:
+            worker.join()
+        if extra:
+            result['background'] = {k: v for k, v in summarize(extra, elapsed).items()
+                                    if k in ('clients', 'requests', 'errors', 'mb_per_sec')}
+        cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+        peak = server.peak_rss_mb()
+        result['server'] = {
+            'cpu_seconds': round(cpu, 3) if cpu is not None else None,
+            'cpu_percent': round(cpu / elapsed * 100, 1) if cpu is not None else None,
+            'cpu_ms_per_request': round(cpu * 1000 / result['requests'], 3) if cpu is not None and result['requests'] else None,
+            'peak_rss_mb': round(peak, 1) if peak is not None else None,
+        }
+        return result
+    finally:
+        server.stop()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+# --- Baseline comparison ---
+
+def lookup(result, key):
+    for part in key.split('.'):
+        if not isinstance(result, dict):
+            return None
+        result = result.get(part)
+    return result
+
+
+def compare(report, baseline, tolerance):
+    """The measures that got worse by more than tolerance, as readable lines."""
+    regressions = []
+    for name, result in report['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if before is None:
+            continue
+        if result['errors'] and not before.get('errors'):
+            regressions.append(f"{name}: {result['errors']} errors (baseline had none)")
+        for key, higher_is_better in COMPARED:
+            old, new = lookup(before, key), lookup(result, key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{name}: {key} {old} -> {new} ({change:+.0%})")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=CODE_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def parse_setting(text):
+    name, sep, value = text.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE, got '{text}'")
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('scenarios', nargs='*', metavar='scenario',
+                        help=f"{', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument('--engine', default='threaded', choices=('threaded', 'asyncio'))
+    parser.add_argument('--workers', type=int, default=1, help="server processes")
+    parser.add_argument('--duration', type=float, default=5, help="measured seconds per scenario")
+    parser.add_argument('--warmup', type=float, default=1, help="unmeasured seconds before each scenario")
+    parser.add_argument('--seed', type=int, default=0, help="client randomness, for repeatable runs")
+    parser.add_argument('--clients', type=int, default=8, help="clients for listings, and fast clients in 'slow'")
+    parser.add_argument('--many-clients', type=int, default=32, help="clients for 'range' and 'small'")
+    parser.add_argument('--upload-clients', type=int, default=4)
+    parser.add_argument('--slow-clients', type=int, default=50)
+    parser.add_argument('--entries', type=int, default=20000, help="entries in the big folder")
+    parser.add_argument('--small-files', type=int, default=2000)
+    parser.add_argument('--small-kb', type=int, default=4)
+    parser.add_argument('--file-mb', type=int, default=128, help="size of the streamed file")
+    parser.add_argument('--range-kb', type=int, default=1024, help="bytes per Range request")
+    parser.add_argument('--upload-mb', type=int, default=64)
+    parser.add_argument('--set', type=parse_setting, action='append', default=[], metavar='NAME=VALUE',
+                        help="config override for the server (VALUE is JSON if it parses), repeatable")
+    parser.add_argument('--output', help="write the JSON here instead of stdout")
+    parser.add_argument('--baseline', help="JSON of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="relative change counted as a regression (default 0.15)")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(sorted(unknown))}")
+    args.set = dict(args.set)
+    random.seed(args.seed)
+    names = args.scenarios or list(SCENARIOS)
+
+    args.root = tempfile.mkdtemp(prefix='load-bench-')
+    try:
+        print(f"Building the tree in {args.root}", file=sys.stderr)
+        build_bench_tree(args.root, args)
+        report = {
+            'meta': {
+                'revision': git_revision(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'engine': args.engine,
+                'workers': args.workers,
+                'settings': args.set,
+                'parameters': {key: value for key, value in vars(args).items()
+                               if key not in ('scenarios', 'engine', 'workers', 'set', 'output', 'baseline', 'root')},
+            },
+            'scenarios': {},
+        }
+        for name in names:
+            print(f"Running {name}...", file=sys.stderr)
+            report['scenarios'][name] = result = run_scenario(name, args)
+            print(f"  {result['requests_per_sec']} req/s, {result['mb_per_sec']} MB/s, "
+                  f"p50 {result['latency_ms']['p50']} ms, p99 {result['latency_ms']['p99']} ms, "
+                  f"{result['errors']} errors", file=sys.stderr)
+    finally:
+        shutil.rmtree(args.root, ignore_errors=True)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key in ('engine', 'workers', 'cpus'):
+            if baseline.get('meta', {}).get(key) != report['meta'][key]:
+                print(f"Note: the baseline was run with {key}={baseline.get('meta', {}).get(key)}", file=sys.stderr)
+        regressions = compare(report, baseline, args.tolerance)
+        report['regressions'] = regressions
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if not regressions:
+            print("No regressions against the baseline", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import ipaddress
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+from config import *
+
+# Per-request access control: the ALLOWED_NETWORKS allowlist and the
+# per-client rate limiter. Both run before every request, so a check has to
+# cost microseconds and a flood of distinct clients must not grow memory.
+
+
+def parse_ip(ip):
+    """(version, address as int) for a textual IP, or None if it isn't one.
+    IPv4-mapped IPv6 addresses (::ffff:a.b.c.d) count as IPv4."""
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+    except OSError:
+        pass
+    try:
+        value = int.from_bytes(socket.inet_pton(socket.AF_INET6, ip.split('%', 1)[0]), 'big')
+    except (OSError, ValueError):
+        return None
+    if value >> 32 == 0xFFFF:
+        return 4, value & 0xFFFFFFFF
+    return 6, value
+
+
+class NetworkAllowlist:
+    """A set of networks compiled into one hash table of prefixes per prefix
+    length. A lookup shifts the address once per distinct length (typically
+    one or two) instead of testing every network in turn.
+    """
+
+    def __init__(self, networks):
+        by_length = {}
+        for net in networks:
+            net = ipaddress.ip_network(net)
+            shift = net.max_prefixlen - net.prefixlen
+            by_length.setdefault((net.version, shift), set()).add(int(net.network_address) >> shift)
+        # Broadest networks first: they are the most likely to match
+        self.tables = {4: [], 6: []}
+        for (version, shift), prefixes in sorted(by_length.items(), key=lambda item: -item[0][1]):
+            self.tables[version].append((shift, frozenset(prefixes)))
+
+    def __contains__(self, ip):
+        parsed = parse_ip(ip)
+        if parsed is None:
+            raise ValueError(f"not an IP address: {ip!r}")
+        version, value = parsed
+        for shift, prefixes in self.tables[version]:
+            if value >> shift in prefixes:
+                return True
+        return False
+
+
+class RateLimiter:
+    """Per-client sliding-window counter (the same estimate SharedRateLimiter
+    uses across processes).
+
+    Each client keeps just a request count for the current and the previous
+    window. Clients are spread over independently locked shards, and every
+    shard keeps them in least-recently-seen order, so clients idle for more
+    than a window are dropped from the front as new ones arrive and the table
+    never holds more than max_clients.
+    """
+
+    def __init__(self, limit=RATE_LIMIT_MAX_REQUESTS, window=RATE_LIMIT_WINDOW,
+                 shards=RATE_LIMIT_SHARDS, max_clients=RATE_LIMIT_MAX_CLIENTS):
+        self.limit = limit
+        self.window = window
+        self.shards = [(threading.Lock(), OrderedDict()) for _ in range(shards)]
+        self.shard_capacity = max(1, max_clients // shards)
+
+    def is_allowed(self, ip):
+        now = time.time()
+        current = int(now // self.window)
+        lock, clients = self.shards[hash(ip) % len(self.shards)]
+        with lock:
+            slot = clients.get(ip)
+            if slot is None:
+                slot = clients[ip] = [current, 0, 0]  # window number, current count, previous count
+                self.evict(clients, current)
+            else:
+                clients.move_to_end(ip)
+                if slot[0] != current:
+                    slot[2] = slot[1] if slot[0] == current - 1 else 0
+                    slot[1] = 0
+                    slot[0] = current
+
+            elapsed = (now % self.window) / self.window
+            if slot[2] * (1 - elapsed) + slot[1] >= self.limit:
+                return False
+            slot[1] += 1
+            return True
+
+    def evict(self, clients, current):
+        # Clients unseen since before the previous window would start from zero anyway
+        while len(clients) > 1:
+            ip, slot = next(iter(clients.items()))
+            if slot[0] >= current - 1 and len(clients) <= self.shard_capacity:
+                break
+            del clients[ip]
+
+    def stats(self):
+        return {'clients': sum(len(clients) for _, clients in self.shards)}
@@ -0,0 +1,226 @@
+import atexit
+import datetime
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+from config import *
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Access and error logging off the request path.
+# Request threads (and the asyncio loop) only put records on a bounded
+# queue; a background thread writes them in batches, as JSON lines to
+# ACCESS_LOG_FILE and as the familiar one-line summaries to the console. A
+# slow terminal or disk can then only fill the queue, never stall a request;
+# once the queue is full, records are dropped and counted instead.
+#
+# The file is rotated past ACCESS_LOG_MAX_MB or every ACCESS_LOG_ROTATE_HOURS
+# (access.log -> access.log.1 -> ... -> access.log.<ACCESS_LOG_BACKUPS>).
+# Worker processes share the file: each batch is a single append, and the
+# process that rotates holds a lock file while it does; the others notice
+# the new file and reopen it.
+#
+# close() writes out whatever is still queued; it runs when serve() returns,
+# before a worker process exits, and at interpreter exit.
+
+BATCH_MAX = 512  # records per write
+STOP = object()  # queued by close()
+
+
+def timestamp(t):
+    return datetime.datetime.fromtimestamp(t, datetime.timezone.utc).isoformat(timespec='milliseconds')
+
+
+class AccessLog:
+    def __init__(self, path=ACCESS_LOG_FILE if ACCESS_LOG_ENABLED else None):
+        self.path = path
+        self.queue = None
+        self.thread = None
+        self.pid = None
+        self.start_lock = threading.Lock()
+        self.drop_lock = threading.Lock()
+        self.fd = None
+        self.size = 0
+        self.next_rotation = None
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0  # failed writes to the file
+        self.rotations = 0
+
+    def start(self):
+        # Started on first use, and again in each forked worker (threads don't survive a fork)
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = queue.Queue(ACCESS_LOG_QUEUE)
+            self.fd = None
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self.run, name='access-log', daemon=True)
+            self.thread.start()
+
+    def put(self, record, line, stream):
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait((record, line, stream))
+        except queue.Full:
+            with self.drop_lock:
+                self.dropped += 1
+
+    def close(self, timeout=5):
+        """Write out the queued records and stop the writer thread."""
+        with self.start_lock:
+            if self.pid != os.getpid():
+                return  # never started in this process (or already closed)
+            self.pid = None  # anything logged after this starts a new writer
+            thread, log_queue = self.thread, self.queue
+        try:
+            log_queue.put(STOP, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+
+    def request(self, client, requestline, method, target, code, seconds, bytes_out, bytes_in=0,
+                route=None, range_header=None, user_agent=None):
+        """Log one answered request."""
+        now = time.time()
+        record = None
+        if self.path is not None:
+            record = {
+                'ts': timestamp(now),
+                'client': client,
+                'method': method,
+                'path': target,
+                'status': code,
+                'bytes': bytes_out,
+                'duration_ms': round(seconds * 1000, 3),
+                'route': route,
+            }
+            if bytes_in:
+                record['bytes_in'] = bytes_in
+            if range_header:
+                record['range'] = range_header
+            if user_agent:
+                record['ua'] = user_agent
+        line = None
+        if ACCESS_LOG_CONSOLE:
+            line = '%s - - [%s] "%s" %s %s\n' % (client, time.strftime('%d/%b/%Y %H:%M:%S', time.localtime(now)),
+                                                 requestline, code, bytes_out or '-')
+        if record is not None or line is not None:
+            self.put(record, line, sys.stderr)
+
+    def message(self, text, level='error', stream=None):
+        """Log a message (an error, a refused client) in place of print()."""
+        record = {'ts': timestamp(time.time()), 'level': level, 'message': text} if self.path is not None else None
+        self.put(record, text + '\n', stream or sys.stdout)
+
+    # --- Writer thread ---
+
+    def run(self):
+        log_queue = self.queue
+        while True:
+            batch = [log_queue.get()]
+            try:
+                while len(batch) < BATCH_MAX:
+                    batch.append(log_queue.get_nowait())
+            except queue.Empty:
+                pass
+            stop = STOP in batch
+            self.write_batch([item for item in batch if item is not STOP])
+            if stop:
+                if self.fd is not None:
+                    os.close(self.fd)
+                    self.fd = None
+                return
+
+    def write_batch(self, batch):
+        records = [json.dumps(record, ensure_ascii=False) + '\n' for record, _, _ in batch if record is not None]
+        file_ok = not records or self.write_file(''.join(records).encode('utf-8', 'surrogateescape'))
+        console_ok = set()
+        for stream in {stream for _, line, stream in batch if line is not None}:
+            try:
+                stream.write(''.join(line for _, line, s in batch if line is not None and s is stream))
+                stream.flush()
+                console_ok.add(stream)
+            except (OSError, ValueError, AttributeError):
+                pass  # no console (pythonw) or it went away
+        # A record counts as written once it is in the file; console-only ones once printed
+        written = sum(1 for record, _, stream in batch
+                      if (file_ok if record is not None else stream in console_ok))
+        self.written += written
+        if written < len(batch):
+            with self.drop_lock:
+                self.dropped += len(batch) - written
+
+    def write_file(self, data):
+        try:
+            if self.fd is None:
+                self.open()
+            elif self.size >= ACCESS_LOG_MAX_MB * 1024 * 1024 or (
+                    self.next_rotation is not None and time.time() >= self.next_rotation):
+                self.rotate()
+            os.write(self.fd, data)
+            self.size += len(data)
+            return True
+        except OSError:
+            # Counted, and retried with a fresh open on the next batch (the disk may have filled up)
+            self.errors += 1
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+            return False
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.size = os.fstat(self.fd).st_size
+        if ACCESS_LOG_ROTATE_HOURS:
+            period = ACCESS_LOG_ROTATE_HOURS * 3600
+            self.next_rotation = (time.time() // period + 1) * period
+
+    def rotate(self):
+        lock_fd = os.open(self.path + '.lock', os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            try:
+                current = os.stat(self.path)
+            except FileNotFoundError:
+                current = None
+            # Another worker may have rotated already; then only reopen
+            if current is not None and current.st_ino == os.fstat(self.fd).st_ino:
+                for i in range(ACCESS_LOG_BACKUPS - 1, 0, -1):
+                    if os.path.exists(f"{self.path}.{i}"):
+                        os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+                if ACCESS_LOG_BACKUPS:
+                    os.replace(self.path, self.path + '.1')
+                else:
+                    os.remove(self.path)
+                self.rotations += 1
+            self.open()
+        finally:
+            os.close(lock_fd)
+
+    def stats(self):
+        return {
+            'file': self.path,
+            'queued': self.queue.qsize() if self.queue is not None else 0,
+            'written': self.written,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'rotations': self.rotations,
+        }
+
+
+access_log = AccessLog()
+atexit.register(access_log.close)
@@ -0,0 +1,211 @@
+import os
+import stat
+import struct
+import tarfile
+import time
+import zlib
+
+from config import *
+
+# Streaming .zip and .tar downloads of folders and selections (?download=).
+# Archives are produced on the fly as a sequence of pieces: bytes to send as
+# they are, or a FileSpan, an open file whose next `length` bytes the engine
+# sends itself (through sendfile where it can). Nothing is staged in temp
+# files, and the only state kept per member is what the zip central
+# directory needs at the end.
+#
+# Zip members are stored when already compressed (ARCHIVE_STORED_EXTS) and
+# deflated otherwise; sizes and CRCs follow each member in a data
+# descriptor, and zip64 records are used once a member, the archive or the
+# member count outgrows the classic format. Tar members are never
+# transformed, so their data always goes out as FileSpans.
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FLAGS = 0x08 | 0x800  # sizes in a data descriptor; UTF-8 names
+ZIP_VERSION = 45  # 4.5: zip64
+MADE_BY_UNIX = 3 << 8
+DEFLATED = 8
+STORED = 0
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+DESCRIPTOR = struct.Struct('<IIII')
+DESCRIPTOR64 = struct.Struct('<IIQQ')
+END_RECORD = struct.Struct('<IHHHHIIH')
+END_RECORD64 = struct.Struct('<IQHHIIQQQQ')
+END_LOCATOR64 = struct.Struct('<IIQI')
+
+FORMATS = {
+    # format: (content type, file extension)
+    'zip': ('application/zip', '.zip'),
+    'tar': ('application/x-tar', '.tar'),
+}
+
+
+class FileSpan:
+    """Send the next `length` bytes of `file`; if it has fewer by now (it
+    shrank since it was listed), pad with zeros so the archive stays whole."""
+    __slots__ = ('file', 'length')
+
+    def __init__(self, file, length):
+        self.file = file
+        self.length = length
+
+
+def iter_members(folder, names, prefix=''):
+    """(archive name, path, stat) for the selected names in folder and,
+    for folders, everything below them, parents before their contents.
+    Symlinked folders are included but not entered (they can loop)."""
+    stack = [(prefix + name, os.path.join(folder, name)) for name in sorted(names, reverse=True)]
+    while stack:
+        arcname, path = stack.pop()
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            yield arcname + '/', path, st
+            if os.path.islink(path):
+                continue
+            try:
+                with os.scandir(path) as it:
+                    children = sorted(entry.name for entry in it)
+            except OSError:
+                continue
+            stack.extend((f"{arcname}/{name}", os.path.join(path, name)) for name in reversed(children)
+                         if os.path.splitext(name)[1].lower() not in EXCLUDED_EXTENSIONS)
+        elif stat.S_ISREG(st.st_mode):
+            yield arcname, path, st
+
+
+def dos_datetime(mtime):
+    t = time.localtime(max(mtime, 315532800))  # zip can't go before 1980
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+def read_span(f, length):
+    # Member data as it is read, never more than the listed length
+    while length > 0:
+        data = f.read(min(ARCHIVE_READ_CHUNK, length))
+        if not data:
+            return
+        length -= len(data)
+        yield data
+
+
+def zip_pieces(members):
+    offset = 0
+    central = []  # (name, flags, method, time, date, crc, compressed, size, local offset, external attrs)
+    for arcname, path, st in members:
+        name = arcname.encode('utf-8', 'surrogateescape')
+        dos_time, dos_date = dos_datetime(st.st_mtime)
+        if arcname.endswith('/'):
+            header = LOCAL_HEADER.pack(0x04034b50, 20, 0x800, STORED, dos_time, dos_date, 0, 0, 0, len(name), 0)
+            yield header + name
+            central.append((name, 0x800, STORED, dos_time, dos_date, 0, 0, 0, offset, (0o40755 << 16) | 0x10))
+            offset += len(header) + len(name)
+            continue
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            continue
+        with f:
+            method = STORED if os.path.splitext(arcname)[1].lower() in ARCHIVE_STORED_EXTS else DEFLATED
+            zip64 = st.st_size * 1.05 > ZIP64_LIMIT
+            extra = struct.pack('<HHQQ', 1, 16, 0, 0) if zip64 else b''
+            header = LOCAL_HEADER.pack(0x04034b50, ZIP_VERSION if zip64 else 20, ZIP_FLAGS, method,
+                                       dos_time, dos_date, 0, ZIP64_LIMIT if zip64 else 0,
+                                       ZIP64_LIMIT if zip64 else 0, len(name), len(extra))
+            yield header + name + extra
+            local_offset = offset
+            offset += len(header) + len(name) + len(extra)
+
+            crc = size = compressed = 0
+            compressor = zlib.compressobj(ARCHIVE_ZIP_LEVEL, zlib.DEFLATED, -15) if method == DEFLATED else None
+            for data in read_span(f, st.st_size):
+                crc = zlib.crc32(data, crc)
+                size += len(data)
+                if compressor is not None:
+                    data = compressor.compress(data)
+                if data:
+                    compressed += len(data)
+                    yield data
+            if compressor is not None:
+                data = compressor.flush()
+                compressed += len(data)
+                yield data
+        descriptor = (DESCRIPTOR64.pack(0x08074b50, crc, compressed, size) if zip64
+                      else DESCRIPTOR.pack(0x08074b50, crc, compressed, size))
+        yield descriptor
+        offset += compressed + len(descriptor)
+        central.append((name, ZIP_FLAGS, method, dos_time, dos_date, crc, compressed, size, local_offset,
+                        0o100644 << 16))
+
+    # Central directory, with zip64 extras for whatever outgrew 32 bits
+    cd_offset = offset
+    for name, flags, method, dos_time, dos_date, crc, compressed, size, local_offset, attrs in central:
+        big = [value for value in (size, compressed, local_offset) if value >= ZIP64_LIMIT]
+        extra = struct.pack(f'<HH{len(big)}Q', 1, 8 * len(big), *big) if big else b''
+        header = CENTRAL_HEADER.pack(
+            0x02014b50, MADE_BY_UNIX | ZIP_VERSION, ZIP_VERSION if big else 20, flags, method, dos_time, dos_date,
+            crc, min(compressed, ZIP64_LIMIT), min(size, ZIP64_LIMIT), len(name), len(extra), 0, 0, 0, attrs,
+            min(local_offset, ZIP64_LIMIT))
+        yield header + name + extra
+        offset += len(header) + len(name) + len(extra)
+    cd_size = offset - cd_offset
+    count = len(central)
+
+    end = b''
+    if count >= 0xFFFF or cd_size >= ZIP64_LIMIT or cd_offset >= ZIP64_LIMIT:
+        end += END_RECORD64.pack(0x06064b50, END_RECORD64.size - 12, MADE_BY_UNIX | ZIP_VERSION, ZIP_VERSION,
+                                 0, 0, count, count, cd_size, cd_offset)
+        end += END_LOCATOR64.pack(0x07064b50, 0, offset, 1)
+    end += END_RECORD.pack(0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                           min(cd_size, ZIP64_LIMIT), min(cd_offset, ZIP64_LIMIT), 0)
+    yield end
+
+
+def tar_pieces(members):
+    for arcname, path, st in members:
+        info = tarfile.TarInfo(arcname.rstrip('/'))
+        info.mtime = int(st.st_mtime)
+        if arcname.endswith('/'):
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            yield info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+            continue
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            continue
+        with f:
+            info.size = st.st_size
+            info.mode = 0o644
+            yield info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+            if st.st_size:
+                yield FileSpan(f, st.st_size)
+        if st.st_size % tarfile.BLOCKSIZE:
+            yield bytes(tarfile.BLOCKSIZE - st.st_size % tarfile.BLOCKSIZE)
+    yield bytes(2 * tarfile.BLOCKSIZE)
+
+
+def archive_pieces(fmt, members):
+    """The archive as pieces, with runs of small byte strings joined into
+    blocks of at least ARCHIVE_READ_CHUNK so each becomes one write."""
+    pending = []
+    pending_size = 0
+    for piece in (zip_pieces if fmt == 'zip' else tar_pieces)(members):
+        if isinstance(piece, FileSpan):
+            if pending:
+                yield b''.join(pending)
+                pending, pending_size = [], 0
+            yield piece
+            continue
+        pending.append(piece)
+        pending_size += len(piece)
+        if pending_size >= ARCHIVE_READ_CHUNK:
+            yield b''.join(pending)
+            pending, pending_size = [], 0
+    if pending:
+        yield b''.join(pending)
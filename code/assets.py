@@ -0,0 +1,932 @@
+import hashlib
+
+import compression
+
+# Stylesheet and script for the listing page.
+# They are served from memory under /__static/ at URLs that contain a hash of
+# their content, so browsers may cache them forever ("immutable"): any edit
+# here changes the URL the listing page references. Compressed copies are
+# made once at import.
+
+
+class StaticAsset:
+    def __init__(self, name, content_type, text):
+        self.content_type = content_type
+        self.body = text.encode('utf-8')
+        digest = hashlib.sha256(self.body).hexdigest()[:16]
+        stem, _, ext = name.rpartition('.')
+        self.url = f"/__static/{stem}.{digest}.{ext}"
+        self.etag = f'"{digest}"'
+        self.encoded = {encoding: compression.compress(self.body, encoding)
+                        for encoding in compression.available_encodings()}
+
+
+LISTING_CSS_TEXT = """
+:root { 
+    --bg: #121212; 
+    --card: rgba(30, 30, 30, 0.7); 
+    --text: #e0e0e0; 
+    --accent: #bb86fc; 
+    --hover: rgba(44, 44, 44, 0.6); 
+    --glass-border: rgba(255, 255, 255, 0.1);
+}
+body { 
+    font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif; 
+    background: var(--bg); 
+    color: var(--text); 
+    margin: 0; 
+    padding: 20px;
+    background: linear-gradient(135deg, #0f0f0f 0%, #1a1a1a 100%);
+    min-height: 100vh;
+}
+.header { display: flex; justify-content: space-between; align-items: center; margin-bottom: 20px; flex-wrap: wrap; }
+h1 { font-size: 1.5rem; color: var(--accent); margin: 0; }
+
+.breadcrumb { font-size: 14px; color: #888; margin: 10px 0; display: flex; align-items: center; gap: 5px;}
+.breadcrumb a { color: var(--accent); text-decoration: none; }
+.breadcrumb a:hover { text-decoration: underline; }
+.breadcrumb span { color: #666; cursor: default; }
+.breadcrumb-sep { color: #444; }
+
+.controls { display: flex; justify-content: space-between; align-items: center; margin-bottom: 20px; flex-wrap: wrap; gap: 10px; }
+input#search { padding: 10px; font-size: 14px; border-radius: 12px; border: none; background: rgba(255, 255, 255, 0.1); color: white; width: 250px; box-sizing: border-box; outline: none; border: 1px solid var(--glass-border); backdrop-filter: blur(10px); }
+input#search:focus { border-color: var(--accent); background: rgba(255, 255, 255, 0.15); }
+.sort-dropdown { position: relative; display: inline-block; }
+.sort-btn { background: rgba(255, 255, 255, 0.1); color: var(--text); border: 1px solid var(--glass-border); padding: 10px 15px; border-radius: 12px; cursor: pointer; backdrop-filter: blur(10px); }
+.sort-content { display: none; position: absolute; background: rgba(30, 30, 30, 0.9); min-width: 160px; box-shadow: 0 8px 32px rgba(0,0,0,0.3); z-index: 1; border-radius: 12px; border: 1px solid var(--glass-border); backdrop-filter: blur(20px); }
+.sort-content a { color: var(--text); padding: 12px 16px; text-decoration: none; display: block; }
+.sort-content a:hover { background: var(--hover); }
+.sort-dropdown:hover .sort-content { display: block; }
+.view-toggle { display: flex; background: rgba(255, 255, 255, 0.1); border-radius: 12px; padding: 4px; border: 1px solid var(--glass-border); backdrop-filter: blur(10px); }
+.view-btn { background: transparent; border: none; padding: 6px 12px; border-radius: 8px; cursor: pointer; color: var(--text); font-size: 16px; }
+.view-btn.active { background: var(--accent); color: black; }
+.upload-btn { background: var(--accent); color: black; border: none; padding: 10px 15px; border-radius: 12px; cursor: pointer; font-weight: 600; text-decoration: none; display: inline-block; }
+.grid { display: grid; grid-template-columns: repeat(auto-fill, minmax(120px, 1fr)); gap: 20px; }
+.list { display: flex; flex-direction: column; gap: 8px; }
+.list .item { flex-direction: row; text-align: left; padding: 12px 16px; border-radius: 12px; }
+.list .file-icon { margin-bottom: 0; margin-right: 15px; }
+.list .info { text-align: left; flex: 1; }
+.list .name { font-size: 14px; }
+.item { display: flex; flex-direction: column; align-items: center; cursor: pointer; color: var(--text); text-decoration: none; padding: 15px; border-radius: 16px; transition: all 0.3s ease; background: var(--card); border: 1px solid var(--glass-border); backdrop-filter: blur(20px); box-shadow: 0 4px 20px rgba(0, 0, 0, 0.2); }
+.item:hover { background: var(--hover); transform: translateY(-2px); box-shadow: 0 8px 30px rgba(0, 0, 0, 0.3); }
+.file-icon { width: 64px; height: 80px; border-radius: 8px; display: flex; align-items: center; justify-content: center; font-size: 12px; font-weight: 900; color: white; text-transform: uppercase; margin-bottom: 8px; position: relative; box-shadow: 0 4px 15px rgba(0,0,0,0.3); backdrop-filter: blur(10px); }
+.file-icon .thumb { position: absolute; inset: 0; width: 100%; height: 100%; object-fit: cover; border-radius: 8px; z-index: 1; background: #1e1e1e; }
+.file-icon::after { content: ''; position: absolute; top: 0; right: 0; border-bottom: 16px solid rgba(0,0,0,0.2); border-left: 16px solid rgba(0,0,0,0.2); border-top: 16px solid transparent; border-right: 16px solid transparent; width: 0; height: 0; }
+.icon-red { background: linear-gradient(135deg, #e53935, #b71c1c); }
+.icon-blue { background: linear-gradient(135deg, #1e88e5, #0d47a1); }
+.icon-green { background: linear-gradient(135deg, #43a047, #1b5e20); }
+.icon-yellow { background: linear-gradient(135deg, #fdd835, #f9a825); color: #212121; }
+.icon-purple { background: linear-gradient(135deg, #8e24aa, #4a148c); }
+.icon-teal { background: linear-gradient(135deg, #00acc1, #006064); }
+.icon-gray { background: linear-gradient(135deg, #757575, #424242); }
+.icon-orange { background: linear-gradient(135deg, #fb8c00, #e65100); }
+.icon-python { background: linear-gradient(135deg, #3776ab 40%, #ffd343 100%); }
+.icon-folder { width: 80px; height: 64px; background: linear-gradient(135deg, #ffa000, #ff6f00); border-radius: 8px; color: rgba(255,255,255,0.8); }
+.icon-folder::after { display: none; }
+.icon-folder::before { content: ''; position: absolute; top: -8px; left: 0; width: 25px; height: 10px; background: #ffa000; border-radius: 6px 6px 0 0; }
+.info { display: flex; flex-direction: column; text-align: center; width: 100%; }
+.name { font-weight: 500; font-size: 12px; word-break: break-word; margin-top: 5px; line-height: 1.3; }
+.meta { font-size: 10px; color: #888; margin-top: 2px; }
+.modal-overlay { display: none; position: fixed; top: 0; left: 0; width: 100%; height: 100%; background: rgba(0,0,0,0.8); z-index: 1000; justify-content: center; align-items: center; backdrop-filter: blur(5px); }
+.modal { background: rgba(30, 30, 30, 0.9); padding: 24px; border-radius: 20px; width: 600px; max-width: 95%; text-align: center; border: 1px solid var(--glass-border); box-shadow: 0 20px 40px rgba(0,0,0,0.5); transform: scale(0.95); transition: transform 0.3s ease; backdrop-filter: blur(20px); max-height: 95vh; overflow-y: auto; }
+.modal.active { transform: scale(1); }
+.modal h3 { margin-top: 0; color: white; margin-bottom: 8px; word-break: break-all; }
+.modal p { color: #888; font-size: 0.9rem; margin-bottom: 20px; }
+.media-player { margin: 15px 0; border-radius: 12px; overflow: hidden; position: relative; }
+.media-player video, .media-player audio { width: 100%; border-radius: 8px; outline: none; background: #000; max-height: 60vh; }
+.media-player img { max-width: 100%; max-height: 300px; border-radius: 8px; }
+.modal::-webkit-scrollbar { width: 8px; }
+.modal::-webkit-scrollbar-track { background: rgba(0,0,0,0.1); }
+.modal::-webkit-scrollbar-thumb { background: rgba(255,255,255,0.2); border-radius: 4px; }
+.btn { display: block; width: 100%; padding: 14px; margin: 8px 0; border: none; border-radius: 12px; font-size: 16px; cursor: pointer; text-decoration: none; box-sizing: border-box; font-weight: 600; transition: all 0.2s ease; backdrop-filter: blur(10px); }
+.btn:active { transform: scale(0.98); }
+.btn-download { background: var(--accent); color: black; }
+.btn-preview { background: rgba(255, 255, 255, 0.1); color: white; border: 1px solid var(--glass-border); }
+.btn-preview:hover { background: rgba(255, 255, 255, 0.2); }
+.upload-btn:disabled { opacity: 0.5; cursor: default; }
+.btn-cancel { background: transparent; color: #777; font-size: 14px; margin-top: 0px; padding: 10px; }
+.btn-cancel:hover { color: #aaa; }
+.hidden { display: none !important; }
+.selection-bar { position: sticky; top: 10px; z-index: 5; display: flex; gap: 10px; align-items: center; padding: 10px 15px; margin-bottom: 15px; border-radius: 16px; background: rgba(30, 30, 30, 0.9); border: 1px solid var(--glass-border); backdrop-filter: blur(20px); }
+.selection-bar span { flex: 1; }
+.selecting .item.selected { background: var(--hover); outline: 2px solid var(--accent); }
+.search-results { margin-bottom: 20px; padding: 12px 16px; border-radius: 16px; background: var(--card); border: 1px solid var(--glass-border); backdrop-filter: blur(20px); }
+.search-results-title { font-size: 12px; color: #888; margin-bottom: 8px; }
+.search-result { display: flex; justify-content: space-between; gap: 10px; padding: 6px 8px; border-radius: 8px; color: var(--text); text-decoration: none; font-size: 14px; }
+.search-result:hover { background: var(--hover); }
+.search-result .meta { font-size: 12px; margin: 0; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }
+.virtual .item { height: 150px; box-sizing: border-box; overflow: hidden; }
+.list.virtual .item { height: 64px; }
+.virtual .vspacer { grid-column: 1 / -1; }
+
+/* Subtitle Select Style */
+.sub-control { margin: 10px 0; text-align: left; background: rgba(0,0,0,0.2); padding: 8px; border-radius: 8px; }
+.sub-control label { color: #aaa; font-size: 12px; margin-right: 10px; }
+.sub-control select { background: rgba(255,255,255,0.1); color: white; border: 1px solid rgba(255,255,255,0.2); border-radius: 4px; padding: 4px; outline: none; width: 100%; margin-top: 5px; }
+
+.upload-form { background: rgba(30, 30, 30, 0.8); padding: 20px; border-radius: 16px; margin: 20px 0; border: 1px solid var(--glass-border); backdrop-filter: blur(20px); }
+.upload-form h3 { margin-top: 0; color: var(--accent); }
+.drop-zone { border: 2px dashed var(--glass-border); border-radius: 12px; padding: 40px; text-align: center; transition: all 0.3s ease; background: rgba(255, 255, 255, 0.05); cursor: pointer; }
+.drop-zone:hover, .drop-zone.dragover { border-color: var(--accent); background: rgba(255, 255, 255, 0.08); }
+.drop-zone.dragover { background: rgba(187, 134, 252, 0.1); }
+.drop-icon { font-size: 48px; margin-bottom: 16px; color: var(--accent); }
+.drop-text { font-size: 16px; margin-bottom: 8px; }
+.drop-hint { font-size: 12px; color: #888; }
+.file-input { display: none; }
+.upload-progress { margin-top: 20px; }
+.progress-bar { width: 100%; height: 6px; background: rgba(255, 255, 255, 0.1); border-radius: 3px; overflow: hidden; margin-bottom: 10px; }
+.progress-fill { height: 100%; background: var(--accent); width: 0%; transition: width 0.3s ease; }
+.progress-text { font-size: 12px; color: #888; text-align: center; }
+.file-list { margin-top: 15px; text-align: left; }
+.file-item { display: flex; justify-content: space-between; align-items: center; padding: 8px 12px; background: rgba(255, 255, 255, 0.05); border-radius: 8px; margin-bottom: 8px; font-size: 14px; }
+.file-name { flex: 1; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }
+.file-size { color: #888; font-size: 12px; margin-left: 10px; }
+.upload-status { margin-left: 10px; font-size: 12px; }
+.status-uploading { color: var(--accent); }
+.status-success { color: #4CAF50; }
+.status-error { color: #f44336; }
+"""
+
+LISTING_JS_TEXT = """
+function stopMediaPlayback() {
+    var mediaPlayer = document.getElementById('media-player');
+    var video = mediaPlayer.querySelector('video');
+    var audio = mediaPlayer.querySelector('audio');
+    if (video) { video.pause(); }
+    if (audio) { audio.pause(); }
+}
+function toggleView(viewType, event) {
+    const container = document.getElementById('file-container');
+    const buttons = document.querySelectorAll('.view-btn');
+    if (event) {
+        buttons.forEach(btn => btn.classList.remove('active'));
+        event.currentTarget.classList.add('active');
+    }
+    if (viewType === 'list') {
+        container.classList.remove('grid');
+        container.classList.add('list');
+        localStorage.setItem('viewPreference', 'list');
+    } else {
+        container.classList.remove('list');
+        container.classList.add('grid');
+        localStorage.setItem('viewPreference', 'grid');
+    }
+    if (vlist) { vlist.rowHeight = 0; scheduleVirtualRender(); }
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    const savedView = localStorage.getItem('viewPreference') || 'grid';
+    const container = document.getElementById('file-container');
+    const btnGrid = document.querySelector('.view-btn[title="Grid View"]');
+    const btnList = document.querySelector('.view-btn[title="List View"]');
+    if (savedView === 'list') {
+        if (btnList) btnList.classList.add('active');
+        container.classList.remove('grid');
+        container.classList.add('list');
+    } else {
+        if (btnGrid) btnGrid.classList.add('active');
+        container.classList.remove('list');
+        container.classList.add('grid');
+    }
+    initVirtualList();
+    if (LIVE_UPDATES && window.EventSource) startLiveUpdates();
+});
+
+function filterFiles() {
+    var input = document.getElementById('search');
+    var filter = input.value.toLowerCase();
+    scheduleTreeSearch(filter);
+    if (vlist) {
+        // Virtual grid: filter on the server instead of hiding nodes
+        clearTimeout(vlist.searchTimer);
+        vlist.searchTimer = setTimeout(() => resetVirtualList(filter), 250);
+        return;
+    }
+    var container = document.getElementById('file-container');
+    var items = container.children;
+    for (var i = 0; i < items.length; i++) {
+        var name = items[i].getAttribute('data-name');
+        if (name.indexOf(filter) > -1) {
+            items[i].style.display = "";
+        } else {
+            items[i].style.display = "none";
+        }
+    }
+}
+
+// --- Search below the current folder ---
+// The grid only holds this folder; matches further down the tree come from
+// the server's /__search index and are listed in a panel above the grid.
+let treeSearchTimer = null;
+let treeSearchGeneration = 0;
+
+function scheduleTreeSearch(query) {
+    const panel = document.getElementById('search-results');
+    if (!panel) return;
+    clearTimeout(treeSearchTimer);
+    treeSearchGeneration++;
+    if (query.trim().length < 2) {
+        panel.classList.add('hidden');
+        panel.innerHTML = '';
+        return;
+    }
+    treeSearchTimer = setTimeout(() => runTreeSearch(panel, query), 250);
+}
+
+async function runTreeSearch(panel, query) {
+    const generation = ++treeSearchGeneration;
+    const here = decodeURIComponent(location.pathname);
+    const params = new URLSearchParams({ q: query, path: here, limit: 50 });
+    let data;
+    try {
+        const response = await fetch('/__search?' + params);
+        if (!response.ok) return;
+        data = await response.json();
+    } catch (e) {
+        return;
+    }
+    if (generation !== treeSearchGeneration) return;
+    // Matches in this folder are already shown by the grid filter
+    const results = data.results.filter(r => r.folder !== here);
+    if (!results.length) {
+        panel.classList.add('hidden');
+        return;
+    }
+    let note = data.truncated ? ` (best ${data.total} matches)` : '';
+    if (data.indexing) note += ' · still indexing';
+    let html = `<div class="search-results-title">In subfolders${note}</div>`;
+    for (const r of results) {
+        const meta = r.is_dir ? r.folder : `${r.folder} · ${r.size_str}`;
+        html += `<a class="search-result" href="${r.url}"><span>${r.is_dir ? '📁 ' : ''}${escapeHtml(r.name)}</span>` +
+            `<span class="meta">${escapeHtml(meta)}</span></a>`;
+    }
+    panel.innerHTML = html;
+    panel.classList.remove('hidden');
+}
+
+// --- Virtual grid for large folders ---
+// Only the rows around the viewport are in the DOM; further entries are
+// fetched page by page from ?format=json as the user scrolls.
+let vlist = null;
+let vRenderPending = false;
+
+function escapeHtml(s) {
+    return String(s).replace(/[&<>"']/g, c => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c]));
+}
+
+function initVirtualList() {
+    const stateEl = document.getElementById('listing-state');
+    if (!stateEl) return;
+    const state = JSON.parse(stateEl.textContent);
+    const container = document.getElementById('file-container');
+    vlist = {
+        container: container,
+        entries: state.entries,
+        total: state.total,
+        cursor: state.next_cursor,
+        sort: state.sort,
+        query: '',
+        loading: false,
+        failed: false,
+        generation: 0,
+        rowHeight: 0,
+        searchTimer: null
+    };
+    container.classList.add('virtual');
+    container.addEventListener('click', (e) => {
+        const el = e.target.closest('[data-index]');
+        if (!el) return;
+        const entry = vlist.entries[Number(el.dataset.index)];
+        const subUrl = entry.subtitle ? encodeURIComponent(entry.subtitle) : null;
+        showModal(entry.url, entry.name, entry.can_preview, entry.media_type, subUrl);
+    });
+    window.addEventListener('scroll', scheduleVirtualRender, { passive: true });
+    window.addEventListener('resize', () => { vlist.rowHeight = 0; scheduleVirtualRender(); });
+    renderVirtualList();
+}
+
+function scheduleVirtualRender() {
+    if (!vlist || vRenderPending) return;
+    vRenderPending = true;
+    requestAnimationFrame(renderVirtualList);
+}
+
+function thumbUrl(url, width) {
+    return '/__thumb' + location.pathname + url + '?w=' + width;
+}
+
+function entryHtml(entry, index) {
+    const thumb = entry.thumb && THUMBS ?
+        `<img class="thumb" loading="lazy" alt="" onerror="this.remove()" src="${thumbUrl(entry.url, THUMBS.grid)}&v=${Math.floor(entry.mtime)}">` : '';
+    const icon = `<div class="file-icon ${entry.icon_class}">${escapeHtml(entry.icon_text)}${thumb}</div>`;
+    const name = escapeHtml(entry.name);
+    const cls = selectedNames.has(entry.name) ? 'item selected' : 'item';
+    if (entry.is_dir) {
+        return `<a href="${entry.url}" class="${cls}" data-name="${name.toLowerCase()}">${icon}` +
+            `<div class="info"><span class="name">${name}</span><span class="meta">${entry.type_desc}</span>` +
+            `<span class="meta">${entry.date_str}</span></div></a>`;
+    }
+    return `<div class="${cls}" data-index="${index}" data-name="${name.toLowerCase()}">${icon}` +
+        `<div class="info"><span class="name">${name}</span>` +
+        `<span class="meta">${entry.size_str} • ${escapeHtml(entry.type_desc)}</span>` +
+        `<span class="meta">${entry.date_str}</span></div></div>`;
+}
+
+function renderVirtualList() {
+    vRenderPending = false;
+    const c = vlist.container;
+    const style = getComputedStyle(c);
+    const gap = parseFloat(style.rowGap) || 0;
+    const cols = c.classList.contains('list') ? 1 : Math.max(1, style.gridTemplateColumns.split(' ').length);
+
+    if (!vlist.rowHeight && vlist.entries.length) {
+        c.innerHTML = entryHtml(vlist.entries[0], 0);
+        vlist.rowHeight = c.firstElementChild.getBoundingClientRect().height;
+    }
+    const rowH = (vlist.rowHeight || 150) + gap;
+    const top = c.getBoundingClientRect().top + window.scrollY;
+    const firstRow = Math.max(0, Math.floor((window.scrollY - top) / rowH) - 2);
+    const totalRows = Math.ceil(vlist.total / cols);
+    const lastRow = Math.min(totalRows, firstRow + Math.ceil(window.innerHeight / rowH) + 4);
+    const start = firstRow * cols;
+    const end = Math.min(vlist.total, lastRow * cols);
+
+    let html = '';
+    if (firstRow > 0) html += `<div class="vspacer" style="height:${firstRow * rowH - gap}px"></div>`;
+    for (let i = start; i < Math.min(end, vlist.entries.length); i++) {
+        html += entryHtml(vlist.entries[i], i);
+    }
+    if (lastRow < totalRows) html += `<div class="vspacer" style="height:${(totalRows - lastRow) * rowH - gap}px"></div>`;
+    c.innerHTML = html;
+
+    if (end > vlist.entries.length) loadMoreEntries();
+}
+
+async function loadMoreEntries() {
+    if (vlist.loading || vlist.failed || vlist.cursor === null) return;
+    vlist.loading = true;
+    const generation = vlist.generation;
+    const params = new URLSearchParams({ format: 'json', sort: vlist.sort, cursor: vlist.cursor });
+    if (vlist.query) params.set('q', vlist.query);
+    try {
+        const response = await fetch(window.location.pathname + '?' + params.toString());
+        if (!response.ok) throw new Error(response.status);
+        const page = await response.json();
+        if (generation !== vlist.generation) return;
+        vlist.entries.push(...page.entries);
+        vlist.total = page.total;
+        vlist.cursor = page.next_cursor;
+    } catch (e) {
+        console.error("Listing fetch failed", e);
+        vlist.failed = true;
+    } finally {
+        if (generation === vlist.generation) {
+            vlist.loading = false;
+            scheduleVirtualRender();
+        }
+    }
+}
+
+function resetVirtualList(query) {
+    vlist.generation++;
+    vlist.query = query;
+    vlist.entries = [];
+    vlist.total = 0;
+    vlist.cursor = '0';
+    vlist.loading = false;
+    vlist.failed = false;
+    vlist.container.innerHTML = '';
+    loadMoreEntries();
+}
+
+// --- Live updates ---
+// The server pushes changes to this folder over /__events; the grid is
+// patched in place instead of reloading the page.
+let liveSource = null;
+let liveEntries = [];  // entries of items added by live updates (non-virtual grid)
+let liveResetTimer = null;
+
+function startLiveUpdates() {
+    liveSource = new EventSource('/__events?' + new URLSearchParams({ dir: decodeURIComponent(location.pathname) }));
+    liveSource.addEventListener('change', (e) => applyChange(JSON.parse(e.data)));
+    liveSource.addEventListener('reload', () => {
+        if (vlist) resetVirtualList(vlist.query);
+        else location.reload();
+    });
+    if (!vlist) {
+        document.getElementById('file-container').addEventListener('click', (e) => {
+            const el = e.target.closest('[data-index]');
+            if (el) openEntry(liveEntries[Number(el.dataset.index)]);
+        });
+    }
+}
+
+function openEntry(entry) {
+    const subUrl = entry.subtitle ? encodeURIComponent(entry.subtitle) : null;
+    showModal(entry.url, entry.name, entry.can_preview, entry.media_type, subUrl);
+}
+
+function isSubtitle(name) {
+    const lower = name.toLowerCase();
+    return lower.endsWith('.srt') || lower.endsWith('.vtt');
+}
+
+function applyChange(change) {
+    for (const name of change.removed) {
+        const i = SUBTITLES.indexOf(name);
+        if (i > -1) SUBTITLES.splice(i, 1);
+    }
+    for (const entry of change.upserted) {
+        if (!entry.is_dir && isSubtitle(entry.name) && !SUBTITLES.includes(entry.name)) SUBTITLES.push(entry.name);
+    }
+    if (vlist) {
+        // Entries are paged in from the server; fetch them again, once per burst
+        clearTimeout(liveResetTimer);
+        liveResetTimer = setTimeout(() => resetVirtualList(vlist.query), 300);
+        return;
+    }
+    const container = document.getElementById('file-container');
+    const template = document.createElement('template');
+    for (const name of change.removed) {
+        const el = findItem(container, name);
+        if (el) el.remove();
+    }
+    for (const entry of change.upserted) {
+        liveEntries.push(entry);
+        template.innerHTML = entryHtml(entry, liveEntries.length - 1);
+        const fresh = template.content.firstElementChild;
+        const old = findItem(container, entry.name);
+        if (old) old.replaceWith(fresh);
+        else insertSorted(container, fresh, entry.name);
+        const filter = document.getElementById('search').value.toLowerCase();
+        if (fresh.getAttribute('data-name').indexOf(filter) === -1) fresh.style.display = 'none';
+    }
+}
+
+function findItem(container, name) {
+    const lower = name.toLowerCase();
+    for (const el of container.children) {
+        if (el.getAttribute('data-name') === lower && el.querySelector('.name').textContent === name) return el;
+    }
+    return null;
+}
+
+function insertSorted(container, el, name) {
+    const sort = new URLSearchParams(location.search).get('sort') || 'name';
+    if (sort === 'date') {
+        container.prepend(el);
+        return;
+    }
+    if (sort === 'name') {
+        const lower = name.toLowerCase();
+        for (const other of container.children) {
+            if (other.querySelector('.name').textContent.toLowerCase() > lower) {
+                container.insertBefore(el, other);
+                return;
+            }
+        }
+    }
+    container.appendChild(el);
+}
+
+// The server converts .srt to WebVTT (and caches it), so a plain track src does
+function subtitleUrl(name) {
+    return '/__vtt' + location.pathname + encodeURIComponent(name);
+}
+
+function changeSubtitle(name) {
+    const video = document.querySelector('video');
+    if(!video) return;
+
+    let track = document.getElementById('dynamic-sub-track');
+
+    if (!name) {
+        // User selected None
+        if(track) track.remove();
+        return;
+    }
+
+    // If track doesn't exist, create it
+    if (!track) {
+        track = document.createElement('track');
+        track.id = 'dynamic-sub-track';
+        track.kind = 'subtitles';
+        track.label = 'English';
+        track.srclang = 'en';
+        track.default = true;
+        video.appendChild(track);
+    }
+
+    track.src = subtitleUrl(name);
+    // Force update
+    track.mode = 'hidden';
+    track.mode = 'showing';
+}
+
+// --- FIX: Updated showModal to handle all subtitles ---
+async function showModal(url, filename, canPreview, mediaType, subtitle) {
+    var overlay = document.getElementById('modal-overlay');
+    var title = document.getElementById('modal-title');
+    var btnPreview = document.getElementById('btn-preview');
+    var btnDownload = document.getElementById('btn-download');
+    var mediaPlayer = document.getElementById('media-player');
+    var description = document.getElementById('modal-description');
+    var subControl = document.getElementById('sub-control');
+    var subSelect = document.getElementById('sub-select');
+    
+    title.innerText = filename;
+    btnDownload.href = url;
+    btnDownload.setAttribute('download', filename);
+    
+    if (canPreview) {
+        btnPreview.href = url;
+        btnPreview.classList.remove('hidden');
+    } else {
+        btnPreview.classList.add('hidden');
+    }
+    
+    mediaPlayer.innerHTML = '';
+    mediaPlayer.classList.add('hidden');
+    subControl.classList.add('hidden');
+    description.classList.remove('hidden');
+    
+    if (mediaType) {
+        description.classList.add('hidden');
+        mediaPlayer.classList.remove('hidden');
+        
+        if (mediaType === 'video') {
+            let videoHtml = `<video controls autoplay style="width:100%"><source src="${url}" type="video/mp4">`;
+            videoHtml += `<track id="dynamic-sub-track" label="English" kind="subtitles" srclang="en" default>`;
+            videoHtml += `Your browser does not support the video tag.</video>`;
+            mediaPlayer.innerHTML = videoHtml;
+
+            // --- Populate Subtitle Dropdown ---
+            subControl.classList.remove('hidden');
+            subSelect.innerHTML = '<option value="">None</option>';
+            
+            try {
+                // subtitle arrives URL-encoded, like url
+                const subtitleName = subtitle ? decodeURIComponent(subtitle) : null;
+                const allSubs = SUBTITLES || [];
+                let foundMatch = false;
+
+                allSubs.forEach(sub => {
+                    const option = document.createElement('option');
+                    option.value = sub;
+                    option.text = sub;
+                    
+                    // Logic: If a subtitle (matching name) exists, select it.
+                    // Otherwise, default to None.
+                    if (subtitleName && sub === subtitleName) {
+                        option.selected = true;
+                        foundMatch = true;
+                    }
+                    subSelect.appendChild(option);
+                });
+
+                if (foundMatch) {
+                    changeSubtitle(subtitleName);
+                } else {
+                    // Default to none, remove track initially
+                    const track = document.getElementById('dynamic-sub-track');
+                    if(track) track.remove();
+                }
+
+            } catch(e) {
+                console.error("Error parsing subs", e);
+            }
+
+        } else if (mediaType === 'audio') {
+            mediaPlayer.innerHTML = `<audio controls autoplay><source src="${url}" type="audio/mpeg">Your browser does not support the audio tag.</audio>`;
+        } else if (mediaType === 'image') {
+            // Screen-sized rendition first; the original is one click away via Preview
+            const src = THUMBS ? thumbUrl(url, THUMBS.preview) : url;
+            mediaPlayer.innerHTML = `<img src="${src}" alt="${escapeHtml(filename)}">`;
+            mediaPlayer.querySelector('img').onerror = function() { this.onerror = null; this.src = url; };
+        }
+    }
+    
+    overlay.style.display = 'flex';
+    setTimeout(() => overlay.querySelector('.modal').classList.add('active'), 10);
+}
+
+function closeModal(e) {
+    if (e === null || e.target.id === 'modal-overlay') {
+        var overlay = document.getElementById('modal-overlay');
+        var mediaPlayer = document.getElementById('media-player');
+        
+        var video = mediaPlayer.querySelector('video');
+        var audio = mediaPlayer.querySelector('audio');
+        if (video) {
+            video.pause();
+            video.currentTime = 0;
+        }
+        if (audio) {
+            audio.pause();
+            audio.currentTime = 0;
+        }
+        
+        overlay.querySelector('.modal').classList.remove('active');
+        setTimeout(() => overlay.style.display = 'none', 200);
+    }
+}
+
+// Upload functionality
+let selectedFiles = [];
+function showUploadForm() { document.getElementById('upload-form').style.display = 'block'; }
+function hideUploadForm() { document.getElementById('upload-form').style.display = 'none'; resetUploadForm(); }
+function resetUploadForm() {
+    selectedFiles = [];
+    document.getElementById('file-list').innerHTML = '';
+    document.getElementById('upload-progress').style.display = 'none';
+    document.getElementById('progress-fill').style.width = '0%';
+    document.getElementById('progress-text').textContent = '0%';
+    document.getElementById('file-input').value = '';
+}
+
+const dropZone = document.getElementById('drop-zone');
+const fileInput = document.getElementById('file-input');
+dropZone.addEventListener('click', () => { fileInput.click(); });
+fileInput.addEventListener('change', (e) => { handleFiles(e.target.files); });
+['dragenter', 'dragover', 'dragleave', 'drop'].forEach(eventName => {
+    dropZone.addEventListener(eventName, preventDefaults, false);
+});
+function preventDefaults(e) { e.preventDefault(); e.stopPropagation(); }
+['dragenter', 'dragover'].forEach(eventName => { dropZone.addEventListener(eventName, highlight, false); });
+['dragleave', 'drop'].forEach(eventName => { dropZone.addEventListener(eventName, unhighlight, false); });
+function highlight() { dropZone.classList.add('dragover'); }
+function unhighlight() { dropZone.classList.remove('dragover'); }
+dropZone.addEventListener('drop', (e) => {
+    const dt = e.dataTransfer;
+    const files = dt.files;
+    handleFiles(files);
+});
+function handleFiles(files) {
+    for (let i = 0; i < files.length; i++) {
+        const file = files[i];
+        if (!selectedFiles.some(f => f.name === file.name && f.size === file.size)) {
+            selectedFiles.push(file);
+        }
+    }
+    updateFileList();
+}
+function updateFileList() {
+    const fileList = document.getElementById('file-list');
+    fileList.innerHTML = '';
+    selectedFiles.forEach((file, index) => {
+        const fileItem = document.createElement('div');
+        fileItem.className = 'file-item';
+        fileItem.innerHTML = `
+            <div class="file-name">${file.name}</div>
+            <div class="file-size">${formatFileSize(file.size)}</div>
+            <div class="upload-status status-uploading" id="status-${index}"></div>
+            <button onclick="removeFile(${index})" style="background: none; border: none; color: #f44336; cursor: pointer; margin-left: 10px;">×</button>
+        `;
+        fileList.appendChild(fileItem);
+    });
+}
+function removeFile(index) { selectedFiles.splice(index, 1); updateFileList(); }
+function formatFileSize(bytes) {
+    if (bytes === 0) return '0 Bytes';
+    const k = 1024;
+    const sizes = ['Bytes', 'KB', 'MB', 'GB'];
+    const i = Math.floor(Math.log(bytes) / Math.log(k));
+    return parseFloat((bytes / Math.pow(k, i)).toFixed(2)) + ' ' + sizes[i];
+}
+// --- Selecting entries for a .zip/.tar download ---
+// In select mode a click on an item toggles it instead of opening it; the
+// selection is downloaded as ?download=<format>&name=...&name=...
+let selectMode = false;
+const selectedNames = new Set();
+
+function toggleSelectMode() {
+    selectMode = !selectMode;
+    selectedNames.clear();
+    const container = document.getElementById('file-container');
+    container.classList.toggle('selecting', selectMode);
+    container.querySelectorAll('.item.selected').forEach(el => el.classList.remove('selected'));
+    document.getElementById('selection-bar').classList.toggle('hidden', !selectMode);
+    updateSelectionCount();
+}
+
+function updateSelectionCount() {
+    document.getElementById('selection-count').textContent = selectedNames.size + ' selected';
+}
+
+function downloadSelection(format) {
+    if (!selectedNames.size) { alert('Select files or folders first'); return; }
+    const params = new URLSearchParams({ download: format });
+    selectedNames.forEach(name => params.append('name', name));
+    location.href = '?' + params;
+}
+
+// Capture phase: runs before the items' own click handlers and links
+document.getElementById('file-container').addEventListener('click', (e) => {
+    if (!selectMode) return;
+    const el = e.target.closest('.item');
+    if (!el) return;
+    e.preventDefault();
+    e.stopPropagation();
+    const name = el.querySelector('.name').textContent;
+    if (selectedNames.has(name)) selectedNames.delete(name);
+    else selectedNames.add(name);
+    el.classList.toggle('selected', selectedNames.has(name));
+    updateSelectionCount();
+}, true);
+
+// --- Uploads ---
+// Files go up through the resumable /__upload protocol: each one is split
+// into chunks, UPLOAD_PARALLEL of which are in flight at any time across all
+// files. A chunk that fails is retried after asking the server which chunks
+// it already has, and upload URLs are kept in localStorage, so choosing the
+// same file again after a reload picks up where it stopped.
+const UPLOAD_RETRIES = 5;
+
+function makeLimiter(limit) {
+    let active = 0;
+    const waiting = [];
+    return async function(task) {
+        if (active >= limit) await new Promise(resolve => waiting.push(resolve));
+        active++;
+        try {
+            return await task();
+        } finally {
+            active--;
+            if (waiting.length) waiting.shift()();
+        }
+    };
+}
+
+function uploadKey(file) {
+    return ['upload', location.pathname, file.name, file.size, file.lastModified].join(':');
+}
+
+function readUploadStatus(url, header) {
+    // The Upload-* headers every /__upload response carries
+    const received = new Set();
+    for (const range of (header('Upload-Received') || '').split(',').filter(Boolean)) {
+        const [first, last] = range.split('-').map(Number);
+        for (let i = first; i <= (isNaN(last) ? first : last); i++) received.add(i);
+    }
+    return {
+        url: url,
+        chunkSize: Number(header('Upload-Chunk-Size')),
+        received: received,
+        complete: header('Upload-Complete') === '?1'
+    };
+}
+
+async function fetchUploadStatus(url) {
+    const response = await fetch(url, { method: 'HEAD', cache: 'no-store' });
+    if (response.status === 404) return null;
+    if (!response.ok) throw new Error('Upload failed (' + response.status + ')');
+    return readUploadStatus(url, name => response.headers.get(name));
+}
+
+async function createUpload(file) {
+    const params = new URLSearchParams({ dir: location.pathname, name: file.name, size: file.size });
+    const response = await fetch('/__upload?' + params, { method: 'POST' });
+    if (!response.ok) {
+        const text = await response.text();
+        const match = /Message: ([^<]*)/.exec(text);
+        throw new Error(match ? match[1] : 'Upload failed (' + response.status + ')');
+    }
+    return readUploadStatus(response.headers.get('Location'), name => response.headers.get(name));
+}
+
+function sendChunk(url, blob, offset, onProgress) {
+    return new Promise((resolve, reject) => {
+        const xhr = new XMLHttpRequest();
+        xhr.upload.addEventListener('progress', (e) => onProgress(e.loaded));
+        xhr.addEventListener('load', () => {
+            if (xhr.status === 200) resolve(readUploadStatus(url, name => xhr.getResponseHeader(name)));
+            else reject({ status: xhr.status });
+        });
+        xhr.addEventListener('error', () => reject({ status: 0 }));
+        xhr.open('PATCH', url);
+        xhr.setRequestHeader('Upload-Offset', String(offset));
+        xhr.send(blob);
+    });
+}
+
+async function uploadChunk(status, file, index, onProgress) {
+    const offset = index * status.chunkSize;
+    const blob = file.slice(offset, offset + status.chunkSize);
+    for (let attempt = 0; ; attempt++) {
+        try {
+            return await sendChunk(status.url, blob, offset, onProgress);
+        } catch (e) {
+            // Network errors and server trouble are retried; a refused chunk is not
+            const transient = e.status === 0 || e.status === 408 || e.status === 429 || e.status >= 500;
+            if ((!transient && e.status !== 409) || attempt >= UPLOAD_RETRIES) {
+                throw new Error('Upload failed (' + (e.status || 'network error') + ')');
+            }
+            onProgress(0);
+            await new Promise(resolve => setTimeout(resolve, 1000 * Math.pow(2, attempt)));
+            const current = await fetchUploadStatus(status.url).catch(() => status);
+            if (!current) throw new Error('Upload expired on the server');
+            if (current.complete || current.received.has(index)) return current;
+        }
+    }
+}
+
+async function uploadFile(file, limit, onProgress) {
+    const key = uploadKey(file);
+    let status = null;
+    const saved = localStorage.getItem(key);
+    if (saved) status = await fetchUploadStatus(saved).catch(() => null);
+    if (!status) {
+        status = await limit(() => createUpload(file));
+        localStorage.setItem(key, status.url);
+    }
+
+    const chunkCount = Math.ceil(file.size / status.chunkSize);
+    const inFlight = new Map();  // chunk index -> bytes sent so far
+    let confirmed = 0;
+    const missing = [];
+    for (let i = 0; i < chunkCount; i++) {
+        if (status.complete || status.received.has(i)) confirmed += Math.min(status.chunkSize, file.size - i * status.chunkSize);
+        else missing.push(i);
+    }
+    const report = () => {
+        let bytes = confirmed;
+        inFlight.forEach(sent => { bytes += sent; });
+        onProgress(bytes);
+    };
+    report();
+
+    let failed = false;
+    const results = await Promise.all(missing.map(index => limit(async () => {
+        if (failed) return status;  // don't send the rest of a file that has failed
+        const result = await uploadChunk(status, file, index, (sent) => { inFlight.set(index, sent); report(); })
+            .catch(e => { failed = true; throw e; });
+        inFlight.delete(index);
+        confirmed += Math.min(status.chunkSize, file.size - index * status.chunkSize);
+        report();
+        return result;
+    })));
+    // Two last chunks may finish together; only one of them sees the upload complete
+    if (!status.complete && !results.some(r => r.complete)) {
+        const current = await fetchUploadStatus(status.url);
+        if (!current || !current.complete) throw new Error('Upload incomplete');
+    }
+    localStorage.removeItem(key);
+}
+
+async function startUpload() {
+    if (selectedFiles.length === 0) { alert('Please select files to upload'); return; }
+    const files = selectedFiles.slice();
+    const button = document.getElementById('upload-button');
+    const progressBar = document.getElementById('progress-fill');
+    const progressText = document.getElementById('progress-text');
+    const uploadProgress = document.getElementById('upload-progress');
+    uploadProgress.style.display = 'block';
+    progressBar.style.background = '';
+    button.disabled = true;
+
+    const limit = makeLimiter(UPLOAD_PARALLEL);
+    const total = files.reduce((sum, file) => sum + file.size, 0) || 1;
+    const sent = files.map(() => 0);
+    const showTotal = () => {
+        const percentComplete = sent.reduce((a, b) => a + b, 0) / total * 100;
+        progressBar.style.width = percentComplete + '%';
+        progressText.textContent = Math.round(percentComplete) + '%';
+    };
+    const outcomes = await Promise.all(files.map(async (file, index) => {
+        const fileStatus = document.getElementById('status-' + index);
+        try {
+            await uploadFile(file, limit, (bytes) => {
+                sent[index] = bytes;
+                fileStatus.textContent = Math.floor(bytes / Math.max(file.size, 1) * 100) + '%';
+                showTotal();
+            });
+            fileStatus.textContent = '✓';
+            fileStatus.className = 'upload-status status-success';
+            return true;
+        } catch (e) {
+            fileStatus.textContent = e.message;
+            fileStatus.className = 'upload-status status-error';
+            return false;
+        }
+    }));
+    button.disabled = false;
+
+    const failed = outcomes.filter(ok => !ok).length;
+    if (failed) {
+        progressBar.style.background = '#f44336';
+        progressText.textContent = failed === files.length ? 'Upload Failed!' :
+            `${failed} of ${files.length} uploads failed; upload them again to resume`;
+        return;
+    }
+    progressBar.style.background = '#4CAF50';
+    progressText.textContent = 'Upload Complete!';
+    // With live updates on, the new files arrive through the event stream
+    const live = liveSource && liveSource.readyState === EventSource.OPEN;
+    setTimeout(() => { hideUploadForm(); if (!live) location.reload(); }, 1000);
+}
+"""
+
+LISTING_CSS = StaticAsset('listing.css', 'text/css; charset=utf-8', LISTING_CSS_TEXT)
+LISTING_JS = StaticAsset('listing.js', 'text/javascript; charset=utf-8', LISTING_JS_TEXT)
+
+STATIC_ASSETS = {asset.url: asset for asset in (LISTING_CSS, LISTING_JS)}
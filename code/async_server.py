@@ -0,0 +1,738 @@
+import asyncio
+import email.utils
+import html
+import http.client
+import io
+import json
+import os
+import socket
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import DEFAULT_ERROR_MESSAGE, DEFAULT_ERROR_CONTENT_TYPE
+
+from config import *
+import server
+import compression
+import archive
+from blockcache import block_cache
+from bandwidth import bandwidth
+from metrics import metrics
+from accesslog import access_log
+from multipart import MultipartParser, UploadSession, UploadError, get_boundary
+
+# asyncio engine (SERVER_ENGINE = "asyncio").
+# Connections are coroutines instead of threads, so idle keep-alive and slow
+# clients cost a socket and a little memory. Anything that touches the disk
+# (stat, open, listing scans, upload writes) runs on a bounded thread pool,
+# and file bodies go out through loop.sendfile().
+
+SENDFILE_SLICE = 8 * 1024 * 1024  # bytes per sendfile call; each slice gets REQUEST_TIMEOUT
+
+
+class _HandlerShim:
+    # translate_path() and guess_type() only need .directory and class
+    # attributes, so the threaded handler's implementations are reused as-is
+    translate_path = server.ModernHandler.translate_path
+    guess_type = server.ModernHandler.guess_type
+    extensions_map = server.ModernHandler.extensions_map
+
+    def __init__(self):
+        self.directory = os.getcwd()
+
+
+class AsyncConnection:
+    server_version = f"{server.ModernHandler.server_version} {server.ModernHandler.sys_version}"
+
+    def __init__(self, reader, writer, executor, thumb_executor, shim):
+        self.reader = reader
+        self.writer = writer
+        self.executor = executor
+        self.thumb_executor = thumb_executor  # renders can wait long; kept off the file executor
+        self.shim = shim
+        self.loop = asyncio.get_running_loop()
+        peer = writer.get_extra_info('peername')
+        self.client_ip = peer[0] if peer else '-'
+        self.transfer = None
+        self.bytes_out = 0
+        metrics.inc('http_connections_total')
+        metrics.inc('http_connections_active')
+
+    async def run(self):
+        requests = 0
+        try:
+            while True:
+                timeout = KEEPALIVE_TIMEOUT if requests else REQUEST_TIMEOUT
+                try:
+                    head = await asyncio.wait_for(self.reader.readuntil(b'\r\n\r\n'), timeout)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                    break
+                requests += 1
+                if not self.parse_request(head):
+                    await self.send_error(400, "Bad request syntax")
+                    access_log.request(self.client_ip, self.requestline, self.method, self.target, 400, 0, 0)
+                    break
+                if requests >= KEEPALIVE_MAX_REQUESTS:
+                    self.keep_alive = False
+                await self.handle_request()
+
+                if not self.keep_alive:
+                    break
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        except Exception as e:
+            access_log.message(f"Async connection error: {e}")
+        finally:
+            metrics.inc('http_connections_active', value=-1)
+            self.writer.close()
+
+    async def handle_request(self):
+        started = time.perf_counter()
+        written = self.bytes_out
+        self.status_code = None
+        self.metric_route = 'other'
+        metrics.inc('http_requests_active')
+        try:
+            denied = server.access_denied(self.client_ip)
+            if denied is not None:
+                code, message, headers = denied
+                await self.send_error(code, message, headers)
+            elif self.method in ('GET', 'HEAD'):
+                await self.do_GET()
+            elif server.find_internal_route(urllib.parse.urlsplit(self.target).path) == 'do_upload':
+                await self.do_upload()
+            elif self.method == 'POST':
+                await self.do_POST()
+            elif self.method in ('PATCH', 'DELETE'):
+                await self.send_error(405, "Method Not Allowed")
+            else:
+                await self.send_error(501, f"Unsupported method ({self.method!r})")
+        finally:
+            metrics.inc('http_requests_active', value=-1)
+            if self.transfer is not None:
+                self.transfer.close()
+                self.transfer = None
+            if self.status_code is not None:
+                seconds = time.perf_counter() - started
+                bytes_out = self.bytes_out - written
+                bytes_in = self.body_length() if self.body_consumed else 0
+                metrics.request_done(self.metric_route, self.method, self.status_code, seconds, bytes_out, bytes_in)
+                access_log.request(self.client_ip, self.requestline, self.method, self.target, self.status_code,
+                                   seconds, bytes_out, bytes_in, self.metric_route,
+                                   self.headers.get('Range'), self.headers.get('User-Agent'))
+
+    def parse_request(self, head):
+        self.method = self.target = ''
+        self.version = 'HTTP/1.0'
+        self.keep_alive = False
+        self.body_consumed = True
+        request_line, _, rest = head.partition(b'\r\n')
+        self.requestline = request_line.decode('iso-8859-1').rstrip()
+        words = self.requestline.split()
+        if len(words) != 3 or not words[2].startswith('HTTP/1.'):
+            return False
+        self.method, self.target, self.version = words
+        try:
+            self.headers = http.client.parse_headers(io.BytesIO(rest))
+        except http.client.HTTPException:
+            return False
+
+        connection = self.headers.get('Connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            self.keep_alive = connection == 'keep-alive'
+        else:
+            self.keep_alive = connection != 'close'
+        # Anything we don't read ourselves must not be mistaken for the next request
+        self.body_consumed = (self.headers.get('Content-Length', '0').strip() in ('', '0')
+                              and 'Transfer-Encoding' not in self.headers)
+        return True
+
+    def body_length(self):
+        try:
+            return max(0, int(self.headers.get('Content-Length', 0)))
+        except ValueError:
+            return 0
+
+    # --- Response helpers ---
+
+    def write(self, data):
+        # Everything sent goes through here or sendfile, so it can be counted
+        self.writer.write(data)
+        self.bytes_out += len(data)
+
+    def start_response(self, code, headers, message=None):
+        if message is None:
+            message = HTTPStatus(code).phrase
+        if not self.body_consumed:
+            self.keep_alive = False
+        lines = [f"HTTP/1.1 {code} {message}",
+                 f"Server: {self.server_version}",
+                 f"Date: {email.utils.formatdate(usegmt=True)}"]
+        lines += [f"{name}: {value}" for name, value in headers]
+        if self.keep_alive:
+            if self.version == 'HTTP/1.0':
+                lines.append("Connection: keep-alive")
+            lines.append(f"Keep-Alive: timeout={KEEPALIVE_TIMEOUT}")
+        else:
+            lines.append("Connection: close")
+        self.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1', 'replace'))
+        self.log_request(code)
+
+    async def drain(self):
+        await asyncio.wait_for(self.writer.drain(), REQUEST_TIMEOUT)
+
+    def begin_transfer(self, bulk=False):
+        # The response body about to be sent, for the bandwidth shaper
+        if self.transfer is None:
+            self.transfer = bandwidth.start(self.client_ip, bulk)
+
+    async def pace(self, n):
+        if self.transfer is None:
+            self.begin_transfer()
+        delay = self.transfer.sent(n)
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def send_body(self, code, headers, body):
+        self.start_response(code, headers + [("Content-Length", str(len(body)))])
+        if self.method != 'HEAD' and body:
+            self.write(body)
+        await self.drain()
+
+    async def send_error(self, code, message=None, headers=()):
+        shortmsg, longmsg = server.ModernHandler.responses.get(code, ('???', '???'))
+        if message is None:
+            message = shortmsg
+        body = (DEFAULT_ERROR_MESSAGE % {
+            'code': code,
+            'message': html.escape(message, quote=False),
+            'explain': html.escape(longmsg, quote=False),
+        }).encode('UTF-8', 'replace')
+        await self.send_body(code, [("Content-Type", DEFAULT_ERROR_CONTENT_TYPE)] + list(headers), body)
+
+    def log_request(self, code):
+        # The access log entry is written once the response is done (handle_request)
+        self.status_code = code
+
+    # --- GET / HEAD ---
+
+    def resolve_get(self):
+        # Runs on the executor: every filesystem call for a GET happens here
+        path = self.shim.translate_path(self.target)
+        self.metric_route = 'file'
+        if os.path.isdir(path):
+            self.metric_route = 'listing'
+            parts = urllib.parse.urlsplit(self.target)
+            if not parts.path.endswith('/'):
+                return 'redirect', urllib.parse.urlunsplit(parts._replace(path=parts.path + '/'))
+            query = urllib.parse.parse_qs(parts.query)
+            if 'download' in query:
+                self.metric_route = 'archive'
+                return server.archive_for(path, parts.query)
+            if query.get('format') != ['json']:
+                for index in "index.html", "index.htm":
+                    index = os.path.join(path, index)
+                    if os.path.exists(index):
+                        path = index
+                        break
+            if os.path.isdir(path):
+                try:
+                    ctype, encoded, etag = server.build_listing(path, self.target)
+                except OSError:
+                    return 'error', 404, "No permission to list directory"
+                except ValueError:
+                    return 'error', 400, "Bad Request: Invalid cursor or limit"
+                return ('listing', ctype) + server.compress_body(self.target, encoded, etag, self.headers)
+
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return 'error', 404, "File not found"
+        try:
+            fs = os.fstat(f.fileno())
+            ctype = self.shim.guess_type(path)
+            variant = server.negotiate_file(path, fs, ctype, self.headers,
+                                            can_stream=self.version != 'HTTP/1.0')
+            if variant[1] is not None:
+                # Send the precompressed sibling in place of the file
+                f.close()
+                f = open(variant[1], 'rb')
+        except OSError:
+            f.close()
+            return 'error', 404, "File not found"
+        return 'file', f, fs, ctype, server.cache_control_for(path), path, variant
+
+    async def do_GET(self):
+        url_path = urllib.parse.urlsplit(self.target).path
+        route = server.find_internal_route(url_path)
+        if route:
+            self.metric_route = route[3:]
+        if route == 'do_status':
+            data = await self.loop.run_in_executor(self.executor, server.status_data, 'asyncio')
+            await self.send_body(200, [("Content-type", "application/json"), ("Cache-Control", "no-store")],
+                                 json.dumps(data).encode('utf-8'))
+            return
+        if route == 'do_metrics':
+            body = await self.loop.run_in_executor(self.executor, server.metrics_text, 'asyncio')
+            await self.send_body(200, [("Content-type", server.METRICS_CONTENT_TYPE), ("Cache-Control", "no-store")],
+                                 body)
+            return
+        if route == 'do_thumb':
+            await self.do_thumb()
+            return
+        if route == 'do_static':
+            await self.do_static(url_path)
+            return
+        if route == 'do_vtt':
+            await self.do_vtt()
+            return
+        if route == 'do_events':
+            await self.do_events()
+            return
+        if route == 'do_upload':
+            await self.do_upload()
+            return
+        if route == 'do_search':
+            code, body = await self.loop.run_in_executor(
+                self.executor, server.search_response, urllib.parse.urlsplit(self.target).query)
+            await self.send_body(code, [("Content-type", "application/json"), ("Cache-Control", "no-store")], body)
+            return
+        result = await self.loop.run_in_executor(self.executor, self.resolve_get)
+        kind = result[0]
+        if kind == 'redirect':
+            await self.send_body(301, [("Location", result[1])], b'')
+        elif kind == 'error':
+            await self.send_error(result[1], result[2])
+        elif kind == 'archive':
+            await self.send_archive(*result[1:])
+        elif kind == 'listing':
+            _, ctype, encoding, body, etag = result
+            validators = [("ETag", etag), ("Cache-Control", CACHE_CONTROL['listing'])]
+            if COMPRESSION_ENABLED:
+                validators.append(("Vary", "Accept-Encoding"))
+            if server.is_not_modified(self.headers, etag):
+                await self.send_not_modified(validators)
+                return
+            headers = [("Content-type", ctype)]
+            if encoding:
+                headers.append(("Content-Encoding", encoding))
+            await self.send_body(200, headers + validators, body)
+        else:
+            f = result[1]
+            try:
+                await self.send_file(f, *result[2:])
+            finally:
+                f.close()
+
+    async def do_static(self, url_path):
+        response = server.static_asset_response(url_path, self.headers)
+        if response is None:
+            await self.send_error(404, "File not found")
+            return
+        code, headers, body = response
+        self.start_response(code, headers)
+        if self.method != 'HEAD' and body:
+            self.write(body)
+        await self.drain()
+
+    async def do_vtt(self):
+        source = self.shim.translate_path(self.target[len('/__vtt'):])
+        response = await self.loop.run_in_executor(self.executor, server.subtitle_response, source, self.headers)
+        if response[0] == 'error':
+            await self.send_error(response[1], response[2])
+            return
+        code, headers, body = response
+        self.start_response(code, headers)
+        if self.method != 'HEAD' and body:
+            self.write(body)
+        await self.drain()
+
+    async def do_events(self):
+        folder = await self.loop.run_in_executor(
+            self.executor, server.events_folder, urllib.parse.urlsplit(self.target).query)
+        if folder is None:
+            await self.send_error(404, "Folder not found")
+            return
+        if server.event_hub.count() >= EVENTS_MAX_STREAMS:
+            await self.send_error(503, "Too many live update streams")
+            return
+        # The stream ends when the connection does; after the headers the
+        # hub takes over a duplicate of the socket and this connection closes
+        self.keep_alive = False
+        self.start_response(200, [("Content-Type", "text/event-stream"), ("Cache-Control", "no-store"),
+                                  ("X-Accel-Buffering", "no")])
+        await self.drain()
+        transport_sock = self.writer.get_extra_info('socket')
+        sock = socket.fromfd(transport_sock.fileno(), transport_sock.family, transport_sock.type)
+        if not server.event_hub.attach(sock, folder):
+            sock.close()
+
+    def resolve_thumb(self):
+        source = self.shim.translate_path(self.target[len('/__thumb'):])
+        result = server.thumbnail_for(source, urllib.parse.urlsplit(self.target).query)
+        if result[0] == 'file':
+            try:
+                f = open(result[1], 'rb')
+                return result + (f, os.fstat(f.fileno()).st_size)
+            except OSError:
+                return 'error', 503, "Thumbnail not ready"
+        return result
+
+    async def do_thumb(self):
+        result = await self.loop.run_in_executor(self.thumb_executor, self.resolve_thumb)
+        if result[0] == 'error':
+            await self.send_error(result[1], result[2])
+            return
+        _, _, etag, cache_control, f, length = result
+        try:
+            validators = [("ETag", etag), ("Cache-Control", cache_control)]
+            if server.is_not_modified(self.headers, etag):
+                await self.send_not_modified(validators)
+                return
+            self.start_response(200, [("Content-type", "image/jpeg"), ("Content-Length", str(length))] + validators)
+            await self.drain()
+            if self.method != 'HEAD':
+                await self.send_range(f, 0, length)
+        finally:
+            f.close()
+
+    async def send_not_modified(self, validators):
+        # No body and no Content-Length on a 304
+        self.start_response(304, validators)
+        await self.drain()
+
+    async def send_file(self, f, fs, ctype, cache_control, path, variant):
+        encoding, sibling, etag, vary = variant
+        validators = [("ETag", etag),
+                      ("Last-Modified", email.utils.formatdate(fs.st_mtime, usegmt=True)),
+                      ("Cache-Control", cache_control)]
+        if vary:
+            validators.append(("Vary", "Accept-Encoding"))
+        if server.is_not_modified(self.headers, etag, fs.st_mtime):
+            await self.send_not_modified(validators)
+            return
+        if self.method != 'HEAD':
+            self.begin_transfer(bulk=fs.st_size >= BANDWIDTH_BULK_MB * 1024 * 1024 and "Range" not in self.headers)
+
+        if encoding:
+            headers = [("Content-type", ctype), ("Content-Encoding", encoding)] + validators
+            if sibling is not None:
+                length = (await self.loop.run_in_executor(self.executor, os.fstat, f.fileno())).st_size
+                self.start_response(200, headers + [("Content-Length", str(length))])
+                await self.drain()
+                if self.method != 'HEAD':
+                    await self.send_range(f, 0, length)
+            elif fs.st_size <= COMPRESS_BUFFER_MAX_KB * 1024:
+                body = await self.loop.run_in_executor(
+                    self.executor, lambda: compression.compressed_body(
+                        (path, etag), f.read(), encoding, cacheable=not etag.startswith('W/')))
+                await self.send_body(200, headers, body)
+            else:
+                await self.send_compressed(f, encoding, headers)
+            return
+
+        file_size = fs.st_size
+        headers = [("Content-type", ctype)] + validators + [("Accept-Ranges", "bytes")]
+        code, offset, length = 200, 0, file_size
+
+        ranges = None
+        if "Range" in self.headers:
+            ranges = server.requested_ranges(self.headers, fs, etag)
+            if ranges is not None:
+                self.metric_route = 'range'
+        if ranges == []:
+            await self.send_body(416, [("Content-Range", f"bytes */{file_size}")], b'')
+            return
+        if ranges and len(ranges) > 1:
+            await self.send_multirange(f, ctype, file_size, ranges, headers[1:])
+            return
+        if ranges:
+            offset, last_byte = ranges[0]
+            code, length = 206, last_byte - offset + 1
+            headers.insert(1, ("Content-Range", f"bytes {offset}-{last_byte}/{file_size}"))
+
+        self.start_response(code, headers + [("Content-Length", str(length))])
+        await self.drain()
+        if self.method != 'HEAD':
+            await self.send_range(f, offset, length)
+
+    async def send_archive(self, ctype, filename, pieces):
+        # Length unknown up front: chunked, or end-of-connection for HTTP/1.0
+        chunked = self.version != 'HTTP/1.0'
+        if not chunked:
+            self.keep_alive = False
+        headers = [("Content-type", ctype), ("Content-Disposition", server.content_disposition(filename)),
+                   ("Cache-Control", "no-store")]
+        if chunked:
+            headers.append(("Transfer-Encoding", "chunked"))
+        try:
+            self.start_response(200, headers)
+            await self.drain()
+            if self.method == 'HEAD':
+                return
+            self.begin_transfer(bulk=True)
+            while True:
+                # Reading and deflating members is blocking work
+                piece = await self.loop.run_in_executor(self.executor, next, pieces, None)
+                if piece is None:
+                    break
+                # An empty chunk would end a chunked body early
+                if isinstance(piece, archive.FileSpan):
+                    if not piece.length:
+                        continue
+                    if chunked:
+                        self.write(b"%x\r\n" % piece.length)
+                    await self.send_span(piece)
+                    if chunked:
+                        self.write(b"\r\n")
+                elif piece:
+                    self.write(b"%x\r\n%s\r\n" % (len(piece), piece) if chunked else piece)
+                    await self.drain()
+                    await self.pace(len(piece))
+            if chunked:
+                self.write(b"0\r\n\r\n")
+            await self.drain()
+        finally:
+            await self.loop.run_in_executor(self.executor, pieces.close)
+
+    async def send_span(self, span):
+        transport = self.writer.transport
+        offset, remaining = span.file.tell(), span.length
+        while remaining > 0:
+            count = min(SENDFILE_SLICE, bandwidth.slice_size, remaining)
+            sent = await asyncio.wait_for(self.loop.sendfile(transport, span.file, offset, count), REQUEST_TIMEOUT)
+            self.bytes_out += sent
+            offset += sent
+            remaining -= sent
+            await self.pace(sent)
+            if sent < count:
+                break
+        while remaining > 0:
+            # The file shrank since it was listed: zeros keep the archive whole
+            size = min(ARCHIVE_READ_CHUNK, remaining)
+            self.write(bytes(size))
+            remaining -= size
+            await self.drain()
+            await self.pace(size)
+
+    async def send_multirange(self, f, ctype, file_size, ranges, headers):
+        boundary, parts, trailer, length = server.multipart_byteranges(ranges, ctype, file_size)
+        self.start_response(206, [("Content-type", f"multipart/byteranges; boundary={boundary}")]
+                            + headers + [("Content-Length", str(length))])
+        await self.drain()
+        if self.method == 'HEAD':
+            return
+        for part_header, offset, part_length in parts:
+            self.write(part_header)
+            if not await self.send_range(f, offset, part_length):
+                return
+        self.write(trailer)
+        await self.drain()
+
+    async def send_range(self, f, offset, length):
+        if block_cache.enabled:
+            reader = await self.loop.run_in_executor(self.executor, block_cache.reader, f)
+            if reader is not None:
+                return await self.send_blocks(reader, offset, length)
+        transport = self.writer.transport
+        while length > 0:
+            count = min(SENDFILE_SLICE, bandwidth.slice_size, length)
+            sent = await asyncio.wait_for(self.loop.sendfile(transport, f, offset, count), REQUEST_TIMEOUT)
+            self.bytes_out += sent
+            await self.pace(sent)
+            if sent < count:
+                # The file shrank under us: the body can't match its Content-Length
+                self.keep_alive = False
+                return False
+            offset += sent
+            length -= sent
+        return True
+
+    async def send_blocks(self, reader, offset, length):
+        # Through the shared block cache; reads that miss it run on the executor
+        while length > 0:
+            data = await self.loop.run_in_executor(self.executor, reader.read, offset, length)
+            if not data:
+                self.keep_alive = False
+                return False
+            self.write(data)
+            await self.drain()
+            await self.pace(len(data))
+            offset += len(data)
+            length -= len(data)
+        return True
+
+    def read_compressed(self, f, compressor):
+        data = f.read(COMPRESS_STREAM_CHUNK)
+        block = compressor.compress(data) if data else compressor.flush()
+        return block, not data
+
+    async def send_compressed(self, f, encoding, headers):
+        # Too big to hold in memory: compress while sending, chunked
+        self.start_response(200, headers + [("Transfer-Encoding", "chunked")])
+        await self.drain()
+        if self.method == 'HEAD':
+            return
+        compressor = compression.StreamCompressor(encoding)
+        done = False
+        while not done:
+            block, done = await self.loop.run_in_executor(self.executor, self.read_compressed, f, compressor)
+            if block:
+                self.write(b"%x\r\n%s\r\n" % (len(block), block))
+                await self.drain()
+                await self.pace(len(block))
+        self.write(b"0\r\n\r\n")
+        await self.drain()
+
+    # --- Resumable uploads (/__upload) ---
+
+    async def do_upload(self):
+        self.metric_route = 'upload'
+        url = urllib.parse.urlsplit(self.target)
+        upload_id = url.path[len('/__upload/'):]
+        try:
+            if not upload_id:
+                if self.method != 'POST':
+                    raise UploadError(405, "Method Not Allowed")
+                code, status = 201, await self.loop.run_in_executor(
+                    self.executor, server.create_upload, url.query, self.shim.translate_path)
+            elif self.method in ('GET', 'HEAD'):
+                code, status = 200, await self.loop.run_in_executor(
+                    self.executor, server.resumable_uploads.status, upload_id)
+            elif self.method == 'PATCH':
+                code, status = 200, await self.receive_chunk(upload_id)
+            elif self.method == 'DELETE':
+                await self.loop.run_in_executor(self.executor, server.resumable_uploads.cancel, upload_id)
+                await self.send_body(204, [("Cache-Control", "no-store")], b'')
+                return
+            else:
+                raise UploadError(405, "Method Not Allowed")
+        except UploadError as e:
+            await self.send_error(e.status, e.message)
+            return
+        headers = [("Content-type", "application/json")] + server.upload_headers(status)
+        if code == 201:
+            headers.append(("Location", status['url']))
+        await self.send_body(code, headers, json.dumps(status).encode('utf-8'))
+
+    async def receive_chunk(self, upload_id):
+        try:
+            offset = int(self.headers.get('Upload-Offset', ''))
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            raise UploadError(400, "Bad Request: Upload-Offset and Content-Length are required")
+        writer = await self.loop.run_in_executor(
+            self.executor, server.resumable_uploads.begin_chunk, upload_id, offset, length)
+        try:
+            if self.version != 'HTTP/1.0' and self.headers.get('Expect', '').lower() == '100-continue':
+                self.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            remaining = length
+            while remaining > 0:
+                chunk = await asyncio.wait_for(
+                    self.reader.read(min(UPLOAD_CHUNK_SIZE, remaining)), REQUEST_TIMEOUT)
+                if not chunk:
+                    raise UploadError(400, "Upload failed: Connection closed before upload completed")
+                remaining -= len(chunk)
+                await self.loop.run_in_executor(self.executor, writer.write, chunk)
+            self.body_consumed = True
+            status = await self.loop.run_in_executor(self.executor, writer.finish)
+        finally:
+            writer.close()
+        if status['complete']:
+            server.search_index.refresh(writer.info['dir'])
+        return status
+
+    # --- POST (multipart upload) ---
+
+    def upload_target(self):
+        target_dir = self.shim.translate_path(self.target)
+        if not os.path.isdir(target_dir):
+            target_dir = os.path.dirname(target_dir)
+        return target_dir
+
+    async def do_POST(self):
+        self.metric_route = 'upload'
+        content_type = self.headers.get('Content-Type', '')
+        if not content_type.startswith('multipart/form-data'):
+            await self.send_error(400, "Bad Request: Expected multipart form data")
+            return
+        boundary = get_boundary(content_type)
+        if not boundary:
+            await self.send_error(400, "Bad Request: Missing multipart boundary")
+            return
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            await self.send_error(400, "Bad Request: Invalid Content-Length")
+            return
+
+        target_dir = await self.loop.run_in_executor(self.executor, self.upload_target)
+        error = await self.loop.run_in_executor(
+            self.executor, server.check_upload_size, content_length, target_dir)
+        if error:
+            await self.send_error(*error)
+            return
+        if self.version != 'HTTP/1.0' and self.headers.get('Expect', '').lower() == '100-continue':
+            self.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+        session = UploadSession(target_dir, MAX_UPLOAD_MB * 1024 * 1024, EXCLUDED_UPLOAD_EXT)
+        parser = MultipartParser(boundary)
+        try:
+            remaining = content_length
+            while remaining > 0:
+                chunk = await asyncio.wait_for(
+                    self.reader.read(min(UPLOAD_CHUNK_SIZE, remaining)), REQUEST_TIMEOUT)
+                if not chunk:
+                    raise UploadError(400, "Upload failed: Connection closed before upload completed")
+                remaining -= len(chunk)
+                events = parser.feed(chunk)
+                if events:
+                    await self.loop.run_in_executor(self.executor, session.handle, events)
+            self.body_consumed = True
+            # A part without its closing boundary is incomplete
+            await self.loop.run_in_executor(self.executor, session.abort)
+        except UploadError as e:
+            await self.loop.run_in_executor(self.executor, session.abort)
+            await self.send_error(e.status, e.message)
+            return
+        except (ConnectionError, asyncio.TimeoutError):
+            await self.loop.run_in_executor(self.executor, session.abort)
+            raise
+        except Exception as e:
+            await self.loop.run_in_executor(self.executor, session.abort)
+            access_log.message(f"Upload error: {e}")
+            await self.send_error(500, f"Upload failed: {str(e)}")
+            return
+
+        if session.saved:
+            server.search_index.refresh(target_dir)
+            await self.send_body(303, [("Location", self.target)], b'')
+        else:
+            await self.send_error(400, "No valid files found")
+
+
+async def _serve(port, on_ready=None, sock=None):
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=ASYNC_EXECUTOR_WORKERS, thread_name_prefix='async-io')
+    loop.set_default_executor(executor)
+    thumb_executor = ThreadPoolExecutor(max_workers=server.thumbnail_service.max_queued,
+                                        thread_name_prefix='async-thumb')
+    shim = _HandlerShim()
+
+    async def on_connection(reader, writer):
+        await AsyncConnection(reader, writer, executor, thumb_executor, shim).run()
+
+    if sock is not None:
+        srv = await asyncio.start_server(on_connection, sock=sock, limit=64 * 1024)
+    else:
+        srv = await asyncio.start_server(on_connection, host='', port=port,
+                                         reuse_address=True, backlog=1024, limit=64 * 1024)
+    if on_ready:
+        on_ready()
+    async with srv:
+        await srv.serve_forever()
+
+
+def serve(port, on_ready=None, sock=None):
+    asyncio.run(_serve(port, on_ready, sock))
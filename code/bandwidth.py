@@ -0,0 +1,227 @@
+import math
+import threading
+import time
+from collections import deque
+
+from config import *
+
+# Bandwidth shaping for response bodies.
+# Every response body counts as a transfer, sent in slices; after each slice
+# the engine asks how long to pause. Token buckets cap the rate per client IP
+# (BANDWIDTH_PER_CLIENT_MB) and for the whole process (BANDWIDTH_TOTAL_MB).
+# While the total is contended, each transfer is paced at its share of it,
+# weighted so interactive transfers (listings, small files, range requests
+# from players) get BANDWIDTH_INTERACTIVE_WEIGHT times the share of a bulk
+# one (big whole-file downloads, archives); when there is capacity to spare,
+# nobody waits. Per-client throughput is measured either way and shown in
+# /__status; each transfer measures its own, and a client's is the sum over
+# its transfers. Without limits, starting, sending and finishing take no
+# lock at all: open transfers sit in a set and finished ones in a queue (both
+# safe to touch from any thread), folded into the per-client totals when
+# stats() is asked for.
+
+RATE_TAU = 2.0  # seconds; time constant of the throughput estimate
+IDLE_SECONDS = 60  # clients without transfers are forgotten after this long
+UNLIMITED_SLICE = 4 * 1024 * 1024  # without limits, slices only keep the measurement live
+MAX_LISTED_CLIENTS = 100
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst_seconds):
+        self.rate = rate
+        self.burst = rate * burst_seconds
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self, n, now):
+        """Spend n bytes. Returns how long until the balance is back at zero
+        (0 when there were enough tokens)."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate) - n
+        self.updated = now
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class Meter:
+    __slots__ = ('bytes', 'rate', 'measured_at')
+
+    def __init__(self, now):
+        self.bytes = 0
+        self.rate = 0.0
+        self.measured_at = now
+
+    def current_rate(self, now):
+        return self.rate * math.exp(-(now - self.measured_at) / RATE_TAU)
+
+    def measure(self, n, now):
+        # Exponentially weighted: a steady stream of x bytes/s reads as x
+        self.rate = self.current_rate(now) + n / RATE_TAU
+        self.measured_at = now
+        self.bytes += n
+
+    def absorb(self, other, now):
+        # A finished transfer's bytes, and its rate decaying from here on
+        self.rate = self.current_rate(now) + other.current_rate(now)
+        self.measured_at = now
+        self.bytes += other.bytes
+
+
+class ClientState:
+    __slots__ = ('bucket', 'meter', 'active', 'last_seen')
+
+    def __init__(self, bucket, now):
+        self.bucket = bucket
+        self.meter = Meter(now)  # transfers that have finished
+        self.active = set()
+        self.last_seen = now
+
+    def current_rate(self, now):
+        return self.meter.current_rate(now) + sum(t.meter.current_rate(now) for t in list(self.active))
+
+    def total_bytes(self):
+        return self.meter.bytes + sum(t.meter.bytes for t in list(self.active))
+
+
+class Transfer:
+    """One response body. sent(n) after each slice returns the pause (in
+    seconds) before the next; close() when the response is done."""
+    __slots__ = ('shaper', 'client_ip', 'client', 'bulk', 'weight', 'meter', 'clock', 'closed')
+
+    def __init__(self, shaper, client_ip, client, bulk, now):
+        self.shaper = shaper
+        self.client_ip = client_ip
+        self.client = client
+        self.bulk = bulk
+        self.weight = 1 if bulk else BANDWIDTH_INTERACTIVE_WEIGHT
+        self.meter = Meter(now)  # only the sending thread touches it
+        self.clock = now
+        self.closed = False
+
+    def sent(self, n):
+        return self.shaper.account(self, n)
+
+    def close(self):
+        self.shaper.finish(self)
+
+
+class BandwidthShaper:
+    def __init__(self, total_rate=BANDWIDTH_TOTAL_MB * 1024 * 1024,
+                 client_rate=BANDWIDTH_PER_CLIENT_MB * 1024 * 1024, burst_seconds=BANDWIDTH_BURST_SECONDS):
+        self.total_rate = total_rate
+        self.client_rate = client_rate
+        self.burst_seconds = burst_seconds
+        self.total = TokenBucket(total_rate, burst_seconds) if total_rate else None
+        self.limited = bool(total_rate or client_rate)
+        self.slice_size = BANDWIDTH_SLICE_KB * 1024 if self.limited else UNLIMITED_SLICE
+        self.lock = threading.Lock()
+        self.clients = {}  # client IP -> ClientState
+        self.open = set()  # without limits: transfers in progress
+        self.finished = deque()  # without limits: transfers done but not yet folded into self.clients
+        self.weights = 0  # sum of the active transfers' weights
+        self.active = {'interactive': 0, 'bulk': 0}
+        self.throttled_seconds = 0.0
+
+    def start(self, client_ip, bulk=False):
+        now = time.monotonic()
+        if not self.limited:
+            transfer = Transfer(self, client_ip, None, bulk, now)
+            self.open.add(transfer)
+            return transfer
+        with self.lock:
+            client = self.client_state(client_ip, now)
+            transfer = Transfer(self, client_ip, client, bulk, now)
+            client.active.add(transfer)
+            self.weights += transfer.weight
+            self.active['bulk' if bulk else 'interactive'] += 1
+        return transfer
+
+    def finish(self, transfer):
+        if transfer.client is None:
+            if not transfer.closed:
+                transfer.closed = True
+                self.open.discard(transfer)
+                self.finished.append(transfer)
+            return
+        with self.lock:
+            if transfer.closed:
+                return
+            transfer.closed = True
+            now = time.monotonic()
+            transfer.client.active.discard(transfer)
+            transfer.client.meter.absorb(transfer.meter, now)
+            transfer.client.last_seen = now
+            self.weights -= transfer.weight
+            self.active['bulk' if transfer.bulk else 'interactive'] -= 1
+
+    def account(self, transfer, n):
+        now = time.monotonic()
+        transfer.meter.measure(n, now)
+        client = transfer.client
+        if client is None or (client.bucket is None and self.total is None):
+            return 0.0
+        with self.lock:
+            delay = client.bucket.take(n, now) if client.bucket is not None else 0.0
+            if self.total is not None:
+                if self.total.take(n, now) > 0:
+                    # Contended: pace this transfer at its weighted share of the total
+                    share = self.total_rate * transfer.weight / max(self.weights, transfer.weight)
+                    transfer.clock = max(transfer.clock, now) + n / share
+                    delay = max(delay, transfer.clock - now)
+                else:
+                    transfer.clock = now
+            self.throttled_seconds += delay
+        return delay
+
+    def client_state(self, client_ip, now):
+        # Called with the lock held
+        client = self.clients.get(client_ip)
+        if client is None:
+            self.forget_idle(now)
+            bucket = TokenBucket(self.client_rate, self.burst_seconds) if self.client_rate else None
+            client = self.clients[client_ip] = ClientState(bucket, now)
+        return client
+
+    def forget_idle(self, now):
+        # Called with the lock held
+        busy = {transfer.client_ip for transfer in list(self.open)}
+        for ip in [ip for ip, client in self.clients.items()
+                   if not client.active and ip not in busy and now - client.last_seen > IDLE_SECONDS]:
+            del self.clients[ip]
+
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            while self.finished:
+                transfer = self.finished.popleft()
+                client = self.client_state(transfer.client_ip, now)
+                client.meter.absorb(transfer.meter, now)
+                client.last_seen = now
+            active = dict(self.active)
+            unlimited = {}  # client IP -> open transfers
+            for transfer in list(self.open):
+                unlimited.setdefault(transfer.client_ip, []).append(transfer)
+                active['bulk' if transfer.bulk else 'interactive'] += 1
+            rows = []
+            for ip in set(self.clients) | set(unlimited):
+                client = self.clients.get(ip)
+                extra = unlimited.get(ip, ())
+                rate = sum(transfer.meter.current_rate(now) for transfer in extra)
+                sent = sum(transfer.meter.bytes for transfer in extra)
+                if client is not None:
+                    rate += client.current_rate(now)
+                    sent += client.total_bytes()
+                rows.append((ip, rate, sent, len(extra) + (len(client.active) if client else 0)))
+            rows.sort(key=lambda row: -row[1])
+            return {
+                'total_limit': self.total_rate or None,
+                'client_limit': self.client_rate or None,
+                'active_transfers': active,
+                'throughput': round(sum(row[1] for row in rows)),
+                'throttled_seconds': round(self.throttled_seconds, 3),
+                'clients': {ip: {'bytes_per_sec': round(rate), 'bytes': sent, 'transfers': transfers}
+                            for ip, rate, sent, transfers in rows[:MAX_LISTED_CLIENTS]},
+            }
+
+
+bandwidth = BandwidthShaper()
@@ -0,0 +1,219 @@
+import os
+import stat
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import *
+
+# Shared read cache for file bodies (BLOCK_CACHE_MB; off by default).
+# Without it every response reads its file on its own through sendfile, so
+# ten people watching the same video cost ten streams of reads, and on a
+# spinning disk those streams seek against each other. With it, files are
+# read in aligned BLOCK_CACHE_BLOCK_KB blocks keyed by (device, inode, size,
+# mtime, block number); every response in the process shares them, and
+# requests missing the same block at once wait for one read instead of
+# issuing their own.
+#
+# Eviction is 2Q, so one pass over a large file (a bulk download, a backup
+# tool) can't flush the blocks other viewers keep coming back to: new blocks
+# enter a FIFO probation queue holding a quarter of the budget, and only a
+# block asked for again after it dropped out of probation (its key is
+# remembered for a while) makes it into the main LRU queue. A response that
+# reads blocks in order gets the next BLOCK_CACHE_READAHEAD blocks of its
+# range read in the background, so the disk works ahead of the socket.
+
+PROBATION_SHARE = 0.25  # of the byte budget
+GHOST_SHARE = 0.5  # remembered probation evictions, as a share of the blocks that fit
+
+
+def read_at(f, offset, size):
+    if hasattr(os, 'pread'):
+        return os.pread(f.fileno(), size, offset)
+    f.seek(offset)
+    return f.read(size)
+
+
+def file_key(fs):
+    return fs.st_dev, fs.st_ino, fs.st_size, fs.st_mtime_ns
+
+
+class Flight:
+    # One read of a block that other requests can wait for
+    __slots__ = ('done', 'data', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.data = None
+        self.error = None
+
+
+class BlockReader:
+    """Reads one response's byte range out of the cache."""
+
+    def __init__(self, cache, f, key):
+        self.cache = cache
+        self.f = f
+        self.key = key
+        self.path = getattr(f, 'name', None)
+        self.last_index = None
+
+    def read(self, offset, limit):
+        """Up to limit bytes at offset (never past the end of a block), or
+        b'' at the end of the file."""
+        size = self.cache.block_size
+        index = offset // size
+        block = self.cache.get(self.key, index, self.f)
+        if self.last_index == index - 1 and self.path is not None:
+            # Reading in order: have the blocks after this one (within the range) on the way
+            last = min(index + BLOCK_CACHE_READAHEAD, (offset + limit - 1) // size)
+            if last > index:
+                self.cache.read_ahead(self.key, self.path, index + 1, last)
+        self.last_index = index
+        start = offset - index * size
+        return memoryview(block)[start:start + limit]
+
+
+class BlockCache:
+    def __init__(self, max_bytes=BLOCK_CACHE_MB * 1024 * 1024, block_size=BLOCK_CACHE_BLOCK_KB * 1024):
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.enabled = max_bytes >= block_size
+        self.probation_bytes = int(max_bytes * PROBATION_SHARE)
+        self.ghost_limit = max(1, int(max_bytes // block_size * GHOST_SHARE))
+        self.lock = threading.Lock()
+        self.probation = OrderedDict()  # key -> block, oldest first
+        self.main = OrderedDict()  # key -> block, least recently used first
+        self.ghosts = OrderedDict()  # keys recently dropped from probation
+        self.probation_size = 0
+        self.size = 0
+        self.loading = {}  # key -> Flight
+        self.executor = None
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.read_ahead_blocks = 0
+        self.evictions = 0
+
+    def reader(self, f):
+        """A BlockReader for the open file f, or None if it isn't a regular file."""
+        try:
+            fs = os.fstat(f.fileno())
+        except (AttributeError, OSError, ValueError):
+            return None
+        if not stat.S_ISREG(fs.st_mode):
+            return None
+        return BlockReader(self, f, file_key(fs))
+
+    def get(self, key, index, f):
+        block_key = key + (index,)
+        with self.lock:
+            block = self.main.get(block_key)
+            if block is not None:
+                self.main.move_to_end(block_key)
+                self.hits += 1
+                return block
+            block = self.probation.get(block_key)
+            if block is not None:
+                self.hits += 1
+                return block
+            flight = self.loading.get(block_key)
+            if flight is None:
+                flight = self.loading[block_key] = Flight()
+                self.misses += 1
+                owner = True
+            else:
+                self.coalesced += 1
+                owner = False
+        if owner:
+            self.load(block_key, flight, f)
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.data
+
+    def load(self, block_key, flight, f):
+        # Whatever happens, the flight must land: requests waiting on it re-raise its error
+        try:
+            flight.data = read_at(f, block_key[-1] * self.block_size, self.block_size)
+        except Exception as e:
+            flight.error = e
+        finally:
+            if flight.data is None and flight.error is None:
+                flight.error = OSError("Block read interrupted")
+            with self.lock:
+                del self.loading[block_key]
+                if flight.data:
+                    self.insert(block_key, flight.data)
+            flight.done.set()
+
+    def insert(self, block_key, block):
+        # Called with the lock held
+        if block_key in self.ghosts:
+            # Asked for again soon after probation dropped it: worth keeping
+            del self.ghosts[block_key]
+            self.main[block_key] = block
+        else:
+            self.probation[block_key] = block
+            self.probation_size += len(block)
+        self.size += len(block)
+        while self.size > self.max_bytes:
+            if self.probation and (self.probation_size > self.probation_bytes or not self.main):
+                evicted_key, evicted = self.probation.popitem(last=False)
+                self.probation_size -= len(evicted)
+                self.ghosts[evicted_key] = None
+                if len(self.ghosts) > self.ghost_limit:
+                    self.ghosts.popitem(last=False)
+            else:
+                _, evicted = self.main.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def read_ahead(self, key, path, first, last):
+        with self.lock:
+            indexes = [index for index in range(first, last + 1)
+                       if key + (index,) not in self.main and key + (index,) not in self.probation
+                       and key + (index,) not in self.loading]
+            if not indexes:
+                return
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=BLOCK_CACHE_READAHEAD_THREADS,
+                                                   thread_name_prefix='read-ahead')
+        self.executor.submit(self.fill, key, path, indexes)
+
+    def fill(self, key, path, indexes):
+        try:
+            with open(path, 'rb') as f:
+                if file_key(os.fstat(f.fileno())) != key:
+                    return  # replaced or modified since the response opened it
+                for index in indexes:
+                    block_key = key + (index,)
+                    with self.lock:
+                        if block_key in self.main or block_key in self.probation or block_key in self.loading:
+                            continue
+                        flight = self.loading[block_key] = Flight()
+                        self.read_ahead_blocks += 1
+                    self.load(block_key, flight, f)
+        except OSError:
+            pass
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'enabled': self.enabled,
+                'blocks': len(self.probation) + len(self.main),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'probation_bytes': self.probation_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'read_ahead': self.read_ahead_blocks,
+                'evictions': self.evictions,
+                'hit_ratio': (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            }
+
+
+block_cache = BlockCache()
@@ -0,0 +1,111 @@
+import os
+import re
+import zlib
+
+from config import *
+from cache import LRUCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content-Encoding negotiation shared by both server engines.
+# Small bodies (listings, text previews) are compressed whole and kept in
+# compressed_cache; bigger files are compressed while streaming. A fresh
+# "name.gz" / "name.br" next to a file is served instead of compressing it.
+
+PRECOMPRESSED_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+_CODING_RE = re.compile(r'\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*(?:,|$)')
+
+# Compressed listing pages and small files, keyed by (path, etag, encoding)
+compressed_cache = LRUCache(COMPRESS_CACHE_MB * 1024 * 1024)
+
+
+def available_encodings():
+    # On-the-fly encodings, most preferred first
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def accepted_encodings(header):
+    """Codings from an Accept-Encoding header, best first (q-value, then br
+    over gzip). Codings with q=0 are left out; '*' stands for both."""
+    ranked = {}
+    for coding, q in _CODING_RE.findall(header or ''):
+        try:
+            q = float(q) if q else 1.0
+        except ValueError:
+            continue
+        coding = coding.lower()
+        if coding == 'x-gzip':
+            coding = 'gzip'
+        if coding == '*':
+            for name in PRECOMPRESSED_SUFFIXES:
+                ranked.setdefault(name, q)
+        elif coding in PRECOMPRESSED_SUFFIXES:
+            ranked[coding] = q
+    preference = list(PRECOMPRESSED_SUFFIXES)
+    return sorted((c for c, q in ranked.items() if q > 0),
+                  key=lambda c: (-ranked[c], preference.index(c)))
+
+
+def is_compressible(ctype):
+    ctype = ctype.split(';', 1)[0].strip().lower()
+    return ctype.startswith(COMPRESSIBLE_TYPES)
+
+
+def pick_encoding(accepted):
+    for coding in accepted:
+        if coding in available_encodings():
+            return coding
+    return None
+
+
+def find_precompressed(path, fs, accepted):
+    """(encoding, sibling path, sibling stat) for the best precompressed
+    sibling the client accepts, or None. Siblings older than the file are
+    stale and ignored."""
+    for coding in accepted:
+        sibling = path + PRECOMPRESSED_SUFFIXES[coding]
+        try:
+            sibling_fs = os.stat(sibling)
+        except OSError:
+            continue
+        if sibling_fs.st_mtime_ns >= fs.st_mtime_ns and os.path.isfile(sibling):
+            return coding, sibling, sibling_fs
+    return None
+
+
+def variant_etag(etag, encoding):
+    # Each encoding is its own representation, so it gets its own validator
+    return f'{etag[:-1]}-{encoding}"'
+
+
+class StreamCompressor:
+    def __init__(self, encoding):
+        if encoding == 'br':
+            self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            self.compress = self.compressor.process
+            self.flush = self.compressor.finish
+        else:
+            # wbits 31: gzip container with a zero timestamp, so output is reproducible
+            self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            self.compress = self.compressor.compress
+            self.flush = self.compressor.flush
+
+
+def compress(data, encoding):
+    compressor = StreamCompressor(encoding)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compressed_body(key, data, encoding, cacheable=True):
+    """Compressed copy of data, served from compressed_cache when possible."""
+    key = key + (encoding,)
+    body = compressed_cache.get(key) if cacheable else None
+    if body is None:
+        body = compress(data, encoding)
+        if cacheable:
+            compressed_cache.put(key, body, len(body))
+    return body
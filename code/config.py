@@ -1,4 +1,5 @@
 import mimetypes
+import os
 import ipaddress
 
 # Configurations:
@@ -9,9 +10,24 @@ ALLOWED_NETWORKS = [
 
 PORT = 8000
 MAX_UPLOAD_MB = 5000
+UPLOAD_MIN_FREE_MB = 100  # uploads that would leave less free disk space are refused
+UPLOAD_CHUNK_SIZE = 256 * 1024
+UPLOAD_OVERHEAD_BYTES = 1024 * 1024  # multipart headers/boundaries allowed on top of MAX_UPLOAD_MB
 
 FOLDER_TO_SERVE = "." 
 
+# Connection Config
+SERVER_ENGINE = "threaded"  # "threaded" (a pool of WORKER_THREADS threads) or "asyncio"
+SERVER_WORKERS = 1  # processes serving PORT; >1 forks workers under a supervisor (POSIX only, --workers N)
+# Each worker builds its own search index and inotify watches, so both cost N times over (see WATCH_MAX_DIRS)
+ASYNC_EXECUTOR_WORKERS = 16  # asyncio engine: threads for blocking file work
+WORKER_THREADS = 64  # threaded engine: fixed worker pool size (0 = one thread per connection)
+LOAD_SHED_QUEUE_DEPTH = 256  # queued connections beyond this get an immediate 503
+RETRY_AFTER_SECONDS = 5
+KEEPALIVE_TIMEOUT = 15  # seconds an idle keep-alive connection is held open
+KEEPALIVE_MAX_REQUESTS = 500  # requests served on one connection before it is closed
+REQUEST_TIMEOUT = 120  # seconds a read/write may stall while a request is in progress
+
 EXCLUDED_EXTENSIONS = {'.lnk', '.ini', '.url', '.db', '.exe', '.parts'}
 EXCLUDED_UPLOAD_EXT = {
     '.exe', '.msi', '.dll', '.scr', '.com', '.bat', '.cmd',
@@ -33,9 +49,112 @@ MEDIA_EXTS = {
     'image': {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg'}
 }
 
+# Listing Cache Config
+LISTING_CACHE_MB = 64
+LISTING_CACHE_TTL = 10  # seconds; also picks up size/mtime changes of files inside a folder
+LISTING_PAGE_SIZE = 200  # entries rendered per page; bigger folders scroll virtually
+LISTING_MAX_PAGE_SIZE = 1000  # largest ?limit= accepted by the JSON listing
+
+# Compression Config (gzip always; brotli when the 'brotli' package is installed)
+COMPRESSION_ENABLED = True
+COMPRESSIBLE_TYPES = (
+    'text/', 'application/json', 'application/javascript', 'application/xml',
+    'application/xhtml+xml', 'image/svg+xml',
+)
+COMPRESS_MIN_BYTES = 1024  # smaller bodies are sent as-is
+COMPRESS_BUFFER_MAX_KB = 1024  # files up to this size are compressed whole and cached; bigger ones stream
+COMPRESS_STREAM_CHUNK = 256 * 1024
+COMPRESS_CACHE_MB = 32
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Cache-Control Config (sent with ETag/Last-Modified; revalidation answers 304)
+CACHE_CONTROL = {
+    'media': "max-age=86400",  # MEDIA_EXTS
+    'preview': "max-age=300",  # other PREVIEWABLE_EXTS
+    'default': "no-cache",  # any other file: always revalidate
+    'listing': "no-cache",  # directory pages and ?format=json
+}
+
+# Persistent data (thumbnail cache); kept outside the served folder
+DATA_DIR = os.path.join(os.path.expanduser("~"), ".http_hosting")
+
+# Resumable Upload Config (/__upload; the page uploads this way, plain multipart POSTs still work)
+UPLOAD_STATE_DIR = os.path.join(DATA_DIR, "uploads")
+UPLOAD_RESUMABLE_CHUNK_MB = 8
+UPLOAD_PARALLEL_CHUNKS = 4  # chunks a browser sends at once
+UPLOAD_EXPIRE_HOURS = 24  # unfinished uploads idle this long are deleted
+
+# Archive Download Config (?download=zip or ?download=tar on a folder, optionally with name= entries)
+ARCHIVE_DOWNLOADS_ENABLED = True
+ARCHIVE_STORED_EXTS = set().union(*MEDIA_EXTS.values(), {
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.zst',
+    '.docx', '.xlsx', '.pptx', '.epub', '.apk', '.jar', '.pdf', '.m4a', '.flac', '.heic',
+})  # already compressed: zipped as-is instead of deflated
+ARCHIVE_ZIP_LEVEL = 6
+ARCHIVE_READ_CHUNK = 256 * 1024
+
+# Block Cache Config (file bodies served from a shared in-memory cache; 0 = off, files go out with sendfile)
+BLOCK_CACHE_MB = 0  # per process; worth it when many clients stream the same files from a slow disk
+BLOCK_CACHE_BLOCK_KB = 512
+BLOCK_CACHE_READAHEAD = 4  # blocks read ahead of a response reading in order
+BLOCK_CACHE_READAHEAD_THREADS = 2
+
+# Bandwidth Config (response bodies, per worker process; MB/s, fractions allowed; 0 = unlimited)
+BANDWIDTH_TOTAL_MB = 0  # all clients together
+BANDWIDTH_PER_CLIENT_MB = 0  # per client IP
+BANDWIDTH_BURST_SECONDS = 1  # how far ahead of its rate a transfer may get after a pause
+BANDWIDTH_BULK_MB = 16  # whole-file downloads this big, and archives, are bulk; everything else is interactive
+BANDWIDTH_INTERACTIVE_WEIGHT = 4  # an interactive transfer's share of a contended total, relative to a bulk one
+BANDWIDTH_SLICE_KB = 64  # bytes sent between pacing decisions
+
+# Access Log Config (written by a background thread; a full queue drops records rather than stall requests)
+ACCESS_LOG_ENABLED = True  # JSON lines, one per request; the console summary is separate
+ACCESS_LOG_FILE = os.path.join(DATA_DIR, "logs", "access.log")
+ACCESS_LOG_MAX_MB = 64  # rotate past this size
+ACCESS_LOG_ROTATE_HOURS = 24  # and at least this often (0 = size only)
+ACCESS_LOG_BACKUPS = 5  # rotated files kept (access.log.1 is the newest)
+ACCESS_LOG_QUEUE = 10000  # records waiting to be written
+ACCESS_LOG_CONSOLE = True  # also print the one-line summary per request
+
+# Thumbnail Config (Pillow renders any size; without it, only EXIF-embedded JPEG thumbnails)
+THUMBNAILS_ENABLED = True
+THUMB_CACHE_DIR = os.path.join(DATA_DIR, "thumbs")
+THUMB_CACHE_MB = 512
+THUMB_WIDTHS = (160, 320, 640, 1280)  # requested ?w= is rounded up to one of these
+THUMB_GRID_WIDTH = 160  # grid icons
+THUMB_PREVIEW_WIDTH = 1280  # image preview in the file dialog
+THUMB_QUALITY = 80
+THUMB_WORKERS = 2  # render processes
+THUMB_WAIT_SECONDS = 30  # how long a request waits for a free render slot before a 503
+THUMB_RENDER_TIMEOUT = 60
+
+# Subtitle Config (/__vtt/ serves .srt and .vtt files as WebVTT for the video player)
+SUBTITLE_CACHE_MB = 16  # converted subtitles kept in memory
+SUBTITLE_MAX_MB = 8  # bigger files aren't converted
+SUBTITLE_FALLBACK_ENCODINGS = ('cp1252',)  # tried for files that aren't UTF-8 (after charset_normalizer, if installed)
+
+# Live Updates Config
+LIVE_UPDATES_ENABLED = True  # watch the served folder and push changes to open pages (/__events)
+WATCH_COALESCE_SECONDS = 0.25  # changes within this window go out as one update
+WATCH_POLL_SECONDS = 2  # without inotify, viewed folders are polled this often
+WATCH_MAX_DIRS = 0  # inotify watches split between the workers (0 = up to the kernel limit); the rest are polled
+EVENTS_MAX_STREAMS = 512  # open pages receiving updates, per process
+EVENTS_KEEPALIVE_SECONDS = 15
+EVENTS_RETRY_MS = 3000  # how soon a browser reconnects a dropped stream
+
+# Search Config
+SEARCH_ENABLED = True  # index every file name below the served folder for /__search
+SEARCH_RESCAN_SECONDS = 30  # how often folders are checked for changes made outside the server (0 = never)
+SEARCH_MAX_MATCHES = 1000  # matches ranked per query; a more specific query finds the rest
+SEARCH_PAGE_SIZE = 50
+
 # Rate Limiting Config 
-RATE_LIMIT_MAX_REQUESTS = 80
+RATE_LIMIT_MAX_REQUESTS = 600  # per client per window; a listing with thumbnails alone makes dozens (0 = no limit)
 RATE_LIMIT_WINDOW = 60  # seconds
+RATE_LIMIT_SHARDS = 16  # independently locked client tables
+RATE_LIMIT_MAX_CLIENTS = 65536  # clients tracked per process; the longest idle are dropped first
+RATE_LIMIT_SLOTS = 4096  # clients tracked by the shared-memory limiter in multi-process mode
 
 if not mimetypes.inited:
     mimetypes.init()
@@ -43,4 +162,5 @@ mimetypes.add_type('video/mp4', '.mp4')
 mimetypes.add_type('video/mp4', '.mkv') 
 mimetypes.add_type('video/webm', '.webm')
 mimetypes.add_type('text/plain', '.srt')
+mimetypes.add_type('text/plain', '.log')
 mimetypes.add_type('text/vtt', '.vtt')
\ No newline at end of file
@@ -0,0 +1,190 @@
+import json
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+
+from config import *
+
+# Server-Sent Event streams for /__events.
+# A stream lives as long as the page showing a folder, so holding a request
+# thread (or a pool worker) for each would starve everything else. Instead
+# the request handler sends the response headers and hands a duplicate of
+# its socket to the hub, whose single thread owns every stream: it fans
+# published events out to the viewers of a folder, sends keep-alive
+# comments, and drops clients that disconnect or stop reading.
+
+MAX_BUFFERED = 256 * 1024  # unsent bytes after which a stream counts as stuck
+
+
+class EventStream:
+    __slots__ = ('sock', 'folder', 'pending')
+
+    def __init__(self, sock, folder, pending):
+        self.sock = sock
+        self.folder = folder
+        self.pending = pending
+
+
+def format_event(event, data):
+    # json.dumps output has no raw newlines, so one data line is enough
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode('utf-8', 'surrogateescape')
+
+
+class EventHub:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.folders = {}  # folder -> set of EventStream
+        self.incoming = deque()
+        self.outbox = deque()  # (folder, payload)
+        self.selector = None
+        self.wake_r = self.wake_w = None
+        self.thread = None
+        self.sent = 0
+        self.dropped = 0
+
+    def directories(self):
+        with self.lock:
+            return set(self.folders)
+
+    def has_viewers(self, folder):
+        with self.lock:
+            return folder in self.folders
+
+    def count(self):
+        with self.lock:
+            return sum(len(streams) for streams in self.folders.values())
+
+    def attach(self, sock, folder):
+        """Take over sock (response headers already sent) as a stream for
+        folder. Returns False when EVENTS_MAX_STREAMS are open already."""
+        with self.lock:
+            if sum(len(streams) for streams in self.folders.values()) >= EVENTS_MAX_STREAMS:
+                return False
+            if self.thread is None:
+                self.selector = selectors.DefaultSelector()
+                self.wake_r, self.wake_w = socket.socketpair()
+                self.wake_r.setblocking(False)
+                self.wake_w.setblocking(False)
+                self.selector.register(self.wake_r, selectors.EVENT_READ)
+                self.thread = threading.Thread(target=self.run, name='event-hub', daemon=True)
+                self.thread.start()
+            sock.setblocking(False)
+            # Tell EventSource how soon to reconnect if the stream drops
+            stream = EventStream(sock, folder, bytearray(f"retry: {EVENTS_RETRY_MS}\n\n".encode()))
+            self.folders.setdefault(folder, set()).add(stream)
+            self.incoming.append(stream)
+        self.wake()
+        return True
+
+    def publish(self, folder, event, data):
+        if not self.has_viewers(folder):
+            return
+        self.outbox.append((folder, format_event(event, data)))
+        self.wake()
+
+    def wake(self):
+        try:
+            self.wake_w.send(b'\0')
+        except (BlockingIOError, AttributeError):
+            pass  # already woken / hub not started
+
+    # --- Hub thread ---
+
+    def run(self):
+        next_ping = time.monotonic() + EVENTS_KEEPALIVE_SECONDS
+        while True:
+            for key, mask in self.selector.select(max(0, next_ping - time.monotonic())):
+                if key.fileobj is self.wake_r:
+                    try:
+                        while self.wake_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                stream = key.data
+                if mask & selectors.EVENT_READ and not self.check_open(stream):
+                    continue
+                if mask & selectors.EVENT_WRITE:
+                    self.flush(stream)
+
+            while self.incoming:
+                stream = self.incoming.popleft()
+                if stream.sock.fileno() < 0:
+                    continue
+                self.selector.register(stream.sock, selectors.EVENT_READ, stream)
+                self.flush(stream)
+
+            while self.outbox:
+                folder, payload = self.outbox.popleft()
+                with self.lock:
+                    streams = list(self.folders.get(folder, ()))
+                for stream in streams:
+                    self.send(stream, payload)
+
+            if time.monotonic() >= next_ping:
+                # Comment lines keep proxies and NAT from timing the stream out
+                with self.lock:
+                    streams = [s for streams in self.folders.values() for s in streams]
+                for stream in streams:
+                    self.send(stream, b": ping\n\n")
+                next_ping = time.monotonic() + EVENTS_KEEPALIVE_SECONDS
+
+    def check_open(self, stream):
+        # Clients never send anything on the stream, so readable means closed
+        try:
+            if stream.sock.recv(4096):
+                return True
+        except BlockingIOError:
+            return True
+        except OSError:
+            pass
+        self.close(stream)
+        return False
+
+    def send(self, stream, payload):
+        if len(stream.pending) + len(payload) > MAX_BUFFERED:
+            self.dropped += 1
+            self.close(stream)
+            return
+        stream.pending += payload
+        self.sent += 1
+        self.flush(stream)
+
+    def flush(self, stream):
+        if stream.sock.fileno() < 0:
+            return
+        try:
+            while stream.pending:
+                sent = stream.sock.send(stream.pending)
+                del stream.pending[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.close(stream)
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if stream.pending else 0)
+        try:
+            self.selector.modify(stream.sock, events, stream)
+        except KeyError:
+            pass  # still in self.incoming; registered (and flushed again) from there
+
+    def close(self, stream):
+        with self.lock:
+            streams = self.folders.get(stream.folder)
+            if streams is not None:
+                streams.discard(stream)
+                if not streams:
+                    del self.folders[stream.folder]
+        try:
+            self.selector.unregister(stream.sock)
+        except (KeyError, ValueError):
+            pass
+        stream.sock.close()
+
+    def stats(self):
+        return {'streams': self.count(), 'events_sent': self.sent, 'dropped': self.dropped}
+
+
+event_hub = EventHub()
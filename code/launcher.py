@@ -3,6 +3,7 @@ import os
 import subprocess
 import platform
 import ctypes
+import multiprocessing
 import shlex  
 
 try:
@@ -99,16 +100,16 @@ def open_folder_picker():
         except (EOFError, KeyboardInterrupt):
             return None
 
-def launch_server_process(target_folder):
+def launch_server_process(target_folder, options=()):
     system = platform.system()
 
     if getattr(sys, 'frozen', False):
         executable = sys.executable
-        args = [executable, target_folder]
+        args = [executable, target_folder, *options]
     else:
         executable = sys.executable
         script_path = os.path.abspath(__file__)
-        args = [executable, script_path, target_folder]
+        args = [executable, script_path, target_folder, *options]
 
     proc = None
 
@@ -183,9 +184,28 @@ def run_server_in_process(target_folder):
         print("Error: Invalid folder path.")
         input("Press Enter to exit...")
 
+def parse_options(argv):
+    # Returns (folder or None, options to pass on to a relaunched server)
+    folder = None
+    options = []
+    args = iter(argv)
+    for arg in args:
+        if arg == "--workers" or arg.startswith("--workers="):
+            value = arg.partition("=")[2] or next(args, "")
+            try:
+                workers = int(value)
+            except ValueError:
+                print(f"Error: --workers expects a number, got '{value}'")
+                sys.exit(2)
+            server.SERVER_WORKERS = max(1, workers)
+            options += ["--workers", str(server.SERVER_WORKERS)]
+        elif folder is None:
+            folder = arg
+    return folder, options
+
 def main():
-    if len(sys.argv) > 1:
-        target_folder = sys.argv[1]
+    target_folder, options = parse_options(sys.argv[1:])
+    if target_folder:
         if getattr(sys, 'frozen', False):
             attach_console()
         if sys.platform == "win32":
@@ -194,7 +214,7 @@ def main():
     else:
         folder = open_folder_picker()
         if folder:
-            process = launch_server_process(folder)
+            process = launch_server_process(folder, options)
             if process:
                 try:
                     process.wait()
@@ -203,4 +223,6 @@ def main():
         sys.exit()
 
 if __name__ == "__main__":
+    # Thumbnail render processes re-enter here in frozen (PyInstaller) builds
+    multiprocessing.freeze_support()
     main()
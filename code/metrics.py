@@ -0,0 +1,155 @@
+import threading
+from bisect import bisect_left
+
+# Request and transfer metrics for /__metrics, in the Prometheus text format.
+# Recording happens several times per request, so it takes no lock: every
+# thread counts into its own shard (through a threading.local), and a scrape
+# adds the shards up. Shards of threads that have exited are folded into a
+# retired total when the next scrape collects them. Gauges that only the
+# scrape can know (caches, threads, queues) come from the stats() of the
+# objects that own them, passed to render() by the server.
+#
+# Label sets are preformatted strings ('route="file",code="200"'), so a
+# recording is a dict lookup and an add.
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRICS = {
+    # name: (type, help)
+    'http_requests_total': ('counter', "Requests answered, by route, method and status code"),
+    'http_request_duration_seconds': ('histogram', "Time from reading the request line to the end of the response, by route"),
+    'http_response_bytes_total': ('counter', "Bytes sent, headers included, by route"),
+    'http_request_bytes_total': ('counter', "Request body bytes received, by route"),
+    'http_requests_active': ('gauge', "Requests being answered"),
+    'http_connections_active': ('gauge', "Open client connections"),
+    'http_connections_total': ('counter', "Client connections accepted"),
+    'http_access_denied_total': ('counter', "Requests refused by the network allowlist or the rate limiter, by reason"),
+}
+
+
+class Shard:
+    __slots__ = ('thread', 'counters', 'histograms')
+
+    def __init__(self, thread):
+        self.thread = thread
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [count per bucket..., count above the last, sum]
+
+
+def merge(into, shard):
+    for key, value in shard.counters.copy().items():
+        into.counters[key] = into.counters.get(key, 0) + value
+    for key, values in shard.histograms.copy().items():
+        total = into.histograms.setdefault(key, [0] * (len(LATENCY_BUCKETS) + 2))
+        for i, value in enumerate(list(values)):
+            total[i] += value
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+class Metrics:
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()  # only for adding and retiring shards
+        self.shards = []
+        self.retired = Shard(None)
+
+    def shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = Shard(threading.current_thread())
+            with self.lock:
+                self.shards.append(shard)
+            return shard
+
+    def inc(self, name, labels='', value=1):
+        counters = self.shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        histograms = self.shard().histograms
+        key = (name, labels)
+        buckets = histograms.get(key)
+        if buckets is None:
+            buckets = histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+        buckets[bisect_left(LATENCY_BUCKETS, value)] += 1
+        buckets[-1] += value
+
+    def request_done(self, route, method, code, seconds, bytes_out, bytes_in):
+        """Record one answered request; called by both engines."""
+        shard = self.shard()
+        counters = shard.counters
+        key = ('http_requests_total', f'route="{route}",method="{escape(method)}",code="{code}"')
+        counters[key] = counters.get(key, 0) + 1
+        route_label = f'route="{route}"'
+        key = ('http_response_bytes_total', route_label)
+        counters[key] = counters.get(key, 0) + bytes_out
+        if bytes_in:
+            key = ('http_request_bytes_total', route_label)
+            counters[key] = counters.get(key, 0) + bytes_in
+        self.observe('http_request_duration_seconds', route_label, seconds)
+
+    def collect(self):
+        total = Shard(None)
+        with self.lock:
+            alive = []
+            for shard in self.shards:
+                if shard.thread.is_alive():
+                    alive.append(shard)
+                else:
+                    merge(self.retired, shard)
+            self.shards = alive
+            merge(total, self.retired)
+            for shard in alive:
+                merge(total, shard)
+        return total
+
+    def render(self, gauges=()):
+        """The exposition text. gauges are (name, type, help, [(labels, value)])
+        families computed at scrape time."""
+        total = self.collect()
+        families = {}
+        for (name, labels), value in total.counters.items():
+            families.setdefault(name, []).append((labels, value))
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            if kind == 'histogram':
+                samples = sorted((labels, values) for (metric, labels), values in total.histograms.items()
+                                 if metric == name)
+            else:
+                samples = sorted(families.get(name, [('', 0)]))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind != 'histogram':
+                lines.extend(f"{name}{{{labels}}} {format_value(value)}" if labels else f"{name} {format_value(value)}"
+                             for labels, value in samples)
+                continue
+            for labels, values in samples:
+                prefix = labels + ',' if labels else ''
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), values):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {format_value(float(values[-1]))}")
+                lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        for name, kind, help_text, samples in gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                if value is None:
+                    continue
+                lines.append(f"{name}{{{labels}}} {format_value(value)}" if labels else f"{name} {format_value(value)}")
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+metrics = Metrics()
@@ -0,0 +1,196 @@
+import os
+import re
+import secrets
+
+# Incremental multipart/form-data parsing for uploads.
+# The parser never holds more than one read chunk plus a boundary in memory,
+# and file parts are streamed straight to disk.
+
+MAX_PART_HEADER_SIZE = 16 * 1024
+
+_PREAMBLE, _BOUNDARY, _HEADERS, _BODY, _DONE = range(5)
+
+_PARAM_RE = re.compile(r';\s*([\w*-]+)\s*=\s*("(?:[^"\\]|\\.)*"|[^;]*)')
+
+
+class UploadError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def get_boundary(content_type):
+    match = re.search(r'boundary=("?)([^";]+)\1', content_type)
+    if not match:
+        return None
+    return match.group(2).encode('latin-1')
+
+
+def parse_disposition(value):
+    params = {}
+    for key, val in _PARAM_RE.findall(value):
+        val = val.strip()
+        if val.startswith('"') and val.endswith('"'):
+            val = re.sub(r'\\(.)', r'\1', val[1:-1])
+        params[key.lower()] = val
+    return params
+
+
+def clean_filename(filename, excluded_ext):
+    """The bare file name an upload may be saved as; raises UploadError for
+    names with an excluded extension. Returns '' when nothing is left."""
+    safe_filename = os.path.basename(filename.replace('\\', '/'))
+    if not safe_filename:
+        return ''
+
+    # exclude certain file using extension names:
+    _, ext = os.path.splitext(safe_filename)
+    if safe_filename in ('.', '..') or ext.lower() in excluded_ext:
+        raise UploadError(400, f"Upload failed: File type '{ext}' is marked Unsafe")
+    return safe_filename
+
+
+class MultipartParser:
+    """Push parser: feed() body chunks, get back a list of events.
+
+    Events are ('part', headers), ('data', bytes) and ('end', None);
+    header names are lowercased.
+    """
+
+    def __init__(self, boundary):
+        self.delimiter = b'\r\n--' + boundary
+        # Pretend a CRLF precedes the body so the first boundary matches the delimiter
+        self.buffer = bytearray(b'\r\n')
+        self.state = _PREAMBLE
+
+    @property
+    def finished(self):
+        return self.state == _DONE
+
+    def feed(self, data):
+        buf = self.buffer
+        buf += data
+        events = []
+        delimiter = self.delimiter
+
+        while True:
+            if self.state in (_PREAMBLE, _BODY):
+                idx = buf.find(delimiter)
+                if idx == -1:
+                    # Keep enough bytes to recognise a delimiter split across chunks
+                    safe = len(buf) - len(delimiter) + 1
+                    if safe > 0:
+                        if self.state == _BODY:
+                            events.append(('data', bytes(buf[:safe])))
+                        del buf[:safe]
+                    break
+                if self.state == _BODY:
+                    if idx:
+                        events.append(('data', bytes(buf[:idx])))
+                    events.append(('end', None))
+                del buf[:idx + len(delimiter)]
+                self.state = _BOUNDARY
+
+            elif self.state == _BOUNDARY:
+                if len(buf) < 2:
+                    break
+                if buf[:2] == b'--':
+                    self.state = _DONE
+                    continue
+                line_end = buf.find(b'\r\n')
+                if line_end == -1:
+                    if len(buf) > MAX_PART_HEADER_SIZE:
+                        raise UploadError(400, "Malformed multipart boundary")
+                    break
+                del buf[:line_end + 2]
+                self.state = _HEADERS
+
+            elif self.state == _HEADERS:
+                if buf[:2] == b'\r\n':
+                    header_end, skip = 0, 2
+                else:
+                    header_end, skip = buf.find(b'\r\n\r\n'), 4
+                if header_end == -1:
+                    if len(buf) > MAX_PART_HEADER_SIZE:
+                        raise UploadError(400, "Multipart headers too large")
+                    break
+                headers = {}
+                for line in bytes(buf[:header_end]).decode('utf-8', 'replace').split('\r\n'):
+                    name, sep, value = line.partition(':')
+                    if sep:
+                        headers[name.strip().lower()] = value.strip()
+                del buf[:header_end + skip]
+                events.append(('part', headers))
+                self.state = _BODY
+
+            else:
+                # Epilogue after the closing boundary is ignored
+                buf.clear()
+                break
+
+        return events
+
+
+class UploadSession:
+    """Streams the files[] parts of a multipart body into target_dir.
+
+    Each file is written to a hidden '.parts' temp file next to its destination
+    and renamed into place only once its closing boundary has been seen.
+    """
+
+    def __init__(self, target_dir, max_file_bytes, excluded_ext):
+        self.target_dir = target_dir
+        self.max_file_bytes = max_file_bytes
+        self.excluded_ext = excluded_ext
+        self.saved = []
+        self.current = None
+        self.current_name = None
+        self.current_size = 0
+
+    def handle(self, events):
+        for kind, value in events:
+            if kind == 'part':
+                self.begin_part(value)
+            elif kind == 'data':
+                if self.current is not None:
+                    self.current_size += len(value)
+                    if self.current_size > self.max_file_bytes:
+                        raise UploadError(413, "Upload failed: File exceeds maximum size limit of "
+                                              f"{self.max_file_bytes // (1024 * 1024)} MB")
+                    self.current.write(value)
+            elif kind == 'end':
+                self.end_part()
+
+    def begin_part(self, headers):
+        params = parse_disposition(headers.get('content-disposition', ''))
+        if params.get('name') != 'files[]' or 'filename' not in params:
+            return
+        safe_filename = clean_filename(params['filename'], self.excluded_ext)
+        if not safe_filename:
+            return
+
+        tmp_path = os.path.join(self.target_dir, f".upload-{secrets.token_hex(8)}.parts")
+        self.current = open(tmp_path, 'xb')
+        self.current_name = safe_filename
+        self.current_size = 0
+
+    def end_part(self):
+        if self.current is None:
+            return
+        tmp_path = self.current.name
+        self.current.close()
+        self.current = None
+        os.replace(tmp_path, os.path.join(self.target_dir, self.current_name))
+        self.saved.append(self.current_name)
+
+    def abort(self):
+        if self.current is None:
+            return
+        tmp_path = self.current.name
+        self.current.close()
+        self.current = None
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
@@ -0,0 +1,309 @@
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from config import *
+from accesslog import access_log
+
+# Filename search over the whole served tree (/__search).
+# Every directory contributes one block of "name\n" lines ("name/\n" for
+# folders). The lowercased blocks are joined into a single string, ordered
+# so that each subtree is contiguous, and a query is a str.find() over that
+# string (or over the slice covering the folder searched in). That keeps a
+# million names in a few tens of MB and answers in milliseconds without a
+# per-name Python loop. A background thread builds the index at startup, then keeps
+# it current: directories reported by refresh() are rescanned at once and
+# every SEARCH_RESCAN_SECONDS all directories are checked for a new mtime.
+
+DirRecord = namedtuple('DirRecord', 'mtime_ns names subdirs')
+Snapshot = namedtuple('Snapshot', 'lower starts keys paths records unaligned entries')
+
+EMPTY = Snapshot('\n', array('Q', [1]), [], [], [], frozenset(), 0)
+WORD_BREAKS = ' ._-()[]'
+PUBLISH_INTERVAL = 2  # seconds between partial snapshots while the first scan runs
+SETTLE_SECONDS = 0.5  # batch bursts of changes (e.g. a multi-file upload) into one rebuild
+
+
+def dir_key(rel):
+    # Sorting by path components keeps every subtree in one contiguous run
+    return tuple(rel.split('/')) if rel else ()
+
+
+class SearchIndex:
+    def __init__(self):
+        self.root = None
+        self.dirs = {}  # path relative to root ('' for the root) -> DirRecord
+        self.lock = threading.Lock()
+        self.pending = set()  # directories to rescan
+        self.wakeup = threading.Event()
+        self.snapshot = EMPTY
+        self.ready = False
+        self.thread = None
+        self.rebuilds = 0
+        self.errors = 0
+        self.build_seconds = None
+
+    def start(self, root):
+        if self.thread is not None:
+            return
+        self.root = os.path.abspath(root)
+        self.thread = threading.Thread(target=self.run, name='search-index', daemon=True)
+        self.thread.start()
+
+    def refresh(self, path):
+        """Rescan the directory at path soon; called after the server itself
+        changes a folder. Other changes are picked up by the periodic check."""
+        if self.root is None:
+            return
+        rel = os.path.relpath(os.path.abspath(path), self.root).replace(os.sep, '/')
+        if rel == '.':
+            rel = ''
+        elif rel.startswith('..'):
+            return
+        with self.lock:
+            self.pending.add(rel)
+        self.wakeup.set()
+
+    # --- Indexing (background thread) ---
+
+    def run(self):
+        started = time.monotonic()
+        try:
+            self.scan_tree('')
+        except Exception as e:
+            self.failed(e)
+        self.publish()
+        self.build_seconds = time.monotonic() - started
+        self.ready = True
+
+        next_rescan = time.monotonic() + SEARCH_RESCAN_SECONDS
+        while True:
+            timeout = max(0, next_rescan - time.monotonic()) if SEARCH_RESCAN_SECONDS else None
+            if self.wakeup.wait(timeout):
+                time.sleep(SETTLE_SECONDS)
+                self.wakeup.clear()
+            try:
+                changed = self.update_pending()
+                if SEARCH_RESCAN_SECONDS and time.monotonic() >= next_rescan:
+                    changed = self.rescan_changed() or changed
+                    next_rescan = time.monotonic() + SEARCH_RESCAN_SECONDS
+                if changed:
+                    self.publish()
+            except Exception as e:
+                self.failed(e)
+
+    def failed(self, error):
+        self.errors += 1
+        access_log.message(f"Search index error: {error}")
+
+    def scan_dir(self, rel):
+        path = os.path.join(self.root, rel) if rel else self.root
+        mtime_ns = os.stat(path).st_mtime_ns
+        lines = []
+        subdirs = []
+        with os.scandir(path) as it:
+            for entry in it:
+                name = entry.name
+                if os.path.splitext(name)[1].lower() in EXCLUDED_EXTENSIONS:
+                    continue
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    lines.append(name + '/\n')
+                    # Symlinked folders are listed but not entered; they can loop
+                    if not entry.is_symlink():
+                        subdirs.append(name)
+                else:
+                    lines.append(name + '\n')
+        return DirRecord(mtime_ns, ''.join(lines), tuple(subdirs))
+
+    def scan_tree(self, rel):
+        stack = [rel]
+        last_publish = time.monotonic()
+        while stack:
+            rel = stack.pop()
+            try:
+                record = self.scan_dir(rel)
+            except OSError:
+                continue
+            with self.lock:
+                self.dirs[rel] = record
+            stack.extend(f"{rel}/{name}" if rel else name for name in record.subdirs)
+            if not self.ready and time.monotonic() - last_publish > PUBLISH_INTERVAL:
+                # Make a large tree searchable while the first scan is still running
+                self.publish()
+                last_publish = time.monotonic()
+
+    def remove_tree(self, rel):
+        prefix = rel + '/'
+        with self.lock:
+            for key in [k for k in self.dirs if k == rel or k.startswith(prefix) or not rel]:
+                del self.dirs[key]
+
+    def update_dir(self, rel):
+        try:
+            record = self.scan_dir(rel)
+        except OSError:
+            self.remove_tree(rel)
+            return
+        with self.lock:
+            old = self.dirs.get(rel)
+            self.dirs[rel] = record
+        old_subdirs = set(old.subdirs) if old else set()
+        for name in old_subdirs - set(record.subdirs):
+            self.remove_tree(f"{rel}/{name}" if rel else name)
+        for name in set(record.subdirs) - old_subdirs:
+            self.scan_tree(f"{rel}/{name}" if rel else name)
+
+    def update_pending(self):
+        with self.lock:
+            pending, self.pending = self.pending, set()
+        for rel in pending:
+            self.update_dir(rel)
+        return bool(pending)
+
+    def rescan_changed(self):
+        # A folder's mtime moves whenever an entry in it is added, removed or renamed
+        changed = False
+        with self.lock:
+            known = [(rel, record.mtime_ns) for rel, record in self.dirs.items()]
+        for rel, mtime_ns in known:
+            try:
+                current = os.stat(os.path.join(self.root, rel) if rel else self.root).st_mtime_ns
+            except OSError:
+                current = None
+            if current != mtime_ns:
+                self.update_dir(rel)
+                changed = True
+        return changed
+
+    def publish(self):
+        with self.lock:
+            items = sorted(self.dirs.items(), key=lambda item: dir_key(item[0]))
+        parts = ['\n']
+        starts = array('Q')
+        unaligned = set()
+        offset = 1
+        entries = 0
+        for i, (rel, record) in enumerate(items):
+            lower = record.names.lower()
+            if len(lower) != len(record.names):
+                # A few characters change length when lowercased (see entry())
+                unaligned.add(i)
+            starts.append(offset)
+            parts.append(lower)
+            offset += len(lower)
+            entries += lower.count('\n')
+        starts.append(offset)
+        self.snapshot = Snapshot(''.join(parts), starts, [dir_key(rel) for rel, _ in items],
+                                 [rel for rel, _ in items], [record for _, record in items],
+                                 frozenset(unaligned), entries)
+        self.rebuilds += 1
+
+    # --- Queries ---
+
+    def search(self, query, scope=''):
+        """Matches for query as (rank, snapshot, folder index, text offset)
+        tuples, best first and at most SEARCH_MAX_MATCHES of them. Every
+        word of the query must occur in the name; scope limits the search to
+        a subtree. Rank 0 is an exact name (or name minus extension), 1 a
+        name starting with the query, 2 a match at a word start, 3 any other.
+        """
+        terms = query.lower().split()
+        if not terms:
+            return []
+        snap = self.snapshot
+        lower = snap.lower
+
+        # Offsets covering the scope's subtree
+        key = dir_key(scope.strip('/'))
+        first = bisect_left(snap.keys, key)
+        last = bisect_left(snap.keys, key + ('\U0010ffff',))
+        if first >= last:
+            return []
+        lo, hi = snap.starts[first], snap.starts[last]
+
+        if len(terms) > 1:
+            # Drive the scan with the rarest word so the others filter few names
+            counts = {term: lower.count(term, lo, hi) for term in terms}
+            primary = min(terms, key=counts.get)
+            if not counts[primary]:
+                return []
+        else:
+            primary = terms[0]
+        others = [term for term in terms if term is not primary]
+        phrase = ' '.join(terms)
+        lead = terms[0]
+
+        matches = []
+        seen = set()
+
+        def collect(pos):
+            start = lower.rfind('\n', 0, pos) + 1
+            end = lower.find('\n', pos)
+            if start in seen:
+                return end
+            name = lower[start:end].rstrip('/')
+            if all(term in name for term in others):
+                seen.add(start)
+                # Ranked by where the query's first word sits in the name
+                at = name.find(lead)
+                if name == phrase or os.path.splitext(name)[0] == phrase:
+                    rank = 0
+                elif at == 0:
+                    rank = 1
+                else:
+                    rank = 2 if name[at - 1] in WORD_BREAKS else 3
+                folder = bisect_right(snap.starts, start, first, last) - 1
+                matches.append((rank, snap.paths[folder].count('/') + bool(snap.paths[folder]),
+                                len(name), start, folder))
+            return end
+
+        pos = lower.find(primary, lo, hi)
+        while pos != -1 and len(matches) < SEARCH_MAX_MATCHES:
+            pos = lower.find(primary, collect(pos), hi)
+        if pos != -1:
+            # Too common to rank every match: make sure names starting with
+            # the query are among those kept
+            needle = '\n' + primary
+            found = len(matches)
+            pos = lower.find(needle, lo - 1, hi)
+            while pos != -1 and len(matches) - found < SEARCH_MAX_MATCHES:
+                pos = lower.find(needle, collect(pos + 1), hi)
+
+        matches.sort()
+        return [(rank, snap, folder, start) for rank, _, _, start, folder in matches[:SEARCH_MAX_MATCHES]]
+
+    @staticmethod
+    def entry(snap, folder, start):
+        """(name, path relative to the root, is_dir) of a search match."""
+        record = snap.records[folder]
+        offset = start - snap.starts[folder]
+        if folder in snap.unaligned:
+            # Offsets in the lowered text don't map onto the original here; go by line number
+            line = record.names.split('\n')[snap.lower.count('\n', snap.starts[folder], start)]
+        else:
+            line = record.names[offset:record.names.find('\n', offset)]
+        is_dir = line.endswith('/')
+        name = line[:-1] if is_dir else line
+        rel = snap.paths[folder]
+        return name, f"{rel}/{name}" if rel else name, is_dir
+
+    def stats(self):
+        return {
+            'ready': self.ready,
+            'folders': len(self.snapshot.paths),
+            'entries': self.snapshot.entries,
+            'text_chars': len(self.snapshot.lower),
+            'rebuilds': self.rebuilds,
+            'errors': self.errors,
+            'build_seconds': round(self.build_seconds, 3) if self.build_seconds is not None else None,
+        }
+
+
+search_index = SearchIndex()
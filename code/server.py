@@ -8,61 +8,410 @@ import io
 import datetime
 import socket
 import re
-import ipaddress
 import threading
 import time
 import json
-from collections import defaultdict
+import stat
+import shutil
+import queue
+import select
+import hashlib
+import email.utils
+import secrets
+import functools
+import weakref
+from collections import namedtuple
 
 from config import * 
+from cache import LRUCache
+from access import RateLimiter, NetworkAllowlist
+from thumbnails import thumbnail_service, ThumbnailBusy, THUMBNAIL_EXTS, pick_width
+import compression
+import archive
+from assets import LISTING_CSS, LISTING_JS, STATIC_ASSETS
+from search import search_index
+from events import event_hub
+from watcher import FileWatcher
+import workers
+from multipart import MultipartParser, UploadSession, UploadError, get_boundary
+from uploads import resumable_uploads
+import subtitles
+from blockcache import block_cache
+from bandwidth import bandwidth
+from metrics import metrics
+from accesslog import access_log
 
 try:
     import segno
 except ImportError:
     segno = None
 
-class RateLimiter:
-    def __init__(self):
-        self.requests = defaultdict(list)
-        self.lock = threading.Lock()
+rate_limiter = RateLimiter()
+allowlist = NetworkAllowlist(ALLOWED_NETWORKS)
 
-    def is_allowed(self, ip):
-        now = time.time()
-        with self.lock:
-            # Filter out timestamps older than the window
-            self.requests[ip] = [t for t in self.requests[ip] if now - t < RATE_LIMIT_WINDOW]
-            
-            if len(self.requests[ip]) >= RATE_LIMIT_MAX_REQUESTS:
-                return False
-            
-            self.requests[ip].append(now)
-            return True
+def access_denied(client_ip):
+    """None when the client may be served, else (status, message, extra
+    headers) for the refusal. Shared by both server engines."""
+    try:
+        allowed = client_ip in allowlist
+    except ValueError:
+        return 403, "Forbidden: Invalid IP address.", []
+    if not allowed:
+        access_log.message(f"BLOCKED IP: {client_ip}", level='warning')
+        metrics.inc('http_access_denied_total', 'reason="network"')
+        return 403, "Forbidden: IP not allowed.", []
 
-rate_limiter = RateLimiter()
+    if RATE_LIMIT_MAX_REQUESTS and not rate_limiter.is_allowed(client_ip):
+        access_log.message(f"RATE LIMIT EXCEEDED: {client_ip}", level='warning')
+        metrics.inc('http_access_denied_total', 'reason="rate_limit"')
+        # The sliding estimate decays continuously; the window boundary is a safe upper bound
+        retry_after = int(RATE_LIMIT_WINDOW - time.time() % RATE_LIMIT_WINDOW) + 1
+        return 429, "Too Many Requests", [("Retry-After", str(retry_after))]
+    return None
+
+# Scanned directory entries and rendered listing pages, keyed by path and
+# validated against the directory mtime.
+listing_cache = LRUCache(LISTING_CACHE_MB * 1024 * 1024, max_age=LISTING_CACHE_TTL)
+
+# More ranges than this in one request are treated as abuse and the Range
+# header is ignored (RFC 7233 section 6.1)
+MAX_BYTE_RANGES = 64
+
+# TCP_CORK (Linux) / TCP_NOPUSH (BSD, macOS) hold back partial frames so the
+# response headers leave in the same segment as the first file bytes.
+TCP_CORK = getattr(socket, 'TCP_CORK', None) or getattr(socket, 'TCP_NOPUSH', None)
+
+# Sockets handed over to another owner mid-request (the /__events hub):
+# closing the server's handle is fine, shutting the connection down is not.
+detached_requests = weakref.WeakSet()
+
+class DetachableMixin:
+    def shutdown_request(self, request):
+        if request in detached_requests:
+            detached_requests.discard(request)
+            self.close_request(request)
+            return
+        super().shutdown_request(request)
+
+class CountingSocketWriter(io.BufferedIOBase):
+    # Unbuffered socket writer (as socketserver uses) that counts what it sends
+    def __init__(self, sock):
+        self.sock = sock
+        self.written = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.sock.sendall(b)
+        with memoryview(b) as view:
+            self.written += view.nbytes
+            return view.nbytes
+
+    def fileno(self):
+        return self.sock.fileno()
 
 # For multiple users at once
-class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+class ThreadedTCPServer(DetachableMixin, socketserver.ThreadingMixIn, socketserver.TCPServer):
     daemon_threads = True
     allow_reuse_address = True
 
+OVERLOAD_BODY = b"Server busy, please retry shortly.\n"
+OVERLOAD_RESPONSE = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Retry-After: " + str(RETRY_AFTER_SECONDS).encode() + b"\r\n"
+    b"Content-Type: text/plain\r\n"
+    b"Content-Length: " + str(len(OVERLOAD_BODY)).encode() + b"\r\n"
+    b"Connection: close\r\n\r\n" + OVERLOAD_BODY
+)
+
+# Fixed number of worker threads fed from a bounded queue of accepted sockets
+class PooledTCPServer(DetachableMixin, socketserver.TCPServer):
+    allow_reuse_address = True
+    request_queue_size = 128  # listen() backlog
+
+    def __init__(self, server_address, RequestHandlerClass, bind_and_activate=True,
+                 workers=WORKER_THREADS, shed_threshold=LOAD_SHED_QUEUE_DEPTH):
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
+        self.pending = queue.Queue()
+        self.shed_threshold = shed_threshold
+        self.stats_lock = threading.Lock()
+        self.busy = 0
+        self.served = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.workers = []
+        for i in range(workers):
+            t = threading.Thread(target=self.worker, name=f"worker-{i}", daemon=True)
+            t.start()
+            self.workers.append(t)
+
+    def process_request(self, request, client_address):
+        # Runs on the accept loop: shed load instead of queueing without bound
+        if self.pending.qsize() >= self.shed_threshold:
+            self.reject(request)
+            return
+        self.pending.put((request, client_address, time.monotonic()))
+
+    def reject(self, request):
+        with self.stats_lock:
+            self.rejected += 1
+        try:
+            request.setblocking(False)
+            request.send(OVERLOAD_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def worker(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            request, client_address, queued_at = item
+            waited = time.monotonic() - queued_at
+            with self.stats_lock:
+                self.busy += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self.stats_lock:
+                    self.busy -= 1
+                    self.served += 1
+
+    def has_waiters(self):
+        return not self.pending.empty()
+
+    def server_close(self):
+        super().server_close()
+        for _ in self.workers:
+            self.pending.put(None)
+
+    def stats(self):
+        with self.stats_lock:
+            started = self.served + self.busy
+            return {
+                'workers': len(self.workers),
+                'busy': self.busy,
+                'queue_depth': self.pending.qsize(),
+                'shed_threshold': self.shed_threshold,
+                'served': self.served,
+                'rejected': self.rejected,
+                'queue_wait_avg_ms': round(1000 * self.wait_total / started, 3) if started else 0.0,
+                'queue_wait_max_ms': round(1000 * self.wait_max, 3),
+            }
+
+# Server-internal endpoints live under a reserved "/__" prefix.
+# Keys ending in "/" take the whole subtree below them.
+INTERNAL_ROUTES = {
+    '/__status': 'do_status',
+    '/__metrics': 'do_metrics',
+    '/__thumb/': 'do_thumb',
+    '/__static/': 'do_static',
+    '/__vtt/': 'do_vtt',
+    '/__search': 'do_search',
+    '/__events': 'do_events',
+    '/__upload': 'do_upload',
+    '/__upload/': 'do_upload',
+}
+
+def find_internal_route(url_path):
+    if not url_path.startswith('/__'):
+        return None
+    route = INTERNAL_ROUTES.get(url_path)
+    if route is None:
+        end = url_path.find('/', 3)
+        if end != -1:
+            route = INTERNAL_ROUTES.get(url_path[:end + 1])
+    return route
+
 # Request Handler 
 class ModernHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.wfile = CountingSocketWriter(self.connection)
+        self.requests_handled = 0
+        metrics.inc('http_connections_total')
+        metrics.inc('http_connections_active')
+
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            metrics.inc('http_connections_active', value=-1)
+
+    def handle_one_request(self):
+        self.content_length = None
+        self.stream_encoding = None
+        self.body_consumed = False
+        self.transfer = None
+        self.status_code = None
+        self.metric_route = 'other'
+        if self.requests_handled and not self.wait_for_next_request():
+            self.close_connection = True
+            return
+        self.connection.settimeout(REQUEST_TIMEOUT)
+        started = time.perf_counter()
+        written = self.wfile.written
+        metrics.inc('http_requests_active')
+        try:
+            super().handle_one_request()
+        finally:
+            metrics.inc('http_requests_active', value=-1)
+            if self.transfer is not None:
+                self.transfer.close()
+            if self.status_code is not None:
+                seconds = time.perf_counter() - started
+                bytes_out = self.wfile.written - written
+                bytes_in = self.body_length() if self.body_consumed else 0
+                metrics.request_done(self.metric_route, self.command, self.status_code, seconds, bytes_out, bytes_in)
+                headers = getattr(self, 'headers', None)
+                access_log.request(self.client_address[0], self.requestline, self.command, self.path,
+                                   self.status_code, seconds, bytes_out, bytes_in, self.metric_route,
+                                   headers.get('Range') if headers else None,
+                                   headers.get('User-Agent') if headers else None)
+
+    def body_length(self):
+        try:
+            return max(0, int(self.headers.get('Content-Length', 0)))
+        except ValueError:
+            return 0
+
+    def log_request(self, code='-', size='-'):
+        # The access log entry is written once the response is done (handle_one_request)
+        if isinstance(code, int):
+            self.status_code = int(code)
+
+    def wait_for_next_request(self):
+        # Idle keep-alive connection: wait quietly for the next request line.
+        # With a worker pool, an idle connection gives its thread up as soon as
+        # other connections are queued.
+        sock = self.connection
+        try:
+            # Pipelined requests are already sitting in the read buffer
+            sock.settimeout(0)
+            if self.rfile.peek(1):
+                return True
+            deadline = time.monotonic() + KEEPALIVE_TIMEOUT
+            has_waiters = getattr(self.server, 'has_waiters', None)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or (has_waiters and has_waiters()):
+                    return False
+                if wait_readable(sock, min(remaining, 0.5)):
+                    sock.settimeout(REQUEST_TIMEOUT)
+                    return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+
+    def parse_request(self):
+        if not super().parse_request():
+            return False
+        self.requests_handled += 1
+        if self.requests_handled >= KEEPALIVE_MAX_REQUESTS:
+            self.close_connection = True
+        return True
+
+    def handle_expect_100(self):
+        # Refuse an upload before the client starts sending its body
+        if self.command == 'POST':
+            try:
+                content_length = int(self.headers.get('Content-Length', 0))
+            except ValueError:
+                content_length = 0
+            target_dir = self.translate_path(self.path)
+            if not os.path.isdir(target_dir):
+                target_dir = os.path.dirname(target_dir)
+            error = check_upload_size(content_length, target_dir)
+            if error:
+                self.send_error(*error)
+                return False
+        self.wfile.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+        return True
+
+    def has_unread_body(self):
+        headers = getattr(self, 'headers', None)
+        if headers is None or self.body_consumed:
+            return False
+        return headers.get('Content-Length', '0').strip() not in ('', '0') or 'Transfer-Encoding' in headers
+
+    def end_headers(self):
+        # An unread request body would be parsed as the next request line
+        if self.has_unread_body():
+            self.close_connection = True
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        else:
+            if self.request_version == 'HTTP/1.0':
+                self.send_header('Connection', 'keep-alive')
+            self.send_header('Keep-Alive', f'timeout={KEEPALIVE_TIMEOUT}')
+        super().end_headers()
+
+    def send_error(self, code, message=None, explain=None, headers=()):
+        # Same as BaseHTTPRequestHandler.send_error, minus the unconditional
+        # "Connection: close": end_headers() decides whether the connection survives.
+        try:
+            shortmsg, longmsg = self.responses[code]
+        except KeyError:
+            shortmsg, longmsg = '???', '???'
+        if message is None:
+            message = shortmsg
+        if explain is None:
+            explain = longmsg
+        self.log_error("code %d, message %s", code, message)
+        self.send_response(code, message)
+
+        body = None
+        if code >= 200 and code not in (204, 205, 304):
+            content = (self.error_message_format % {
+                'code': code,
+                'message': html.escape(message, quote=False),
+                'explain': html.escape(explain, quote=False)
+            })
+            body = content.encode('UTF-8', 'replace')
+            self.send_header("Content-Type", self.error_content_type)
+            self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+
+        if self.command != 'HEAD' and body:
+            self.wfile.write(body)
     
     def log_message(self, format, *args):
-        sys.stderr.write("%s - - [%s] %s\n" %
-                         (self.client_address[0],
-                          self.log_date_time_string(),
-                          format%args))
+        # Errors http.server reports (bad request lines, send_error)
+        access_log.message("%s - - [%s] %s" % (self.client_address[0], self.log_date_time_string(), format % args),
+                           stream=sys.stderr)
 
     def send_head(self):
         path = self.translate_path(self.path)
         f = None
+        self.metric_route = 'file'
         if os.path.isdir(path):
-            if not self.path.endswith('/'):
+            self.metric_route = 'listing'
+            parts = urllib.parse.urlsplit(self.path)
+            if not parts.path.endswith('/'):
                 self.send_response(301)
-                self.send_header("Location", self.path + "/")
+                self.send_header("Location", urllib.parse.urlunsplit(parts._replace(path=parts.path + '/')))
+                self.send_header("Content-Length", "0")
                 self.end_headers()
                 return None
+            query = urllib.parse.parse_qs(parts.query)
+            if query.get('format') == ['json']:
+                return self.list_directory(path)
+            if 'download' in query:
+                self.metric_route = 'archive'
+                self.send_archive(path, parts.query)
+                return None
             for index in "index.html", "index.htm":
                 index = os.path.join(path, index)
                 if os.path.exists(index):
@@ -70,6 +419,7 @@ class ModernHandler(http.server.SimpleHTTPRequestHandler):
                     break
             else:
                 return self.list_directory(path)
+            self.metric_route = 'file'
         
         ctype = self.guess_type(path)
         
@@ -79,63 +429,258 @@ class ModernHandler(http.server.SimpleHTTPRequestHandler):
             self.send_error(404, "File not found")
             return None
 
+        try:
+            fs = os.fstat(f.fileno())
+        except OSError:
+            f.close()
+            self.send_error(404, "File not found")
+            return None
+
+        encoding, sibling, etag, vary = negotiate_file(
+            path, fs, ctype, self.headers, can_stream=self.request_version != 'HTTP/1.0')
+        cache_control = cache_control_for(path)
+        if is_not_modified(self.headers, etag, fs.st_mtime):
+            f.close()
+            self.send_not_modified(etag, cache_control, fs.st_mtime, vary)
+            return None
+
         # Handle Range Requests (Video Seeking)
-        if "Range" in self.headers:
-            self.handle_range_request(f, path, ctype)
-            return None 
+        if "Range" in self.headers and encoding is None:
+            ranges = requested_ranges(self.headers, fs, etag)
+            if ranges is not None:
+                self.metric_route = 'range'
+                self.handle_range_request(f, path, ctype, fs, ranges)
+                return None
 
         try:
-            fs = os.fstat(f.fileno())
+            length = fs.st_size
+            if sibling is not None:
+                f.close()
+                f = open(sibling, 'rb')
+                length = os.fstat(f.fileno()).st_size
+            elif encoding and length <= COMPRESS_BUFFER_MAX_KB * 1024:
+                body = compression.compressed_body(
+                    (path, etag), f.read(), encoding, cacheable=not etag.startswith('W/'))
+                f.close()
+                f = io.BytesIO(body)
+                length = len(body)
+            elif encoding:
+                # Too big to hold in memory: compress while sending, chunked
+                self.stream_encoding = encoding
+                length = None
+
+            if self.command != 'HEAD':
+                self.set_cork(True)
             self.send_response(200)
             self.send_header("Content-type", ctype)
-            self.send_header("Content-Length", str(fs[6]))
-            self.send_header("Last-Modified", self.date_time_string(fs.st_mtime))
-            self.send_header("Accept-Ranges", "bytes")
+            if encoding:
+                self.send_header("Content-Encoding", encoding)
+            if length is None:
+                self.send_header("Transfer-Encoding", "chunked")
+            else:
+                self.send_header("Content-Length", str(length))
+            self.send_validators(etag, cache_control, fs.st_mtime, vary)
+            if not encoding:
+                self.send_header("Accept-Ranges", "bytes")
             self.end_headers()
+            self.content_length = length
+            if self.command != 'HEAD':
+                self.begin_transfer(bulk=fs.st_size >= BANDWIDTH_BULK_MB * 1024 * 1024)
             return f
         except:
             f.close()
             raise
 
-    def handle_range_request(self, f, path, ctype):
+    def send_validators(self, etag, cache_control, mtime=None, vary=False):
+        self.send_header("ETag", etag)
+        if mtime is not None:
+            self.send_header("Last-Modified", self.date_time_string(mtime))
+        self.send_header("Cache-Control", cache_control)
+        if vary:
+            self.send_header("Vary", "Accept-Encoding")
+
+    def send_not_modified(self, etag, cache_control, mtime=None, vary=False):
+        # A 304 carries the validators but no body (and so no Content-Length)
+        self.send_response(304)
+        self.send_validators(etag, cache_control, mtime, vary)
+        self.end_headers()
+
+    def handle_range_request(self, f, path, ctype, fs, ranges):
         try:
-            file_size = os.path.getsize(path)
-            range_header = self.headers['Range']
-            range_match = re.search(r'bytes=(\d+)-(\d*)', range_header)
-            
-            if range_match:
-                first_byte = int(range_match.group(1))
-                last_byte = range_match.group(2)
-                
-                if last_byte:
-                    last_byte = int(last_byte)
-                else:
-                    last_byte = file_size - 1
-                
+            file_size = fs.st_size
+            if not ranges:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{file_size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            if len(ranges) == 1:
+                first_byte, last_byte = ranges[0]
+                parts = None
                 length = last_byte - first_byte + 1
-                
-                self.send_response(206)
+            else:
+                boundary, parts, trailer, length = multipart_byteranges(ranges, ctype, file_size)
+            
+            if self.command != 'HEAD':
+                self.set_cork(True)
+            self.send_response(206)
+            if parts is None:
                 self.send_header('Content-type', ctype)
                 self.send_header('Content-Range', f'bytes {first_byte}-{last_byte}/{file_size}')
-                self.send_header('Content-Length', str(length))
-                self.send_header('Accept-Ranges', 'bytes')
-                self.end_headers()
-                
+            else:
+                self.send_header('Content-type', f'multipart/byteranges; boundary={boundary}')
+            self.send_header('Content-Length', str(length))
+            self.send_validators(file_etag(fs), cache_control_for(path), fs.st_mtime,
+                                 vary=is_compressible(ctype))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
+            
+            if self.command == 'HEAD':
+                return
+            if parts is None:
                 f.seek(first_byte)
                 self.copyfile(f, self.wfile, length)
-            else:
-                self.send_error(400, "Bad Range Header")
+                return
+            # Part headers are tiny writes; each part body still goes through sendfile
+            for part_header, first_byte, part_length in parts:
+                self.wfile.write(part_header)
+                f.seek(first_byte)
+                self.copyfile(f, self.wfile, part_length)
+                if self.close_connection:
+                    return
+                self.set_cork(True)
+            self.wfile.write(trailer)
+            self.set_cork(False)
         except (ConnectionResetError, BrokenPipeError):
-            pass
+            self.close_connection = True
         except Exception as e:
-            print(f"Range Error: {e}")
+            self.close_connection = True
+            access_log.message(f"Range Error: {e}")
         finally:
             f.close()
 
+    def send_archive(self, path, query):
+        result = archive_for(path, query)
+        if result[0] == 'error':
+            self.send_error(result[1], result[2])
+            return
+        _, ctype, filename, pieces = result
+        # Length unknown up front: chunked, or end-of-connection for HTTP/1.0
+        chunked = self.request_version != 'HTTP/1.0'
+        if not chunked:
+            self.close_connection = True
+        try:
+            self.set_cork(True)
+            self.send_response(200)
+            self.send_header("Content-type", ctype)
+            self.send_header("Content-Disposition", content_disposition(filename))
+            self.send_header("Cache-Control", "no-store")
+            if chunked:
+                self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            if self.command == 'HEAD':
+                return
+            self.begin_transfer(bulk=True)
+            for piece in pieces:
+                # An empty chunk would end a chunked body early
+                if isinstance(piece, archive.FileSpan):
+                    if piece.length:
+                        self.send_span(piece, chunked)
+                    continue
+                if not piece:
+                    continue
+                if chunked:
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(piece), piece))
+                else:
+                    self.wfile.write(piece)
+                self.pace(len(piece))
+            if chunked:
+                self.wfile.write(b"0\r\n\r\n")
+        except (ConnectionResetError, BrokenPipeError):
+            self.close_connection = True
+        except Exception as e:
+            self.close_connection = True
+            access_log.message(f"Archive Error: {e}")
+        finally:
+            pieces.close()
+            self.set_cork(False)
+
+    def send_span(self, span, chunked):
+        if chunked:
+            self.wfile.write(b"%x\r\n" % span.length)
+        remaining = span.length - (self.sendfile(span.file, span.length) or 0)
+        while remaining > 0:
+            # No sendfile, or the file shrank since it was listed: zeros keep the archive whole
+            size = min(ARCHIVE_READ_CHUNK, remaining)
+            data = span.file.read(size) or bytes(size)
+            self.wfile.write(data)
+            self.pace(len(data))
+            remaining -= len(data)
+        if chunked:
+            self.wfile.write(b"\r\n")
+
+    def set_cork(self, enabled):
+        if TCP_CORK is None:
+            return
+        try:
+            self.connection.setsockopt(socket.IPPROTO_TCP, TCP_CORK, 1 if enabled else 0)
+        except OSError:
+            pass
+
+    def sendfile(self, source, length=None):
+        # Zero-copy path: only regular files can be handed to the kernel.
+        # Returns the number of bytes sent, or None (nothing sent) so the caller
+        # can fall back to the buffered loop.
+        try:
+            fd = source.fileno()
+            if not stat.S_ISREG(os.fstat(fd).st_mode):
+                return None
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            return None
+        # socket.sendfile() itself falls back to a send() loop on platforms
+        # without os.sendfile (Windows) before any byte has been written.
+        # Sent in slices so the bandwidth shaper can pace and measure it.
+        offset, total = source.tell(), 0
+        while length is None or total < length:
+            count = bandwidth.slice_size if length is None else min(bandwidth.slice_size, length - total)
+            sent = self.connection.sendfile(source, offset + total, count)
+            if not sent:
+                break
+            total += sent
+            self.wfile.written += sent
+            self.pace(sent)
+        return total
+
+    def begin_transfer(self, bulk=False):
+        # The response body about to be sent, for the bandwidth shaper
+        if self.transfer is None:
+            self.transfer = bandwidth.start(self.client_address[0], bulk)
+
+    def pace(self, n):
+        if self.transfer is None:
+            self.begin_transfer()
+        delay = self.transfer.sent(n)
+        if delay:
+            time.sleep(delay)
+
     def copyfile(self, source, outputfile, length=None):
         BUFFER_SIZE = 1024 * 64 # 64KB chunks
 
         try:
+            if length is not None and outputfile is self.wfile and block_cache.enabled:
+                reader = block_cache.reader(source)
+                if reader is not None:
+                    if not self.copy_blocks(reader, source.tell(), length):
+                        self.close_connection = True
+                    return
+            sent = self.sendfile(source, length) if outputfile is self.wfile else None
+            if sent is not None:
+                # The file shrank under us: the response is shorter than its Content-Length
+                if length is not None and sent < length:
+                    self.close_connection = True
+                return
+
             if length is None:
                
                 while True:
@@ -143,6 +688,7 @@ class ModernHandler(http.server.SimpleHTTPRequestHandler):
                     if not data:
                         break
                     outputfile.write(data)
+                    self.pace(len(data))
             else:
                 bytes_to_read = length
                 while bytes_to_read > 0:
@@ -151,831 +697,1402 @@ class ModernHandler(http.server.SimpleHTTPRequestHandler):
                     if not data:
                         break
                     outputfile.write(data)
+                    self.pace(len(data))
                     bytes_to_read -= len(data)
+                if bytes_to_read > 0:
+                    self.close_connection = True
         except (ConnectionResetError, BrokenPipeError):
-            pass
+            self.close_connection = True
         except Exception as e:
-            print(f"Copyfile Error: {e}")
+            self.close_connection = True
+            access_log.message(f"Copyfile Error: {e}")
+        finally:
+            self.set_cork(False)
 
-    def check_access(self) -> bool:
+    def copy_blocks(self, reader, offset, length):
+        # Through the shared block cache; False if the file ended early
+        while length > 0:
+            data = reader.read(offset, length)
+            if not data:
+                return False
+            self.wfile.write(data)
+            self.pace(len(data))
+            offset += len(data)
+            length -= len(data)
         return True
-        #unused code below:
-        client_ip = self.client_address[0]
-        
-        # IP check
+
+    def copy_compressed(self, source, encoding):
+        compressor = compression.StreamCompressor(encoding)
         try:
-            ip = ipaddress.ip_address(client_ip)
-        except ValueError:
-            self.send_error(403, "Forbidden: Invalid IP address.")
-            return False
-            
-        allowed = any(ip in net for net in ALLOWED_NETWORKS)
-        if not allowed:
-            print(f"BLOCKED IP: {client_ip}")
-            self.send_error(403, "Forbidden: IP not allowed.")
-            return False
+            while True:
+                data = source.read(COMPRESS_STREAM_CHUNK)
+                block = compressor.compress(data) if data else compressor.flush()
+                if block:
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(block), block))
+                    self.pace(len(block))
+                if not data:
+                    break
+            self.wfile.write(b"0\r\n\r\n")
+        except (ConnectionResetError, BrokenPipeError):
+            self.close_connection = True
+        except Exception as e:
+            self.close_connection = True
+            access_log.message(f"Compression Error: {e}")
+        finally:
+            self.set_cork(False)
 
-        # Rate Limit Check
-        if not rate_limiter.is_allowed(client_ip):
-            print(f"RATE LIMIT EXCEEDED: {client_ip}")
-            self.send_error(429, "Too Many Requests")
+    def check_access(self) -> bool:
+        denied = access_denied(self.client_address[0])
+        if denied is not None:
+            code, message, headers = denied
+            self.send_error(code, message, headers=headers)
             return False
-            
         return True
 
+    def do_HEAD(self):
+        if not self.check_access():
+            return
+        if find_internal_route(urllib.parse.urlsplit(self.path).path) == 'do_upload':
+            self.do_upload()
+            return
+        super().do_HEAD()
+
+    def do_PATCH(self):
+        if not self.check_access():
+            return
+        if find_internal_route(urllib.parse.urlsplit(self.path).path) == 'do_upload':
+            self.do_upload()
+            return
+        self.send_error(405, "Method Not Allowed")
+
+    do_DELETE = do_PATCH
+
     def do_GET(self):
         if not self.check_access():
             return
-        super().do_GET()
+        route = find_internal_route(urllib.parse.urlsplit(self.path).path)
+        if route:
+            self.metric_route = route[3:]
+            getattr(self, route)()
+            return
+        f = self.send_head()
+        if f:
+            try:
+                if self.stream_encoding:
+                    self.copy_compressed(f, self.stream_encoding)
+                else:
+                    # Never send more than the Content-Length already announced
+                    self.copyfile(f, self.wfile, self.content_length)
+            finally:
+                f.close()
+
+    def send_json(self, data):
+        encoded = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def do_status(self):
+        pool_stats = getattr(self.server, 'stats', None)
+        self.send_json(status_data('threaded', pool_stats() if pool_stats else None))
+
+    def do_metrics(self):
+        pool_stats = getattr(self.server, 'stats', None)
+        body = metrics_text('threaded', pool_stats() if pool_stats else None)
+        self.send_response(200)
+        self.send_header("Content-type", METRICS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_upload(self):
+        self.metric_route = 'upload'
+        url = urllib.parse.urlsplit(self.path)
+        upload_id = url.path[len('/__upload/'):]
+        try:
+            if not upload_id:
+                if self.command != 'POST':
+                    raise UploadError(405, "Method Not Allowed")
+                status = create_upload(url.query, self.translate_path)
+                self.send_upload_status(201, status)
+            elif self.command in ('GET', 'HEAD'):
+                self.send_upload_status(200, resumable_uploads.status(upload_id))
+            elif self.command == 'PATCH':
+                self.send_upload_status(200, self.receive_chunk(upload_id))
+            elif self.command == 'DELETE':
+                resumable_uploads.cancel(upload_id)
+                self.send_response(204)
+                self.send_header("Cache-Control", "no-store")
+                self.end_headers()
+            else:
+                raise UploadError(405, "Method Not Allowed")
+        except UploadError as e:
+            self.send_error(e.status, e.message)
+        except (ConnectionError, TimeoutError):
+            self.close_connection = True
+
+    def receive_chunk(self, upload_id):
+        try:
+            offset = int(self.headers.get('Upload-Offset', ''))
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            raise UploadError(400, "Bad Request: Upload-Offset and Content-Length are required")
+        writer = resumable_uploads.begin_chunk(upload_id, offset, length)
+        try:
+            remaining = length
+            while remaining > 0:
+                chunk = self.rfile.read(min(UPLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise UploadError(400, "Upload failed: Connection closed before upload completed")
+                remaining -= len(chunk)
+                writer.write(chunk)
+            self.body_consumed = True
+            status = writer.finish()
+        finally:
+            writer.close()
+        if status['complete']:
+            search_index.refresh(writer.info['dir'])
+        return status
+
+    def send_upload_status(self, code, status):
+        encoded = json.dumps(status).encode('utf-8')
+        self.send_response(code)
+        self.send_header("Content-type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        if code == 201:
+            self.send_header("Location", status['url'])
+        for name, value in upload_headers(status):
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(encoded)
+
+    def do_events(self):
+        folder = events_folder(urllib.parse.urlsplit(self.path).query)
+        if folder is None:
+            self.send_error(404, "Folder not found")
+            return
+        if event_hub.count() >= EVENTS_MAX_STREAMS:
+            self.send_error(503, "Too many live update streams")
+            return
+        # The stream ends when the connection does
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("X-Accel-Buffering", "no")  # keep reverse proxies from buffering it
+        self.end_headers()
+        sock = socket.fromfd(self.connection.fileno(), self.connection.family, self.connection.type)
+        if event_hub.attach(sock, folder):
+            detached_requests.add(self.request)
+        else:
+            sock.close()
+
+    def do_search(self):
+        code, body = search_response(urllib.parse.urlsplit(self.path).query)
+        self.send_response(code)
+        self.send_header("Content-type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_static(self):
+        response = static_asset_response(urllib.parse.urlsplit(self.path).path, self.headers)
+        if response is None:
+            self.send_error(404, "File not found")
+            return
+        code, headers, body = response
+        self.send_response(code)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_vtt(self):
+        source = self.translate_path(self.path[len('/__vtt'):])
+        response = subtitle_response(source, self.headers)
+        if response[0] == 'error':
+            self.send_error(response[1], response[2])
+            return
+        code, headers, body = response
+        self.send_response(code)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_thumb(self):
+        source = self.translate_path(self.path[len('/__thumb'):])
+        result = thumbnail_for(source, urllib.parse.urlsplit(self.path).query)
+        if result[0] == 'error':
+            self.send_error(result[1], result[2])
+            return
+        _, thumb_path, etag, cache_control = result
+        if is_not_modified(self.headers, etag):
+            self.send_not_modified(etag, cache_control)
+            return
+        try:
+            f = open(thumb_path, 'rb')
+        except OSError:
+            # Evicted between lookup and open
+            self.send_error(503, "Thumbnail not ready")
+            return
+        try:
+            length = os.fstat(f.fileno()).st_size
+            self.set_cork(True)
+            self.send_response(200)
+            self.send_header("Content-type", "image/jpeg")
+            self.send_header("Content-Length", str(length))
+            self.send_validators(etag, cache_control)
+            self.end_headers()
+            self.copyfile(f, self.wfile, length)
+        finally:
+            f.close()
 
     def do_POST(self):
         if not self.check_access():
             return
+        if find_internal_route(urllib.parse.urlsplit(self.path).path) == 'do_upload':
+            self.do_upload()
+            return
+        self.metric_route = 'upload'
         content_type = self.headers.get('Content-Type', '')
         if not content_type.startswith('multipart/form-data'):
             self.send_error(400, "Bad Request: Expected multipart form data")
             return
-        
+        boundary = get_boundary(content_type)
+        if not boundary:
+            self.send_error(400, "Bad Request: Missing multipart boundary")
+            return
+
         try:
             content_length = int(self.headers.get('Content-Length', 0))
-            form_data = self.rfile.read(content_length)
-        
-            boundary = content_type.split('boundary=')[1].encode()
-            parts = form_data.split(b'--' + boundary)
-            
-            target_dir = self.translate_path(self.path)
-            if not os.path.isdir(target_dir):
-                target_dir = os.path.dirname(target_dir)
+        except ValueError:
+            self.send_error(400, "Bad Request: Invalid Content-Length")
+            return
 
-            uploaded_files = []
-            for part in parts:
-                if b'name="files[]"' in part and b'filename="' in part:
-                    filename_start = part.find(b'filename="') + 10
-                    filename_end = part.find(b'"', filename_start)
-                    filename = part[filename_start:filename_end].decode()
-                    
-                    file_content_start = part.find(b'\r\n\r\n') + 4
-                    file_content_end = part.find(b'\r\n--', file_content_start)
-                    if file_content_end == -1:
-                        file_content_end = len(part) - 2
-                    
-                    file_content = part[file_content_start:file_content_end]
-                
-                    if len(file_content) < MAX_UPLOAD_MB * 1024 * 1024:
-                        safe_filename = os.path.basename(filename)
-                        
-                        # exclude certain file using extension names:
-                        _, ext = os.path.splitext(safe_filename)
-                        
-                        if safe_filename and ext.lower() not in EXCLUDED_UPLOAD_EXT:
-                            save_path = os.path.join(target_dir, safe_filename)
-                            with open(save_path, 'wb') as f:
-                                f.write(file_content)
-                            uploaded_files.append(safe_filename)
-                        else:
-                            self.send_error(400, f"Upload failed: File type '{ext}' is marked Unsafe")
-                            return
-                    else:
-                        self.send_error(400, f"Upload failed: File exceeds maximum size limit of {MAX_UPLOAD_MB} MB")
-                        return
+        target_dir = self.translate_path(self.path)
+        if not os.path.isdir(target_dir):
+            target_dir = os.path.dirname(target_dir)
+
+        # Reject before reading the payload: the body is never buffered,
+        # so the connection is dropped instead of drained (see end_headers).
+        error = check_upload_size(content_length, target_dir)
+        if error:
+            self.send_error(*error)
+            return
+
+        session = UploadSession(target_dir, MAX_UPLOAD_MB * 1024 * 1024, EXCLUDED_UPLOAD_EXT)
+        parser = MultipartParser(boundary)
+        try:
+            remaining = content_length
+            while remaining > 0:
+                chunk = self.rfile.read(min(UPLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise UploadError(400, "Upload failed: Connection closed before upload completed")
+                remaining -= len(chunk)
+                session.handle(parser.feed(chunk))
+            self.body_consumed = True
+            # A part without its closing boundary is incomplete
+            session.abort()
             
-            if uploaded_files:
+            if session.saved:
+                search_index.refresh(target_dir)
                 self.send_response(303)
                 self.send_header('Location', self.path)
+                self.send_header('Content-Length', '0')
                 self.end_headers()
                 return
             else:
                 self.send_error(400, "No valid files found")
-            
+
+        except UploadError as e:
+            session.abort()
+            self.send_error(e.status, e.message)
+        except (ConnectionResetError, BrokenPipeError):
+            session.abort()
+            self.close_connection = True
         except Exception as e:
-            print(f"Upload error: {e}")
+            session.abort()
+            access_log.message(f"Upload error: {e}")
             self.send_error(500, f"Upload failed: {str(e)}")
 
     def list_directory(self, path):
         try:
-            list_dir = os.listdir(path)
+            ctype, encoded, etag = build_listing(path, self.path)
         except OSError:
             self.send_error(404, "No permission to list directory")
             return None
-        
+        except ValueError:
+            self.send_error(400, "Bad Request: Invalid cursor or limit")
+            return None
+
+        encoding, encoded, etag = compress_body(self.path, encoded, etag, self.headers)
+        if is_not_modified(self.headers, etag):
+            self.send_not_modified(etag, CACHE_CONTROL['listing'], vary=COMPRESSION_ENABLED)
+            return None
+
+        f = io.BytesIO(encoded)
+        self.send_response(200)
+        self.send_header("Content-type", ctype)
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(encoded)))
+        self.send_validators(etag, CACHE_CONTROL['listing'], vary=COMPRESSION_ENABLED)
+        self.end_headers()
+        self.content_length = len(encoded)
+        return f
+
+def wait_readable(sock, timeout):
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        poller.register(sock, select.POLLIN)
+        return bool(poller.poll(timeout * 1000))
+    return bool(select.select([sock], [], [], timeout)[0])
+
+def check_upload_size(content_length, target_dir):
+    # (status, message) when an upload must be refused before its body is read
+    if content_length <= 0:
+        return 411, "Length Required"
+    if content_length > MAX_UPLOAD_MB * 1024 * 1024 + UPLOAD_OVERHEAD_BYTES:
+        return 413, f"Upload failed: File exceeds maximum size limit of {MAX_UPLOAD_MB} MB"
+    try:
+        free = shutil.disk_usage(target_dir).free
+    except OSError:
+        return None
+    if content_length > free - UPLOAD_MIN_FREE_MB * 1024 * 1024:
+        return 507, "Upload failed: Not enough free disk space on server"
+    return None
+
+def content_disposition(filename):
+    # Plain filename= for old clients, RFC 6266 filename*= for everyone else
+    fallback = filename.encode('ascii', 'replace').decode('ascii').replace('"', "'")
+    quoted = urllib.parse.quote(filename, errors='surrogateescape')
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quoted}"
+
+def archive_for(path, query_string):
+    """Resolve a ?download=zip|tar request on the folder at path, for the
+    whole folder or only its name= entries. Returns ('archive', content
+    type, file name, pieces) or ('error', status, message). Shared by both
+    engines."""
+    params = urllib.parse.parse_qs(query_string)
+    fmt = params.get('download', [''])[0]
+    if not ARCHIVE_DOWNLOADS_ENABLED:
+        return 'error', 404, "Archive downloads are disabled"
+    if fmt not in archive.FORMATS:
+        return 'error', 400, "Bad Request: download must be zip or tar"
+    ctype, ext = archive.FORMATS[fmt]
+    folder_name = os.path.basename(os.path.abspath(path)) or 'files'
+
+    names = params.get('name')
+    if names:
+        # Selected entries go at the top of the archive
+        for name in names:
+            if (name in ('.', '..') or '/' in name or os.sep in name
+                    or os.path.splitext(name)[1].lower() in EXCLUDED_EXTENSIONS
+                    or not os.path.lexists(os.path.join(path, name))):
+                return 'error', 404, f"File not found: {name}"
+        members = archive.iter_members(path, set(names))
+    else:
+        # The whole folder goes inside a folder of the same name
+        try:
+            names = [name for name in os.listdir(path) if os.path.splitext(name)[1].lower() not in EXCLUDED_EXTENSIONS]
+        except OSError:
+            return 'error', 404, "No permission to list directory"
+        members = archive.iter_members(path, names, prefix=folder_name + '/')
+    return 'archive', ctype, folder_name + ext, archive.archive_pieces(fmt, members)
+
+def create_upload(query_string, translate_path):
+    """Start a resumable upload (POST /__upload?dir=&name=&size=, where dir
+    is the folder's URL path) and return its status; raises UploadError.
+    Shared by both engines."""
+    params = urllib.parse.parse_qs(query_string)
+    target_dir = translate_path(params.get('dir', ['/'])[0])
+    if not os.path.isdir(target_dir):
+        raise UploadError(404, "Folder not found")
+    try:
+        size = int(params.get('size', [''])[0])
+    except ValueError:
+        raise UploadError(400, "Upload failed: Invalid size")
+    error = check_upload_size(size, target_dir) if size > 0 else None
+    if error:
+        raise UploadError(*error)
+    status = resumable_uploads.create(target_dir, params.get('name', [''])[0], size)
+    if status['complete']:
+        search_index.refresh(target_dir)  # an empty file is done at once
+    return status
+
+def upload_headers(status):
+    # A resumable upload's progress, sent with every /__upload response
+    return [
+        ("Upload-Length", str(status['size'])),
+        ("Upload-Offset", str(status['offset'])),
+        ("Upload-Chunk-Size", str(status['chunk_size'])),
+        ("Upload-Received", status['received']),
+        ("Upload-Complete", "?1" if status['complete'] else "?0"),
+        ("Cache-Control", "no-store"),
+    ]
+
+def parse_byte_ranges(range_header, file_size):
+    """Parse a "bytes=" Range header (RFC 7233) against a file of file_size bytes.
+
+    Handles "first-last", open "first-" and suffix "-length" specs. Returns
+    the satisfiable ranges as (first, last) pairs clamped to the file,
+    sorted, with overlapping and adjacent ones merged. The list is empty
+    when nothing can be satisfied. Raises ValueError for a malformed header,
+    which callers ignore (the whole file is sent).
+    """
+    unit, sep, specs = range_header.partition('=')
+    if not sep or unit.strip().lower() != 'bytes':
+        raise ValueError(range_header)
+    ranges = []
+    specs = [spec.strip() for spec in specs.split(',') if spec.strip()]
+    if not specs:
+        raise ValueError(range_header)
+    for spec in specs:
+        first, sep, last = (part.strip() for part in spec.partition('-'))
+        if not sep or not (first or last) or not all(p.isdigit() for p in (first, last) if p):
+            raise ValueError(range_header)
+        if not first:
+            # Suffix range: the final `last` bytes
+            suffix = int(last)
+            if suffix == 0 or file_size == 0:
+                continue
+            ranges.append((max(0, file_size - suffix), file_size - 1))
+            continue
+        first = int(first)
+        if last:
+            if int(last) < first:
+                raise ValueError(range_header)
+            last = min(int(last), file_size - 1)
+        else:
+            last = file_size - 1
+        if first < file_size:
+            ranges.append((first, last))
+
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+def if_range_matches(headers, etag, mtime):
+    # If-Range needs a strong validator: a strong ETag, or exactly the Last-Modified date
+    if_range = headers.get('If-Range')
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith(('"', 'W/')):
+        return not etag.startswith('W/') and if_range == etag
+    try:
+        since = email.utils.parsedate_to_datetime(if_range)
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=datetime.timezone.utc)
+    return int(mtime) == since.timestamp()
+
+def requested_ranges(headers, fs, etag):
+    """Ranges to send for a request carrying a Range header.
+
+    None means the Range header is ignored and the whole file is sent: it is
+    malformed, asks for too many pieces, or If-Range no longer matches. An
+    empty list means the range is unsatisfiable (416).
+    """
+    if not if_range_matches(headers, etag, fs.st_mtime):
+        return None
+    try:
+        ranges = parse_byte_ranges(headers['Range'], fs.st_size)
+    except ValueError:
+        return None
+    if len(ranges) > MAX_BYTE_RANGES:
+        return None
+    return ranges
+
+def multipart_byteranges(ranges, ctype, file_size):
+    """Layout of a multipart/byteranges body.
+
+    Returns (boundary, parts, trailer, content_length), where parts holds
+    (part header bytes, first byte, length) for each range so the bodies can
+    be streamed straight from the file.
+    """
+    boundary = secrets.token_hex(16)
+    parts = []
+    total = 0
+    for first, last in ranges:
+        part_header = (f"\r\n--{boundary}\r\n"
+                       f"Content-Type: {ctype}\r\n"
+                       f"Content-Range: bytes {first}-{last}/{file_size}\r\n\r\n").encode('latin-1')
+        parts.append((part_header, first, last - first + 1))
+        total += len(part_header) + last - first + 1
+    trailer = f"\r\n--{boundary}--\r\n".encode('latin-1')
+    return boundary, parts, trailer, total + len(trailer)
+
+# --- Conditional requests and caching policy ---
+
+# Cache-Control by extension class, resolved once
+CACHE_CONTROL_BY_EXT = {ext: CACHE_CONTROL['preview'] for ext in PREVIEWABLE_EXTS}
+CACHE_CONTROL_BY_EXT.update({ext: CACHE_CONTROL['media'] for exts in MEDIA_EXTS.values() for ext in exts})
+
+_ETAG_RE = re.compile(r'(?:W/)?"[^"]*"')
+
+def cache_control_for(path):
+    return CACHE_CONTROL_BY_EXT.get(os.path.splitext(path)[1].lower(), CACHE_CONTROL['default'])
+
+def file_etag(fs):
+    """ETag from inode, size and mtime.
+
+    A file modified within the last second could change again without its
+    mtime moving, so it only gets a weak validator until it settles.
+    """
+    tag = f'"{fs.st_ino:x}-{fs.st_size:x}-{fs.st_mtime_ns:x}"'
+    if time.time() - fs.st_mtime < 1:
+        return 'W/' + tag
+    return tag
+
+def body_etag(body):
+    return 'W/"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+def is_not_modified(headers, etag, mtime=None):
+    """True when a GET/HEAD's validators match, i.e. a 304 should be sent.
+
+    If-None-Match (weak comparison) takes precedence over If-Modified-Since,
+    which is compared at the one-second resolution of HTTP dates.
+    """
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match is not None:
+        if if_none_match.strip() == '*':
+            return True
+        bare = etag[2:] if etag.startswith('W/') else etag
+        return any(tag[-len(bare):] == bare for tag in _ETAG_RE.findall(if_none_match))
+
+    if_modified_since = headers.get('If-Modified-Since')
+    if if_modified_since is None or mtime is None:
+        return False
+    try:
+        since = email.utils.parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=datetime.timezone.utc)
+    return int(mtime) <= since.timestamp()
+
+def static_asset_response(url_path, headers):
+    """(status, headers, body) for a /__static/ asset, or None if unknown."""
+    asset = STATIC_ASSETS.get(url_path)
+    if asset is None:
+        return None
+    validators = [("ETag", asset.etag),
+                  ("Cache-Control", "public, max-age=31536000, immutable"),
+                  ("Vary", "Accept-Encoding")]
+    if is_not_modified(headers, asset.etag):
+        return 304, validators, b''
+    encoding = compression.pick_encoding(compression.accepted_encodings(headers.get('Accept-Encoding')))
+    body = asset.encoded.get(encoding, asset.body)
+    response_headers = [("Content-type", asset.content_type)]
+    if body is not asset.body:
+        response_headers.append(("Content-Encoding", encoding))
+    response_headers.append(("Content-Length", str(len(body))))
+    return 200, response_headers + validators, body
+
+def subtitle_response(source, headers):
+    """(status, headers, body) for a /__vtt/ request: the .srt or .vtt file
+    at source as WebVTT, or ('error', status, message). May block while the
+    file is read and converted.
+    """
+    ext = os.path.splitext(source)[1].lower()
+    if ext not in subtitles.SUBTITLE_EXTS:
+        return 'error', 404, "Not a subtitle file"
+    try:
+        with open(source, 'rb') as f:
+            fs = os.fstat(f.fileno())
+            if not stat.S_ISREG(fs.st_mode):
+                return 'error', 404, "File not found"
+            if fs.st_size > SUBTITLE_MAX_MB * 1024 * 1024:
+                return 'error', 413, "Subtitle file too large"
+            version = (fs.st_ino, fs.st_size, fs.st_mtime_ns)
+            cached = subtitles.subtitle_cache.get(source, version)
+            if cached is None:
+                vtt = subtitles.to_vtt(f.read(), ext)
+                cached = (vtt, body_etag(vtt))
+                subtitles.subtitle_cache.put(source, cached, len(vtt), version)
+    except OSError:
+        return 'error', 404, "File not found"
+
+    encoding, body, etag = compress_body(source, cached[0], cached[1], headers)
+    validators = [("ETag", etag),
+                  ("Last-Modified", email.utils.formatdate(fs.st_mtime, usegmt=True)),
+                  ("Cache-Control", CACHE_CONTROL['preview'])]
+    if COMPRESSION_ENABLED:
+        validators.append(("Vary", "Accept-Encoding"))
+    if is_not_modified(headers, etag, fs.st_mtime):
+        return 304, validators, b''
+    response_headers = [("Content-type", "text/vtt; charset=utf-8")]
+    if encoding:
+        response_headers.append(("Content-Encoding", encoding))
+    response_headers.append(("Content-Length", str(len(body))))
+    return 200, response_headers + validators, body
+
+def thumbnail_for(source, query):
+    """Resolve a /__thumb/ request for the image at source.
+
+    Returns ('file', thumbnail path, etag, cache control) or ('error',
+    status, message). May block while the thumbnail is rendered.
+    """
+    if not THUMBNAILS_ENABLED:
+        return 'error', 404, "Thumbnails are disabled"
+    if os.path.splitext(source)[1].lower() not in THUMBNAIL_EXTS:
+        return 'error', 404, "No thumbnail for this file type"
+    params = urllib.parse.parse_qs(query)
+    try:
+        width = pick_width(int(params.get('w', [THUMB_GRID_WIDTH])[0]))
+    except ValueError:
+        return 'error', 400, "Bad Request: Invalid width"
+    try:
+        fs = os.stat(source)
+    except OSError:
+        return 'error', 404, "File not found"
+    if not stat.S_ISREG(fs.st_mode):
+        return 'error', 404, "File not found"
+    try:
+        thumb_path = thumbnail_service.get(source, fs, width)
+    except ThumbnailBusy:
+        return 'error', 503, "Thumbnail generation busy, retry shortly"
+    if thumb_path is None:
+        return 'error', 404, "No thumbnail available"
+    # The listing adds ?v=<mtime>, so a changed image gets a new URL
+    cache_control = "max-age=31536000, immutable" if 'v' in params else CACHE_CONTROL['media']
+    return 'file', thumb_path, compression.variant_etag(file_etag(fs), f"w{width}"), cache_control
+
+def is_compressible(ctype):
+    return COMPRESSION_ENABLED and compression.is_compressible(ctype)
+
+def negotiate_file(path, fs, ctype, headers, can_stream=True):
+    """Choose which representation of a file to send.
+
+    Returns (encoding, sibling, etag, vary): encoding is None for the file
+    as-is, sibling is the path of a precompressed file to send instead of
+    compressing on the fly, and vary tells whether Accept-Encoding was
+    consulted. Range requests always get the identity body.
+    """
+    etag = file_etag(fs)
+    vary = is_compressible(ctype)
+    if not vary or 'Range' in headers:
+        return None, None, etag, vary
+    accepted = compression.accepted_encodings(headers.get('Accept-Encoding'))
+    found = compression.find_precompressed(path, fs, accepted)
+    if found:
+        encoding, sibling, sibling_fs = found
+        return encoding, sibling, file_etag(sibling_fs), vary
+    encoding = compression.pick_encoding(accepted)
+    if (encoding is None or fs.st_size < COMPRESS_MIN_BYTES
+            or (fs.st_size > COMPRESS_BUFFER_MAX_KB * 1024 and not can_stream)):
+        return None, None, etag, vary
+    return encoding, None, compression.variant_etag(etag, encoding), vary
+
+def compress_body(key, encoded, etag, headers):
+    # (encoding, body, etag) of the representation to send for a generated body
+    if not COMPRESSION_ENABLED or len(encoded) < COMPRESS_MIN_BYTES:
+        return None, encoded, etag
+    encoding = compression.pick_encoding(compression.accepted_encodings(headers.get('Accept-Encoding')))
+    if encoding is None:
+        return None, encoded, etag
+    body = compression.compressed_body((key, etag), encoded, encoding)
+    return encoding, body, compression.variant_etag(etag, encoding)
+
+def build_listing(path, request_path):
+    """Return (content type, body, etag) for a directory listing request.
+
+    Raises OSError when the directory can't be read and ValueError for bad
+    paging parameters. Shared by both server engines.
+    """
+    params = urllib.parse.parse_qs(urllib.parse.urlparse(request_path).query)
+    sort_by = params.get('sort', ['name'])[0]
+    if sort_by not in ['name', 'size', 'date', 'type']:
         sort_by = 'name'
-        if 'sort=' in self.path:
-            try:
-                sort_param = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query).get('sort', ['name'])[0]
-                if sort_param in ['name', 'size', 'date', 'type']:
-                    sort_by = sort_param
-            except:
-                pass
-        
-        existing_files = set(list_dir)
-        all_subtitles = [f for f in list_dir if f.lower().endswith(('.srt', '.vtt'))]
-        
-        file_data = []
-        for name in list_dir:
-            fullname = os.path.join(path, name)
-            is_dir = os.path.isdir(fullname)
-            size = 0
-            mtime = 0
-            file_type = 'folder' if is_dir else 'file'
-            ext = os.path.splitext(name)[1].lower()
-            
-            subtitle_file = None
-            if not is_dir and ext in MEDIA_EXTS['video']:
-                base_name = os.path.splitext(name)[0]
-                # Auto-detect same-name subtitle
-                if f"{base_name}.srt" in existing_files:
-                    subtitle_file = f"{base_name}.srt"
-                elif f"{base_name}.vtt" in existing_files:
-                    subtitle_file = f"{base_name}.vtt"
-
-            if os.path.isfile(fullname):
-                try:
-                    size = os.path.getsize(fullname)
-                    mtime = os.path.getmtime(fullname)
-                except OSError:
-                    pass
-            elif is_dir:
-                try:
-                    mtime = os.path.getmtime(fullname)
-                except OSError:
-                    pass
-            
-            file_data.append({
-                'name': name,
-                'is_dir': is_dir,
-                'size': size,
-                'mtime': mtime,
-                'type': file_type,
-                'ext': ext,
-                'subtitle': subtitle_file
-            })
-        
-        # Sorting 
-        if sort_by == 'name':
-            file_data.sort(key=lambda x: x['name'].lower())
-        elif sort_by == 'size':
-            file_data.sort(key=lambda x: x['size'], reverse=True)
-            file_data.sort(key=lambda x: not x['is_dir'])
-        elif sort_by == 'date':
-            file_data.sort(key=lambda x: x['mtime'], reverse=True)
-        elif sort_by == 'type':
-            file_data.sort(key=lambda x: (x['type'], x['ext'], x['name'].lower()))
-        
-        r = []
-        parsed_url = urllib.parse.urlparse(self.path)
-        clean_path = parsed_url.path 
-        displaypath = html.escape(urllib.parse.unquote(clean_path))
-        
-        r.append('<!DOCTYPE html>')
-        r.append('<html lang="en">')
-        r.append('<head>')
-        r.append('<meta charset="utf-8">')
-        r.append('<meta name="viewport" content="width=device-width, initial-scale=1">')
-        r.append(f'<title>Files: {displaypath}</title>')
-        r.append('<style>')
-        r.append("""
-            :root { 
-                --bg: #121212; 
-                --card: rgba(30, 30, 30, 0.7); 
-                --text: #e0e0e0; 
-                --accent: #bb86fc; 
-                --hover: rgba(44, 44, 44, 0.6); 
-                --glass-border: rgba(255, 255, 255, 0.1);
-            }
-            body { 
-                font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif; 
-                background: var(--bg); 
-                color: var(--text); 
-                margin: 0; 
-                padding: 20px;
-                background: linear-gradient(135deg, #0f0f0f 0%, #1a1a1a 100%);
-                min-height: 100vh;
-            }
-            .header { display: flex; justify-content: space-between; align-items: center; margin-bottom: 20px; flex-wrap: wrap; }
-            h1 { font-size: 1.5rem; color: var(--accent); margin: 0; }
-            
-            .breadcrumb { font-size: 14px; color: #888; margin: 10px 0; display: flex; align-items: center; gap: 5px;}
-            .breadcrumb a { color: var(--accent); text-decoration: none; }
-            .breadcrumb a:hover { text-decoration: underline; }
-            .breadcrumb span { color: #666; cursor: default; }
-            .breadcrumb-sep { color: #444; }
-
-            .controls { display: flex; justify-content: space-between; align-items: center; margin-bottom: 20px; flex-wrap: wrap; gap: 10px; }
-            input#search { padding: 10px; font-size: 14px; border-radius: 12px; border: none; background: rgba(255, 255, 255, 0.1); color: white; width: 250px; box-sizing: border-box; outline: none; border: 1px solid var(--glass-border); backdrop-filter: blur(10px); }
-            input#search:focus { border-color: var(--accent); background: rgba(255, 255, 255, 0.15); }
-            .sort-dropdown { position: relative; display: inline-block; }
-            .sort-btn { background: rgba(255, 255, 255, 0.1); color: var(--text); border: 1px solid var(--glass-border); padding: 10px 15px; border-radius: 12px; cursor: pointer; backdrop-filter: blur(10px); }
-            .sort-content { display: none; position: absolute; background: rgba(30, 30, 30, 0.9); min-width: 160px; box-shadow: 0 8px 32px rgba(0,0,0,0.3); z-index: 1; border-radius: 12px; border: 1px solid var(--glass-border); backdrop-filter: blur(20px); }
-            .sort-content a { color: var(--text); padding: 12px 16px; text-decoration: none; display: block; }
-            .sort-content a:hover { background: var(--hover); }
-            .sort-dropdown:hover .sort-content { display: block; }
-            .view-toggle { display: flex; background: rgba(255, 255, 255, 0.1); border-radius: 12px; padding: 4px; border: 1px solid var(--glass-border); backdrop-filter: blur(10px); }
-            .view-btn { background: transparent; border: none; padding: 6px 12px; border-radius: 8px; cursor: pointer; color: var(--text); font-size: 16px; }
-            .view-btn.active { background: var(--accent); color: black; }
-            .upload-btn { background: var(--accent); color: black; border: none; padding: 10px 15px; border-radius: 12px; cursor: pointer; font-weight: 600; text-decoration: none; display: inline-block; }
-            .grid { display: grid; grid-template-columns: repeat(auto-fill, minmax(120px, 1fr)); gap: 20px; }
-            .list { display: flex; flex-direction: column; gap: 8px; }
-            .list .item { flex-direction: row; text-align: left; padding: 12px 16px; border-radius: 12px; }
-            .list .file-icon { margin-bottom: 0; margin-right: 15px; }
-            .list .info { text-align: left; flex: 1; }
-            .list .name { font-size: 14px; }
-            .item { display: flex; flex-direction: column; align-items: center; cursor: pointer; color: var(--text); text-decoration: none; padding: 15px; border-radius: 16px; transition: all 0.3s ease; background: var(--card); border: 1px solid var(--glass-border); backdrop-filter: blur(20px); box-shadow: 0 4px 20px rgba(0, 0, 0, 0.2); }
-            .item:hover { background: var(--hover); transform: translateY(-2px); box-shadow: 0 8px 30px rgba(0, 0, 0, 0.3); }
-            .file-icon { width: 64px; height: 80px; border-radius: 8px; display: flex; align-items: center; justify-content: center; font-size: 12px; font-weight: 900; color: white; text-transform: uppercase; margin-bottom: 8px; position: relative; box-shadow: 0 4px 15px rgba(0,0,0,0.3); backdrop-filter: blur(10px); }
-            .file-icon::after { content: ''; position: absolute; top: 0; right: 0; border-bottom: 16px solid rgba(0,0,0,0.2); border-left: 16px solid rgba(0,0,0,0.2); border-top: 16px solid transparent; border-right: 16px solid transparent; width: 0; height: 0; }
-            .icon-red { background: linear-gradient(135deg, #e53935, #b71c1c); }
-            .icon-blue { background: linear-gradient(135deg, #1e88e5, #0d47a1); }
-            .icon-green { background: linear-gradient(135deg, #43a047, #1b5e20); }
-            .icon-yellow { background: linear-gradient(135deg, #fdd835, #f9a825); color: #212121; }
-            .icon-purple { background: linear-gradient(135deg, #8e24aa, #4a148c); }
-            .icon-teal { background: linear-gradient(135deg, #00acc1, #006064); }
-            .icon-gray { background: linear-gradient(135deg, #757575, #424242); }
-            .icon-orange { background: linear-gradient(135deg, #fb8c00, #e65100); }
-            .icon-python { background: linear-gradient(135deg, #3776ab 40%, #ffd343 100%); }
-            .icon-folder { width: 80px; height: 64px; background: linear-gradient(135deg, #ffa000, #ff6f00); border-radius: 8px; color: rgba(255,255,255,0.8); }
-            .icon-folder::after { display: none; }
-            .icon-folder::before { content: ''; position: absolute; top: -8px; left: 0; width: 25px; height: 10px; background: #ffa000; border-radius: 6px 6px 0 0; }
-            .info { display: flex; flex-direction: column; text-align: center; width: 100%; }
-            .name { font-weight: 500; font-size: 12px; word-break: break-word; margin-top: 5px; line-height: 1.3; }
-            .meta { font-size: 10px; color: #888; margin-top: 2px; }
-            .modal-overlay { display: none; position: fixed; top: 0; left: 0; width: 100%; height: 100%; background: rgba(0,0,0,0.8); z-index: 1000; justify-content: center; align-items: center; backdrop-filter: blur(5px); }
-            .modal { background: rgba(30, 30, 30, 0.9); padding: 24px; border-radius: 20px; width: 600px; max-width: 95%; text-align: center; border: 1px solid var(--glass-border); box-shadow: 0 20px 40px rgba(0,0,0,0.5); transform: scale(0.95); transition: transform 0.3s ease; backdrop-filter: blur(20px); max-height: 95vh; overflow-y: auto; }
-            .modal.active { transform: scale(1); }
-            .modal h3 { margin-top: 0; color: white; margin-bottom: 8px; word-break: break-all; }
-            .modal p { color: #888; font-size: 0.9rem; margin-bottom: 20px; }
-            .media-player { margin: 15px 0; border-radius: 12px; overflow: hidden; position: relative; }
-            .media-player video, .media-player audio { width: 100%; border-radius: 8px; outline: none; background: #000; max-height: 60vh; }
-            .media-player img { max-width: 100%; max-height: 300px; border-radius: 8px; }
-            .modal::-webkit-scrollbar { width: 8px; }
-            .modal::-webkit-scrollbar-track { background: rgba(0,0,0,0.1); }
-            .modal::-webkit-scrollbar-thumb { background: rgba(255,255,255,0.2); border-radius: 4px; }
-            .btn { display: block; width: 100%; padding: 14px; margin: 8px 0; border: none; border-radius: 12px; font-size: 16px; cursor: pointer; text-decoration: none; box-sizing: border-box; font-weight: 600; transition: all 0.2s ease; backdrop-filter: blur(10px); }
-            .btn:active { transform: scale(0.98); }
-            .btn-download { background: var(--accent); color: black; }
-            .btn-preview { background: rgba(255, 255, 255, 0.1); color: white; border: 1px solid var(--glass-border); }
-            .btn-preview:hover { background: rgba(255, 255, 255, 0.2); }
-            .btn-cancel { background: transparent; color: #777; font-size: 14px; margin-top: 0px; padding: 10px; }
-            .btn-cancel:hover { color: #aaa; }
-            .hidden { display: none !important; }
-            
-            /* Subtitle Select Style */
-            .sub-control { margin: 10px 0; text-align: left; background: rgba(0,0,0,0.2); padding: 8px; border-radius: 8px; }
-            .sub-control label { color: #aaa; font-size: 12px; margin-right: 10px; }
-            .sub-control select { background: rgba(255,255,255,0.1); color: white; border: 1px solid rgba(255,255,255,0.2); border-radius: 4px; padding: 4px; outline: none; width: 100%; margin-top: 5px; }
-
-            .upload-form { background: rgba(30, 30, 30, 0.8); padding: 20px; border-radius: 16px; margin: 20px 0; border: 1px solid var(--glass-border); backdrop-filter: blur(20px); }
-            .upload-form h3 { margin-top: 0; color: var(--accent); }
-            .drop-zone { border: 2px dashed var(--glass-border); border-radius: 12px; padding: 40px; text-align: center; transition: all 0.3s ease; background: rgba(255, 255, 255, 0.05); cursor: pointer; }
-            .drop-zone:hover, .drop-zone.dragover { border-color: var(--accent); background: rgba(255, 255, 255, 0.08); }
-            .drop-zone.dragover { background: rgba(187, 134, 252, 0.1); }
-            .drop-icon { font-size: 48px; margin-bottom: 16px; color: var(--accent); }
-            .drop-text { font-size: 16px; margin-bottom: 8px; }
-            .drop-hint { font-size: 12px; color: #888; }
-            .file-input { display: none; }
-            .upload-progress { margin-top: 20px; }
-            .progress-bar { width: 100%; height: 6px; background: rgba(255, 255, 255, 0.1); border-radius: 3px; overflow: hidden; margin-bottom: 10px; }
-            .progress-fill { height: 100%; background: var(--accent); width: 0%; transition: width 0.3s ease; }
-            .progress-text { font-size: 12px; color: #888; text-align: center; }
-            .file-list { margin-top: 15px; text-align: left; }
-            .file-item { display: flex; justify-content: space-between; align-items: center; padding: 8px 12px; background: rgba(255, 255, 255, 0.05); border-radius: 8px; margin-bottom: 8px; font-size: 14px; }
-            .file-name { flex: 1; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }
-            .file-size { color: #888; font-size: 12px; margin-left: 10px; }
-            .upload-status { margin-left: 10px; font-size: 12px; }
-            .status-uploading { color: var(--accent); }
-            .status-success { color: #4CAF50; }
-            .status-error { color: #f44336; }
-        """)
-        r.append('</style>')
-        r.append('</head>')
-        r.append('<body>') 
-        r.append('<div class="header">')
-        r.append(f'<h1>File Manager</h1>')
-        r.append('</div>')
-        r.append('<div class="breadcrumb">')
-        path_parts = clean_path.strip('/').split('/')
-        
-        # Home is always a link
-        r.append('<a href="/">Home</a>')
-        
-        for part in path_parts:
-            if part:
-                display_part = urllib.parse.unquote(part)
-                r.append('<span class="breadcrumb-sep">></span>')
-                r.append(f'<span>{html.escape(display_part)}</span>')
-        r.append('</div>')
+
+    version = listing_version(path)
+    if params.get('format', [''])[0] == 'json':
+        encoded = build_listing_json(path, request_path, version, sort_by, params)
+        return "application/json", encoded, body_etag(encoded)
+
+    # The ETag hashes the rendered page, so it moves with anything the page
+    # shows (entries, sizes, dates) and is computed once per cached render
+    clean_path = urllib.parse.urlparse(request_path).path
+    page_key = ('page', os.path.abspath(path), clean_path, sort_by)
+    cached = listing_cache.get(page_key, version)
+    if cached is None:
+        file_data, all_subtitles = listing_entries(path, version, sort_by)
+        encoded = render_listing(request_path, file_data, all_subtitles, sort_by)
+        cached = (encoded, body_etag(encoded))
+        if version is not None:
+            listing_cache.put(page_key, cached, len(encoded), version)
+    return ("text/html; charset=utf-8",) + cached
+
+def build_listing_json(path, request_path, version, sort_by, params):
+    offset = max(0, int(params.get('cursor', ['0'])[0] or 0))
+    limit = min(max(int(params.get('limit', [LISTING_PAGE_SIZE])[0]), 1), LISTING_MAX_PAGE_SIZE)
+
+    file_data, all_subtitles = listing_entries(path, version, sort_by)
+    file_data = filter_entries(file_data, params.get('q', [''])[0], params.get('type', [''])[0])
+
+    end = offset + limit
+    listing = {
+        'path': urllib.parse.unquote(urllib.parse.urlparse(request_path).path),
+        'sort': sort_by,
+        'total': len(file_data),
+        'next_cursor': str(end) if end < len(file_data) else None,
+        'subtitles': all_subtitles,
+        'entries': [entry_json(item) for item in file_data[offset:end]],
+    }
+    return json.dumps(listing).encode('utf-8', 'surrogateescape')
+
+file_watcher = None
+
+def events_folder(query_string):
+    """Folder named by the dir= parameter of an /__events request, relative
+    to the served root ('' for the root), or None if there's no such folder.
+    Shared by both engines."""
+    if not LIVE_UPDATES_ENABLED:
+        return None
+    folder = urllib.parse.parse_qs(query_string).get('dir', ['/'])[0]
+    parts = [part for part in folder.replace('\\', '/').split('/') if part]
+    if any(part in ('.', '..') for part in parts):
+        return None
+    folder = '/'.join(parts)
+    if not os.path.isdir(os.path.join(os.getcwd(), folder)):
+        return None
+    return folder
+
+def apply_fs_changes(changes):
+    """FileWatcher callback: drop cached listings of changed folders, update
+    the search index and push the changes to anyone viewing the folders."""
+    for folder, names in changes.items():
+        if names is not None:
+            # Hidden upload/temp files change constantly while an upload runs
+            names = {name for name in names if os.path.splitext(name)[1].lower() not in EXCLUDED_EXTENSIONS}
+            if not names:
+                continue
+        path = os.path.join(file_watcher.root, folder)
+        abspath = os.path.abspath(path)
+        listing_cache.invalidate(lambda key: key[1] == abspath)
+        search_index.refresh(path)
+        if not event_hub.has_viewers(folder):
+            continue
+        if names is None:
+            event_hub.publish(folder, 'reload', {})
+            continue
+
+        # A new or removed subtitle changes the videos it belongs to
+        for name in list(names):
+            base_name, ext = os.path.splitext(name)
+            if ext.lower() in ('.srt', '.vtt'):
+                names.update(base_name + video_ext for video_ext in MEDIA_EXTS['video']
+                             if os.path.exists(os.path.join(path, base_name + video_ext)))
+
+        upserted = []
+        removed = []
+        for name in sorted(names):
+            entry = stat_entry(path, name)
+            if entry is None:
+                removed.append(name)
+            else:
+                upserted.append(entry_json(entry))
+        if upserted or removed:
+            event_hub.publish(folder, 'change', {'upserted': upserted, 'removed': removed})
+
+def status_data(engine, pool_stats=None):
+    """The /__status document. Shared by both engines."""
+    return {
+        'engine': engine,
+        'pid': os.getpid(),
+        'threads': threading.active_count(),
+        'pool': pool_stats,
+        'rate_limiter': rate_limiter.stats(),
+        'listing_cache': listing_cache.stats(),
+        'compression_cache': compression.compressed_cache.stats(),
+        'block_cache': block_cache.stats(),
+        'bandwidth': bandwidth.stats(),
+        'access_log': access_log.stats(),
+        'thumbnails': thumbnail_service.stats(),
+        'subtitle_cache': subtitles.subtitle_cache.stats(),
+        'search': search_index.stats(),
+        'live_updates': live_update_stats(),
+        'uploads': resumable_uploads.stats(),
+    }
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def metrics_text(engine, pool_stats=None):
+    """The /__metrics body: the recorded request metrics plus gauges read
+    from the caches, queues and services at scrape time. Shared by both
+    engines."""
+    caches = {
+        'listing': listing_cache.stats(),
+        'compression': compression.compressed_cache.stats(),
+        'subtitle': subtitles.subtitle_cache.stats(),
+    }
+    if block_cache.enabled:
+        block = block_cache.stats()
+        caches['block'] = dict(block, hits=block['hits'] + block['coalesced'])
+
+    def per_cache(key):
+        return [(f'cache="{name}"', stats[key]) for name, stats in caches.items()]
+
+    thumbs = thumbnail_service.stats()
+    uploads = resumable_uploads.stats()
+    shaping = bandwidth.stats()
+    logged = access_log.stats()
+    gauges = [
+        ('process_threads', 'gauge', "Threads in this process", [(f'engine="{engine}"', threading.active_count())]),
+        ('cache_hits_total', 'counter', "Cache lookups answered from the cache", per_cache('hits')),
+        ('cache_misses_total', 'counter', "Cache lookups that missed", per_cache('misses')),
+        ('cache_hit_ratio', 'gauge', "Share of cache lookups that hit, since start", per_cache('hit_ratio')),
+        ('cache_bytes', 'gauge', "Bytes held by each cache", per_cache('bytes')),
+        ('thumbnails_generated_total', 'counter', "Thumbnails rendered", [('', thumbs['generated'])]),
+        ('thumbnails_rejected_total', 'counter', "Thumbnail requests refused while renderers were busy",
+         [('', thumbs['rejected'])]),
+        ('uploads_in_progress', 'gauge', "Resumable uploads started but not complete", [('', uploads['in_progress'])]),
+        ('uploads_completed_total', 'counter', "Resumable uploads completed", [('', uploads['completed'])]),
+        ('bandwidth_bytes_per_second', 'gauge', "Current send rate over all clients", [('', shaping['throughput'])]),
+        ('bandwidth_transfers_active', 'gauge', "Response bodies being sent, by class",
+         [(f'class="{name}"', count) for name, count in shaping['active_transfers'].items()]),
+        ('bandwidth_throttled_seconds_total', 'counter', "Time transfers spent paused by the bandwidth limits",
+         [('', shaping['throttled_seconds'])]),
+        ('rate_limiter_clients', 'gauge', "Clients tracked by the rate limiter", [('', rate_limiter.stats()['clients'])]),
+        ('event_streams_active', 'gauge', "Open live-update streams", [('', event_hub.count())]),
+        ('access_log_queued', 'gauge', "Log records waiting for the writer thread", [('', logged['queued'])]),
+        ('access_log_dropped_total', 'counter', "Log records lost to a full queue or a failed write",
+         [('', logged['dropped'])]),
+        ('access_log_write_errors_total', 'counter', "Failed writes to the access log file",
+         [('', logged['errors'])]),
+    ]
+    if pool_stats is not None:
+        gauges += [
+            ('worker_pool_busy', 'gauge', "Pool threads serving a connection", [('', pool_stats['busy'])]),
+            ('worker_pool_queue_depth', 'gauge', "Accepted connections waiting for a pool thread",
+             [('', pool_stats['queue_depth'])]),
+            ('worker_pool_rejected_total', 'counter', "Connections turned away with a 503 by load shedding",
+             [('', pool_stats['rejected'])]),
+        ]
+    return metrics.render(gauges)
+
+def live_update_stats():
+    if file_watcher is None:
+        return None
+    return dict(file_watcher.stats(), **event_hub.stats())
+
+def search_response(query_string):
+    """Return (status, JSON body) for a /__search request.
+
+    Parameters: q (words that must all occur in the name), path (only
+    search below this folder), cursor and limit. Shared by both engines.
+    """
+    params = urllib.parse.parse_qs(query_string)
+    query = params.get('q', [''])[0].strip()
+    scope = params.get('path', ['/'])[0]
+    try:
+        offset = max(0, int(params.get('cursor', ['0'])[0] or 0))
+        limit = min(max(int(params.get('limit', [SEARCH_PAGE_SIZE])[0]), 1), SEARCH_MAX_MATCHES)
+    except ValueError:
+        return 400, json.dumps({'error': "Invalid cursor or limit"}).encode('utf-8')
+    if not SEARCH_ENABLED:
+        return 404, json.dumps({'error': "Search is disabled"}).encode('utf-8')
+
+    started = time.perf_counter()
+    matches = search_index.search(query, scope)
+    results = []
+    for rank, snapshot, index, start in matches[offset:offset + limit]:
+        name, path, is_dir = search_index.entry(snapshot, index, start)
+        try:
+            st = os.stat(os.path.join(search_index.root, path))
+        except OSError:
+            continue  # removed since it was indexed
+        folder = f"/{os.path.dirname(path)}/" if '/' in path else "/"
+        results.append({
+            'name': name,
+            'path': f"/{path}/" if is_dir else f"/{path}",
+            'folder': folder,
+            'url': urllib.parse.quote(f"/{path}/" if is_dir else f"/{path}"),
+            'folder_url': urllib.parse.quote(folder),
+            'is_dir': is_dir,
+            'size': 0 if is_dir else st.st_size,
+            'size_str': "" if is_dir else format_size(st.st_size),
+            'mtime': st.st_mtime,
+            'date_str': format_date(st.st_mtime),
+            'rank': rank,
+        })
+
+    end = offset + limit
+    body = {
+        'query': query,
+        'path': scope,
+        'total': len(matches),
+        'truncated': len(matches) >= SEARCH_MAX_MATCHES,
+        'next_cursor': str(end) if end < len(matches) else None,
+        'indexing': not search_index.ready,
+        'took_ms': round(1000 * (time.perf_counter() - started), 3),
+        'results': results,
+    }
+    return 200, json.dumps(body).encode('utf-8', 'surrogateescape')
+
+def listing_version(path):
+    # A directory's mtime changes whenever an entry is added, removed or renamed.
+    # Directories touched within the last second may still change inside the same
+    # timestamp tick, so they are not cached at all (version None).
+    st = os.stat(path)
+    if time.time() - st.st_mtime < 1:
+        return None
+    return st.st_mtime_ns
+
+class Entry:
+    """One scanned directory entry. Scans are cached and shared by every sort
+    order and page, so entries are kept small and never mutated."""
+
+    __slots__ = ('name', 'is_dir', 'size', 'mtime', 'ext', 'subtitle')
+
+    def __init__(self, name, is_dir, size, mtime, ext, subtitle=None):
+        self.name = name
+        self.is_dir = is_dir
+        self.size = size
+        self.mtime = mtime
+        self.ext = ext
+        self.subtitle = subtitle
+
+    @property
+    def type(self):
+        return 'folder' if self.is_dir else 'file'
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'is_dir': self.is_dir,
+            'size': self.size,
+            'mtime': self.mtime,
+            'type': self.type,
+            'ext': self.ext,
+            'subtitle': self.subtitle,
+        }
+
+def stat_entry(dir_path, name):
+    # Entry for a single name, as scan_directory() would build it; None if it's gone
+    try:
+        st = os.stat(os.path.join(dir_path, name))
+    except OSError:
+        return None
+    is_dir = stat.S_ISDIR(st.st_mode)
+    base_name, ext = os.path.splitext(name)
+    ext = ext.lower()
+    subtitle_file = None
+    if not is_dir and ext in MEDIA_EXTS['video']:
+        for candidate in (f"{base_name}.srt", f"{base_name}.vtt"):
+            if os.path.exists(os.path.join(dir_path, candidate)):
+                subtitle_file = candidate
+                break
+    return Entry(name, is_dir, 0 if is_dir else st.st_size, st.st_mtime, ext, subtitle_file)
+
+def scan_directory(path, version=None):
+    scan_key = ('scan', os.path.abspath(path))
+    cached = listing_cache.get(scan_key, version)
+    if cached is not None:
+        return cached
+
+    file_data = []
+    all_subtitles = []
+    with os.scandir(path) as it:
+        entries = list(it)
+    existing_files = {entry.name for entry in entries}
+
+    for entry in entries:
+        name = entry.name
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        size = 0
+        mtime = 0
+        base_name, ext = os.path.splitext(name)
+        ext = ext.lower()
+        if ext in ('.srt', '.vtt'):
+            all_subtitles.append(name)
+
+        subtitle_file = None
+        if not is_dir and ext in MEDIA_EXTS['video']:
+            # Auto-detect same-name subtitle
+            if f"{base_name}.srt" in existing_files:
+                subtitle_file = f"{base_name}.srt"
+            elif f"{base_name}.vtt" in existing_files:
+                subtitle_file = f"{base_name}.vtt"
+
+        # One stat per entry (follows symlinks, like isfile/getsize did)
+        try:
+            st = entry.stat()
+            mtime = st.st_mtime
+            if not is_dir:
+                size = st.st_size
+        except OSError:
+            pass
+
+        file_data.append(Entry(name, is_dir, size, mtime, ext, subtitle_file))
+
+    result = (file_data, all_subtitles)
+    if version is not None:
+        listing_cache.put(scan_key, result, 64 + sum(160 + 2 * len(item.name) for item in file_data), version)
+    return result
+
+def sort_entries(file_data, sort_by):
+    file_data = list(file_data)
+    if sort_by == 'name':
+        file_data.sort(key=lambda x: x.name.lower())
+    elif sort_by == 'size':
+        file_data.sort(key=lambda x: x.size, reverse=True)
+        file_data.sort(key=lambda x: not x.is_dir)
+    elif sort_by == 'date':
+        file_data.sort(key=lambda x: x.mtime, reverse=True)
+    elif sort_by == 'type':
+        file_data.sort(key=lambda x: (x.type, x.ext, x.name.lower()))
+    return file_data
+
+def listing_entries(path, version, sort_by):
+    # Visible entries of a directory in the requested order
+    sorted_key = ('sorted', os.path.abspath(path), sort_by)
+    cached = listing_cache.get(sorted_key, version)
+    if cached is not None:
+        return cached
+    file_data, all_subtitles = scan_directory(path, version)
+    file_data = [item for item in sort_entries(file_data, sort_by) if item.ext not in EXCLUDED_EXTENSIONS]
+    result = (file_data, all_subtitles)
+    if version is not None:
+        listing_cache.put(sorted_key, result, 64 + 16 * len(file_data), version)
+    return result
+
+def filter_entries(file_data, query='', kind=''):
+    if query:
+        query = query.lower()
+        file_data = [item for item in file_data if query in item.name.lower()]
+    if kind == 'folder':
+        file_data = [item for item in file_data if item.is_dir]
+    elif kind == 'file':
+        file_data = [item for item in file_data if not item.is_dir]
+    elif kind in MEDIA_EXTS:
+        file_data = [item for item in file_data if not item.is_dir and item.ext in MEDIA_EXTS[kind]]
+    return file_data
+
+# --- Listing presentation ---
+# Everything about an entry's look that depends only on its extension is
+# worked out once per extension (EXT_VIEWS) instead of once per entry.
+
+ExtView = namedtuple('ExtView', 'icon_class icon_text type_desc can_preview media_type thumb')
+
+ICON_GROUPS = (
+    (('.pdf',), 'icon-red', None),
+    (('.doc', '.docx', '.rtf', '.txt'), 'icon-blue', None),
+    (('.xls', '.xlsx', '.csv'), 'icon-green', None),
+    (('.ppt', '.pptx'), 'icon-yellow', None),
+    (('.mp4', '.mkv', '.mov', '.avi', '.webm'), 'icon-purple', None),
+    (('.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg'), 'icon-teal', None),
+    (('.zip', '.rar', '.7z', '.tar', '.gz'), 'icon-orange', None),
+    (('.py',), 'icon-python', 'PY'),
+    (('.js', '.html', '.css', '.cpp', '.c', '.json'), 'icon-gray', '</>'),
+)
+ICON_TEXT_ALIASES = {'DOCX': 'DOC', 'XLSX': 'XLS', 'PPTX': 'PPT', 'JPEG': 'JPG'}
+ICONS = {ext: (icon_class, icon_text) for exts, icon_class, icon_text in ICON_GROUPS for ext in exts}
+
+FOLDER_VIEW = ExtView('icon-folder', '', 'Folder', False, None, False)
+
+def make_ext_view(ext):
+    icon_class, icon_text = ICONS.get(ext, ('icon-gray', None))
+    if icon_text is None:
+        icon_text = ext.replace('.', '').upper()
+        icon_text = ICON_TEXT_ALIASES.get(icon_text, icon_text)
+    if len(icon_text) > 4: icon_text = icon_text[:3]
+
+    media_type = None
+    for kind in ('video', 'audio', 'image'):
+        if ext in MEDIA_EXTS[kind]:
+            media_type = kind
+            break
+
+    return ExtView(
+        icon_class,
+        icon_text,
+        f"{ext.upper().replace('.', '')} File",
+        ext in PREVIEWABLE_EXTS,
+        media_type,
+        THUMBNAILS_ENABLED and ext in THUMBNAIL_EXTS,
+    )
+
+EXT_VIEWS = {ext: make_ext_view(ext) for ext in set(ICONS).union(PREVIEWABLE_EXTS, *MEDIA_EXTS.values())}
+
+def ext_view(ext):
+    view = EXT_VIEWS.get(ext)
+    if view is None:
+        # Unusual extensions are cheap to classify; don't let them grow the table
+        view = make_ext_view(ext)
+    return view
+
+def format_size(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024.0:
+            return f"{size:.1f} {unit}"
+        size /= 1024.0
+    return f"{size:.1f} TB"
+
+@functools.lru_cache(maxsize=8192)
+def format_minute(minute):
+    try:
+        return datetime.datetime.fromtimestamp(minute * 60).strftime('%Y-%m-%d %H:%M')
+    except (OverflowError, OSError, ValueError):
+        return "Unknown"
+
+def format_date(mtime):
+    # The display has minute resolution, so entries from the same minute share a string
+    try:
+        return format_minute(int(mtime // 60))
+    except (OverflowError, ValueError):
+        return "Unknown"
+
+def entry_view(item):
+    # Display fields shared by the HTML grid and the JSON listing
+    view = FOLDER_VIEW if item.is_dir else ext_view(item.ext)
+    return {
+        'url': urllib.parse.quote(item.name + '/' if item.is_dir else item.name),
+        'icon_class': view.icon_class,
+        'icon_text': view.icon_text,
+        'size_str': "" if item.is_dir else format_size(item.size),
+        'date_str': format_date(item.mtime),
+        'type_desc': view.type_desc,
+        'can_preview': view.can_preview,
+        'media_type': view.media_type,
+        'thumb': view.thumb,
+    }
+
+def entry_json(item):
+    view = entry_view(item)
+    view.update(item.as_dict())
+    return view
+
+# Grid item markup, compiled once; fields are escaped by the caller
+FOLDER_ITEM_HTML = (
+    '<a href="{url}" class="item" data-name="{lower_name}">'
+    '<div class="file-icon icon-folder"></div>'
+    '<div class="info"><span class="name">{name}</span>'
+    '<span class="meta">Folder</span>'
+    '<span class="meta">{date}</span></div></a>\n'
+).format
+FILE_ITEM_HTML = (
+    '<div class="item" data-name="{lower_name}" '
+    'onclick="showModal(\'{url}\', {js_name}, {preview}, {media_type}, {subtitle})">'
+    '<div class="file-icon {icon_class}">{icon_text}{thumb}</div>'
+    '<div class="info"><span class="name">{name}</span>'
+    '<span class="meta">{size} • {type_desc}</span>'
+    '<span class="meta">{date}</span></div></div>\n'
+).format
+THUMB_HTML = (
+    '<img class="thumb" loading="lazy" alt="" onerror="this.remove()" '
+    'src="{base}{url}?w={width}&amp;v={version}">'
+).format
+
+# Per-extension pieces of FILE_ITEM_HTML that are already escaped/serialized
+ItemMarkup = namedtuple('ItemMarkup', 'icon_class icon_text type_desc preview media_type thumb')
+
+def item_markup(view):
+    return ItemMarkup(
+        view.icon_class,
+        html.escape(view.icon_text),
+        html.escape(view.type_desc),
+        'true' if view.can_preview else 'false',
+        f"'{view.media_type}'" if view.media_type else 'null',
+        view.thumb,
+    )
+
+ITEM_MARKUP = {ext: item_markup(view) for ext, view in EXT_VIEWS.items()}
+
+def render_items(file_data, thumb_base):
+    quote = urllib.parse.quote
+    escape = html.escape
+    dumps = json.dumps
+    r = []
+    for item in file_data:
+        name = escape(item.name)
+        lower_name = name.lower()
+        date = format_date(item.mtime)
+        if item.is_dir:
+            r.append(FOLDER_ITEM_HTML(url=quote(item.name + '/'), lower_name=lower_name, name=name, date=date))
+            continue
+
+        markup = ITEM_MARKUP.get(item.ext) or item_markup(ext_view(item.ext))
+        url = quote(item.name)
+        thumb = ''
+        if markup.thumb:
+            thumb = THUMB_HTML(base=thumb_base, url=url, width=THUMB_GRID_WIDTH, version=int(item.mtime))
+        r.append(FILE_ITEM_HTML(
+            lower_name=lower_name,
+            url=url,
+            js_name=escape(dumps(item.name)),
+            preview=markup.preview,
+            media_type=markup.media_type,
+            subtitle=f"'{quote(item.subtitle)}'" if item.subtitle else 'null',
+            icon_class=markup.icon_class,
+            icon_text=markup.icon_text,
+            thumb=thumb,
+            name=name,
+            size=format_size(item.size),
+            type_desc=markup.type_desc,
+            date=date,
+        ))
+    return r
+
+def render_listing(request_path, file_data, all_subtitles, sort_by):
+    r = []
+    parsed_url = urllib.parse.urlparse(request_path)
+    clean_path = parsed_url.path 
+    displaypath = html.escape(urllib.parse.unquote(clean_path))
+    
+    r.append('<!DOCTYPE html>')
+    r.append('<html lang="en">')
+    r.append('<head>')
+    r.append('<meta charset="utf-8">')
+    r.append('<meta name="viewport" content="width=device-width, initial-scale=1">')
+    r.append(f'<title>Files: {displaypath}</title>')
+    r.append(f'<link rel="stylesheet" href="{LISTING_CSS.url}">')
+    r.append('</head>')
+    r.append('<body>') 
+    r.append('<div class="header">')
+    r.append(f'<h1>File Manager</h1>')
+    r.append('</div>')
+    r.append('<div class="breadcrumb">')
+    path_parts = clean_path.strip('/').split('/')
+    
+    # Home is always a link
+    r.append('<a href="/">Home</a>')
+    
+    for part in path_parts:
+        if part:
+            display_part = urllib.parse.unquote(part)
+            r.append('<span class="breadcrumb-sep">></span>')
+            r.append(f'<span>{html.escape(display_part)}</span>')
+    r.append('</div>')
    
-        r.append('<div class="controls">')
-        r.append('<input type="text" id="search" placeholder="Search files..." onkeyup="filterFiles()">')
-        
-        r.append('<div style="display: flex; gap: 10px; align-items: center;">')
-        r.append('<div class="view-toggle">')
-        r.append('<button class="view-btn" onclick="toggleView(\'grid\', event)" title="Grid View">◼◼</button>')
-        r.append('<button class="view-btn" onclick="toggleView(\'list\', event)" title="List View">≡</button>')
-        r.append('</div>')
-        
+    r.append('<div class="controls">')
+    r.append('<input type="text" id="search" placeholder="Search files..." onkeyup="filterFiles()">')
+    
+    r.append('<div style="display: flex; gap: 10px; align-items: center;">')
+    r.append('<div class="view-toggle">')
+    r.append('<button class="view-btn" onclick="toggleView(\'grid\', event)" title="Grid View">◼◼</button>')
+    r.append('<button class="view-btn" onclick="toggleView(\'list\', event)" title="List View">≡</button>')
+    r.append('</div>')
+    
+    r.append('<div class="sort-dropdown">')
+    r.append('<button class="sort-btn">Sort By ▾</button>')
+    r.append('<div class="sort-content">')
+    r.append(f'<a href="?sort=name">Name</a>')
+    r.append(f'<a href="?sort=size">Size</a>')
+    r.append(f'<a href="?sort=date">Date Modified</a>')
+    r.append(f'<a href="?sort=type">Type</a>')
+    r.append('</div>')
+    r.append('</div>')
+    
+    if ARCHIVE_DOWNLOADS_ENABLED:
         r.append('<div class="sort-dropdown">')
-        r.append('<button class="sort-btn">Sort By ▾</button>')
+        r.append('<button class="sort-btn">Download ▾</button>')
         r.append('<div class="sort-content">')
-        r.append(f'<a href="?sort=name">Name</a>')
-        r.append(f'<a href="?sort=size">Size</a>')
-        r.append(f'<a href="?sort=date">Date Modified</a>')
-        r.append(f'<a href="?sort=type">Type</a>')
-        r.append('</div>')
-        r.append('</div>')
-        
-        r.append('<button class="upload-btn" onclick="showUploadForm()">Upload File</button>')
+        r.append('<a href="?download=zip">Folder as .zip</a>')
+        r.append('<a href="?download=tar">Folder as .tar</a>')
+        r.append('<a href="#" onclick="toggleSelectMode(); return false;">Select files…</a>')
         r.append('</div>')
         r.append('</div>')
-        
-        r.append('<div id="upload-form" class="upload-form" style="display: none;">')
-        r.append('<h3>Upload Files</h3>')
-        r.append('<div class="drop-zone" id="drop-zone">')
-        r.append('<div class="drop-icon">📁</div>')
-        r.append('<div class="drop-text">Drag and drop files here</div>')
-        r.append('<div class="drop-hint">or click to select files</div>')
-        r.append('<input type="file" class="file-input" id="file-input" multiple>')
-        r.append('</div>')
-        r.append('<div class="file-list" id="file-list"></div>')
-        r.append('<div class="upload-progress" id="upload-progress" style="display: none;">')
-        r.append('<div class="progress-bar">')
-        r.append('<div class="progress-fill" id="progress-fill"></div>')
-        r.append('</div>')
-        r.append('<div class="progress-text" id="progress-text">0%</div>')
-        r.append('</div>')
-        r.append('<div style="display: flex; gap: 10px; margin-top: 15px;">')
-        r.append('<button type="button" class="upload-btn" onclick="startUpload()" id="upload-button">Upload Files</button>')
-        r.append('<button type="button" class="btn-cancel" onclick="hideUploadForm()">Cancel</button>')
-        r.append('</div>')
+
+    r.append('<button class="upload-btn" onclick="showUploadForm()">Upload File</button>')
+    r.append('</div>')
+    r.append('</div>')
+    
+    r.append('<div id="upload-form" class="upload-form" style="display: none;">')
+    r.append('<h3>Upload Files</h3>')
+    r.append('<div class="drop-zone" id="drop-zone">')
+    r.append('<div class="drop-icon">📁</div>')
+    r.append('<div class="drop-text">Drag and drop files here</div>')
+    r.append('<div class="drop-hint">or click to select files</div>')
+    r.append('<input type="file" class="file-input" id="file-input" multiple>')
+    r.append('</div>')
+    r.append('<div class="file-list" id="file-list"></div>')
+    r.append('<div class="upload-progress" id="upload-progress" style="display: none;">')
+    r.append('<div class="progress-bar">')
+    r.append('<div class="progress-fill" id="progress-fill"></div>')
+    r.append('</div>')
+    r.append('<div class="progress-text" id="progress-text">0%</div>')
+    r.append('</div>')
+    r.append('<div style="display: flex; gap: 10px; margin-top: 15px;">')
+    r.append('<button type="button" class="upload-btn" onclick="startUpload()" id="upload-button">Upload Files</button>')
+    r.append('<button type="button" class="btn-cancel" onclick="hideUploadForm()">Cancel</button>')
+    r.append('</div>')
+    r.append('</div>')
+    
+    if ARCHIVE_DOWNLOADS_ENABLED:
+        r.append('<div id="selection-bar" class="selection-bar hidden">')
+        r.append('<span id="selection-count">0 selected</span>')
+        r.append('<button class="upload-btn" onclick="downloadSelection(\'zip\')">Download .zip</button>')
+        r.append('<button class="sort-btn" onclick="downloadSelection(\'tar\')">.tar</button>')
+        r.append('<button class="btn-cancel" onclick="toggleSelectMode()">Done</button>')
         r.append('</div>')
-        
-        r.append('<div class="grid" id="file-container">')
+    if SEARCH_ENABLED:
+        r.append('<div id="search-results" class="search-results hidden"></div>')
+    r.append('<div class="grid" id="file-container">')
+    thumb_base = '/__thumb' + urllib.parse.quote(urllib.parse.unquote(clean_path))
 
-        for item in file_data:
-            name = item['name']
-            is_dir = item['is_dir']
-            
-            subtitle_url = 'null'
-            if item.get('subtitle'):
-                 subtitle_url = f"'{urllib.parse.quote(item['subtitle'])}'"
-
-            displayname = name
-            linkname = name
-            ext = item['ext']
-            if ext in EXCLUDED_EXTENSIONS:
-                continue
-            
-            if is_dir:
-                displayname = name
-                linkname = name + "/"
-            
-            icon_class = "icon-gray"
-            icon_text = ext.replace('.', '').upper()
-            
-            if is_dir:
-                icon_class = "icon-folder"
-                icon_text = ""
-            elif ext == '.pdf':
-                icon_class = "icon-red"
-                icon_text = "PDF"
-            elif ext in ['.doc', '.docx', '.rtf', '.txt']:
-                icon_class = "icon-blue"
-                if icon_text == "DOCX": icon_text = "DOC"
-            elif ext in ['.xls', '.xlsx', '.csv']:
-                icon_class = "icon-green"
-                if icon_text == "XLSX": icon_text = "XLS"
-            elif ext in ['.ppt', '.pptx']:
-                icon_class = "icon-yellow"
-                if icon_text == "PPTX": icon_text = "PPT"
-            elif ext in ['.mp4', '.mkv', '.mov', '.avi', '.webm']:
-                icon_class = "icon-purple"
-            elif ext in ['.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg']:
-                icon_class = "icon-teal"
-                if icon_text == "JPEG": icon_text = "JPG"
-            elif ext in ['.zip', '.rar', '.7z', '.tar', '.gz']:
-                icon_class = "icon-orange"
-            elif ext == '.py':
-                icon_class = "icon-python" 
-                icon_text = "PY"
-            elif ext in ['.js', '.html', '.css', '.cpp', '.c', '.json']:
-                icon_class = "icon-gray"
-                icon_text = "</>"
-
-            if len(icon_text) > 4: icon_text = icon_text[:3]
-
-            size_str = ""
-            date_str = ""
-            can_preview = False
-            media_type = None
-            
-            if os.path.isfile(os.path.join(path, name)):
-                if ext in PREVIEWABLE_EXTS:
-                    can_preview = True
-                
-                if ext in MEDIA_EXTS['video']:
-                    media_type = 'video'
-                elif ext in MEDIA_EXTS['audio']:
-                    media_type = 'audio'
-                elif ext in MEDIA_EXTS['image']:
-                    media_type = 'image'
-                
-                try:
-                    size = item['size']
-                    for unit in ['B', 'KB', 'MB', 'GB']:
-                        if size < 1024.0:
-                            size_str = f"{size:.1f} {unit}"
-                            break
-                        size /= 1024.0
-                except OSError:
-                    size_str = "??"
-            
-            try:
-                mtime = item['mtime']
-                date_str = datetime.datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M')
-            except:
-                date_str = "Unknown"
-            
-            type_desc = "Folder" if is_dir else f"{ext.upper().replace('.', '')} File"
+    r.extend(render_items(file_data[:LISTING_PAGE_SIZE], thumb_base))
+    r.append('</div>')
 
-            url = urllib.parse.quote(linkname)
+    if len(file_data) > LISTING_PAGE_SIZE:
+        # Large folder: the page carries only the first page of entries and the
+        # grid switches to virtual scrolling over ?format=json
+        state = {
+            'total': len(file_data),
+            'next_cursor': str(LISTING_PAGE_SIZE),
+            'sort': sort_by,
+            'entries': [entry_json(item) for item in file_data[:LISTING_PAGE_SIZE]],
+        }
+        state_json = json.dumps(state).replace('</', '<\\/')
+        r.append(f'<script type="application/json" id="listing-state">{state_json}</script>')
+    
+    r.append("""
+    <div id="modal-overlay" class="modal-overlay" onclick="closeModal(event)">
+        <div class="modal">
+            <h3 id="modal-title">File Name</h3>
+            <div id="media-player" class="media-player hidden"></div>
             
-            if is_dir:
-                r.append(f'''
-                <a href="{url}" class="item" data-name="{name.lower()}">
-                    <div class="file-icon {icon_class}">{icon_text}</div>
-                    <div class="info">
-                        <span class="name">{displayname}</span>
-                        <span class="meta">{type_desc}</span>
-                        <span class="meta">{date_str}</span>
-                    </div>
-                </a>
-                ''')
-            else:
-                preview_flag = 'true' if can_preview else 'false'
-                media_type_attr = f"'{media_type}'" if media_type else 'null'
-                
-                # Encode list of all subtitles safely for JS
-                subs_encoded = urllib.parse.quote(json.dumps(all_subtitles))
-
-                r.append(f'''
-                <div class="item" data-name="{name.lower()}" onclick="showModal('{url}', '{name}', {preview_flag}, {media_type_attr}, {subtitle_url}, '{subs_encoded}')">
-                    <div class="file-icon {icon_class}">{icon_text}</div>
-                    <div class="info">
-                        <span class="name">{displayname}</span>
-                        <span class="meta">{size_str} • {type_desc}</span>
-                        <span class="meta">{date_str}</span>
-                    </div>
-                </div>
-                ''')
-
-        r.append('</div>')
-        
-        r.append("""
-        <div id="modal-overlay" class="modal-overlay" onclick="closeModal(event)">
-            <div class="modal">
-                <h3 id="modal-title">File Name</h3>
-                <div id="media-player" class="media-player hidden"></div>
-                
-                <div id="sub-control" class="sub-control hidden">
-                    <label for="sub-select">Subtitles:</label>
-                    <select id="sub-select" onchange="changeSubtitle(this.value)"></select>
-                </div>
-
-                <p id="modal-description">Select an action</p>
-                <a id="btn-preview" href="#" target="_blank" class="btn btn-preview">Preview in New Tab</a>
-                <a id="btn-download" href="#" download class="btn btn-download" onclick="stopMediaPlayback()">⬇️ Download</a>
-                <button onclick="closeModal(null)" class="btn btn-cancel">Cancel</button>
+            <div id="sub-control" class="sub-control hidden">
+                <label for="sub-select">Subtitles:</label>
+                <select id="sub-select" onchange="changeSubtitle(this.value)"></select>
             </div>
-        </div>
-        """)
-        
-        r.append("""
-        <script>
-            function stopMediaPlayback() {
-                var mediaPlayer = document.getElementById('media-player');
-                var video = mediaPlayer.querySelector('video');
-                var audio = mediaPlayer.querySelector('audio');
-                if (video) { video.pause(); }
-                if (audio) { audio.pause(); }
-            }
-            function toggleView(viewType, event) {
-                const container = document.getElementById('file-container');
-                const buttons = document.querySelectorAll('.view-btn');
-                if (event) {
-                    buttons.forEach(btn => btn.classList.remove('active'));
-                    event.currentTarget.classList.add('active');
-                }
-                if (viewType === 'list') {
-                    container.classList.remove('grid');
-                    container.classList.add('list');
-                    localStorage.setItem('viewPreference', 'list');
-                } else {
-                    container.classList.remove('list');
-                    container.classList.add('grid');
-                    localStorage.setItem('viewPreference', 'grid');
-                }
-            }
-            
-            document.addEventListener('DOMContentLoaded', function() {
-                const savedView = localStorage.getItem('viewPreference') || 'grid';
-                const container = document.getElementById('file-container');
-                const btnGrid = document.querySelector('.view-btn[title="Grid View"]');
-                const btnList = document.querySelector('.view-btn[title="List View"]');
-                if (savedView === 'list') {
-                    if (btnList) btnList.classList.add('active');
-                    container.classList.remove('grid');
-                    container.classList.add('list');
-                } else {
-                    if (btnGrid) btnGrid.classList.add('active');
-                    container.classList.remove('list');
-                    container.classList.add('grid');
-                }
-            });
-
-            function filterFiles() {
-                var input = document.getElementById('search');
-                var filter = input.value.toLowerCase();
-                var container = document.getElementById('file-container');
-                var items = container.children;
-                for (var i = 0; i < items.length; i++) {
-                    var name = items[i].getAttribute('data-name');
-                    if (name.indexOf(filter) > -1) {
-                        items[i].style.display = "";
-                    } else {
-                        items[i].style.display = "none";
-                    }
-                }
-            }
-
-            async function fetchAndConvertSubtitles(url) {
-                try {
-                    const response = await fetch(url);
-                    if (!response.ok) return null;
-                    const srtText = await response.text();
-                    
-                    // Simple SRT to VTT converter
-                    let vttText = "WEBVTT\\n\\n" + srtText.replace(/(\\d{2}:\\d{2}:\\d{2}),(\\d{3})/g, '$1.$2');
-                    
-                    const blob = new Blob([vttText], { type: 'text/vtt' });
-                    return URL.createObjectURL(blob);
-                } catch (e) {
-                    console.error("Subtitle conversion failed", e);
-                    return null;
-                }
-            }
-            
-            async function changeSubtitle(url) {
-                const video = document.querySelector('video');
-                if(!video) return;
-
-                let track = document.getElementById('dynamic-sub-track');
-                
-                // Cleanup old blob if exists
-                if (track && track.src && track.src.startsWith('blob:')) {
-                    URL.revokeObjectURL(track.src);
-                }
-
-                if (!url) {
-                    // User selected None
-                    if(track) track.remove();
-                    return;
-                }
-
-                // If track doesn't exist, create it
-                if (!track) {
-                    track = document.createElement('track');
-                    track.id = 'dynamic-sub-track';
-                    track.kind = 'subtitles';
-                    track.label = 'English';
-                    track.srclang = 'en';
-                    track.default = true;
-                    video.appendChild(track);
-                }
-
-                const trackUrl = await fetchAndConvertSubtitles(url);
-                if (trackUrl) {
-                    track.src = trackUrl;
-                    // Force update
-                    track.mode = 'hidden';
-                    track.mode = 'showing';
-                }
-            }
-
-            // --- FIX: Updated showModal to handle all subtitles ---
-            async function showModal(url, filename, canPreview, mediaType, subtitleUrl, allSubsEncoded) {
-                var overlay = document.getElementById('modal-overlay');
-                var title = document.getElementById('modal-title');
-                var btnPreview = document.getElementById('btn-preview');
-                var btnDownload = document.getElementById('btn-download');
-                var mediaPlayer = document.getElementById('media-player');
-                var description = document.getElementById('modal-description');
-                var subControl = document.getElementById('sub-control');
-                var subSelect = document.getElementById('sub-select');
-                
-                title.innerText = filename;
-                btnDownload.href = url;
-                btnDownload.setAttribute('download', filename);
-                
-                if (canPreview) {
-                    btnPreview.href = url;
-                    btnPreview.classList.remove('hidden');
-                } else {
-                    btnPreview.classList.add('hidden');
-                }
-                
-                mediaPlayer.innerHTML = '';
-                mediaPlayer.classList.add('hidden');
-                subControl.classList.add('hidden');
-                description.classList.remove('hidden');
-                
-                if (mediaType) {
-                    description.classList.add('hidden');
-                    mediaPlayer.classList.remove('hidden');
-                    
-                    if (mediaType === 'video') {
-                        let videoHtml = `<video controls autoplay style="width:100%"><source src="${url}" type="video/mp4">`;
-                        videoHtml += `<track id="dynamic-sub-track" label="English" kind="subtitles" srclang="en" default>`;
-                        videoHtml += `Your browser does not support the video tag.</video>`;
-                        mediaPlayer.innerHTML = videoHtml;
-
-                        // --- Populate Subtitle Dropdown ---
-                        subControl.classList.remove('hidden');
-                        subSelect.innerHTML = '<option value="">None</option>';
-                        
-                        try {
-                            const allSubs = JSON.parse(decodeURIComponent(allSubsEncoded || "[]"));
-                            let foundMatch = false;
-
-                            allSubs.forEach(sub => {
-                                const option = document.createElement('option');
-                                option.value = sub;
-                                option.text = sub;
-                                
-                                // Logic: If a subtitleUrl (matching name) exists, select it.
-                                // Otherwise, default to None.
-                                if (subtitleUrl && sub === subtitleUrl) {
-                                    option.selected = true;
-                                    foundMatch = true;
-                                }
-                                subSelect.appendChild(option);
-                            });
-
-                            if (foundMatch && subtitleUrl) {
-                                changeSubtitle(subtitleUrl);
-                            } else {
-                                // Default to none, remove track initially
-                                const track = document.getElementById('dynamic-sub-track');
-                                if(track) track.remove();
-                            }
-
-                        } catch(e) {
-                            console.error("Error parsing subs", e);
-                        }
-
-                    } else if (mediaType === 'audio') {
-                        mediaPlayer.innerHTML = `<audio controls autoplay><source src="${url}" type="audio/mpeg">Your browser does not support the audio tag.</audio>`;
-                    } else if (mediaType === 'image') {
-                        mediaPlayer.innerHTML = `<img src="${url}" alt="${filename}">`;
-                    }
-                }
-                
-                overlay.style.display = 'flex';
-                setTimeout(() => overlay.querySelector('.modal').classList.add('active'), 10);
-            }
 
-            function closeModal(e) {
-                if (e === null || e.target.id === 'modal-overlay') {
-                    var overlay = document.getElementById('modal-overlay');
-                    var mediaPlayer = document.getElementById('media-player');
-                    
-                    var video = mediaPlayer.querySelector('video');
-                    var audio = mediaPlayer.querySelector('audio');
-                    if (video) {
-                        video.pause();
-                        video.currentTime = 0;
-                        const track = video.querySelector('track');
-                        if (track && track.src && track.src.startsWith('blob:')) {
-                            URL.revokeObjectURL(track.src);
-                        }
-                    }
-                    if (audio) {
-                        audio.pause();
-                        audio.currentTime = 0;
-                    }
-                    
-                    overlay.querySelector('.modal').classList.remove('active');
-                    setTimeout(() => overlay.style.display = 'none', 200);
-                }
-            }
-
-            // Upload functionality
-            let selectedFiles = [];
-            function showUploadForm() { document.getElementById('upload-form').style.display = 'block'; }
-            function hideUploadForm() { document.getElementById('upload-form').style.display = 'none'; resetUploadForm(); }
-            function resetUploadForm() {
-                selectedFiles = [];
-                document.getElementById('file-list').innerHTML = '';
-                document.getElementById('upload-progress').style.display = 'none';
-                document.getElementById('progress-fill').style.width = '0%';
-                document.getElementById('progress-text').textContent = '0%';
-                document.getElementById('file-input').value = '';
-            }
-            
-            const dropZone = document.getElementById('drop-zone');
-            const fileInput = document.getElementById('file-input');
-            dropZone.addEventListener('click', () => { fileInput.click(); });
-            fileInput.addEventListener('change', (e) => { handleFiles(e.target.files); });
-            ['dragenter', 'dragover', 'dragleave', 'drop'].forEach(eventName => {
-                dropZone.addEventListener(eventName, preventDefaults, false);
-            });
-            function preventDefaults(e) { e.preventDefault(); e.stopPropagation(); }
-            ['dragenter', 'dragover'].forEach(eventName => { dropZone.addEventListener(eventName, highlight, false); });
-            ['dragleave', 'drop'].forEach(eventName => { dropZone.addEventListener(eventName, unhighlight, false); });
-            function highlight() { dropZone.classList.add('dragover'); }
-            function unhighlight() { dropZone.classList.remove('dragover'); }
-            dropZone.addEventListener('drop', (e) => {
-                const dt = e.dataTransfer;
-                const files = dt.files;
-                handleFiles(files);
-            });
-            function handleFiles(files) {
-                for (let i = 0; i < files.length; i++) {
-                    const file = files[i];
-                    if (!selectedFiles.some(f => f.name === file.name && f.size === file.size)) {
-                        selectedFiles.push(file);
-                    }
-                }
-                updateFileList();
-            }
-            function updateFileList() {
-                const fileList = document.getElementById('file-list');
-                fileList.innerHTML = '';
-                selectedFiles.forEach((file, index) => {
-                    const fileItem = document.createElement('div');
-                    fileItem.className = 'file-item';
-                    fileItem.innerHTML = `
-                        <div class="file-name">${file.name}</div>
-                        <div class="file-size">${formatFileSize(file.size)}</div>
-                        <div class="upload-status status-uploading" id="status-${index}"></div>
-                        <button onclick="removeFile(${index})" style="background: none; border: none; color: #f44336; cursor: pointer; margin-left: 10px;">×</button>
-                    `;
-                    fileList.appendChild(fileItem);
-                });
-            }
-            function removeFile(index) { selectedFiles.splice(index, 1); updateFileList(); }
-            function formatFileSize(bytes) {
-                if (bytes === 0) return '0 Bytes';
-                const k = 1024;
-                const sizes = ['Bytes', 'KB', 'MB', 'GB'];
-                const i = Math.floor(Math.log(bytes) / Math.log(k));
-                return parseFloat((bytes / Math.pow(k, i)).toFixed(2)) + ' ' + sizes[i];
-            }
-            function startUpload() {
-                if (selectedFiles.length === 0) { alert('Please select files to upload'); return; }
-                const formData = new FormData();
-                selectedFiles.forEach(file => { formData.append('files[]', file); });
-                const xhr = new XMLHttpRequest();
-                const progressBar = document.getElementById('progress-fill');
-                const progressText = document.getElementById('progress-text');
-                const uploadProgress = document.getElementById('upload-progress');
-                uploadProgress.style.display = 'block';
-                xhr.upload.addEventListener('progress', (e) => {
-                    if (e.lengthComputable) {
-                        const percentComplete = (e.loaded / e.total) * 100;
-                        progressBar.style.width = percentComplete + '%';
-                        progressText.textContent = Math.round(percentComplete) + '%';
-                    }
-                });
-                xhr.addEventListener('load', () => {
-                    if (xhr.status === 200 || xhr.status === 303) {
-                        progressBar.style.background = '#4CAF50';
-                        progressText.textContent = 'Upload Complete!';
-                        setTimeout(() => { hideUploadForm(); location.reload(); }, 1000);
-                    } else {
-                        progressBar.style.background = '#f44336';
-                        progressText.textContent = 'Upload Failed!';
-                    }
-                });
-                xhr.addEventListener('error', () => {
-                    progressBar.style.background = '#f44336';
-                    progressText.textContent = 'Upload Failed!';
-                });
-                xhr.open('POST', window.location.pathname + window.location.search);
-                xhr.send(formData);
-            }
-        </script>
-        """)
-        
-        r.append('</body></html>')
-        
-        encoded = ''.join(r).encode('utf-8', 'surrogateescape')
-        f = io.BytesIO()
-        f.write(encoded)
-        f.seek(0)
-        self.send_response(200)
-        self.send_header("Content-type", "text/html; charset=utf-8")
-        self.send_header("Content-Length", str(len(encoded)))
-        self.end_headers()
-        return f
+            <p id="modal-description">Select an action</p>
+            <a id="btn-preview" href="#" target="_blank" class="btn btn-preview">Preview in New Tab</a>
+            <a id="btn-download" href="#" download class="btn btn-download" onclick="stopMediaPlayback()">⬇️ Download</a>
+            <button onclick="closeModal(null)" class="btn btn-cancel">Cancel</button>
+        </div>
+    </div>
+    """)
+    
+    thumb_config = {'grid': THUMB_GRID_WIDTH, 'preview': THUMB_PREVIEW_WIDTH} if THUMBNAILS_ENABLED else None
+    # Page-wide data is emitted once here rather than repeated on every item
+    subtitles_json = json.dumps(all_subtitles).replace('</', '<\\/')
+    r.append(f'<script>const THUMBS = {json.dumps(thumb_config)}; const SUBTITLES = {subtitles_json}; '
+             f'const LIVE_UPDATES = {json.dumps(LIVE_UPDATES_ENABLED)}; const UPLOAD_PARALLEL = {UPLOAD_PARALLEL_CHUNKS};</script>')
+    r.append(f'<script src="{LISTING_JS.url}"></script>')
+    
+    r.append('</body></html>')
+    
+    return ''.join(r).encode('utf-8', 'surrogateescape')
 
 def get_local_ip():
     try:
@@ -1012,25 +2129,63 @@ def run_server():
     
     ThreadedTCPServer.allow_reuse_address = True   
     try:
-        with ThreadedTCPServer(("", PORT), ModernHandler) as httpd:
-            local_ip = get_local_ip()
-            local_url = f"http://{local_ip}:{PORT}"
-            
-            print(f"\n{'='*60}")
-            print("SERVER STARTING..")
-            print(f"Port: {PORT}")
-            print(f"Local URL: http://127.0.0.1:{PORT}")
-            print(f"Network URL: {local_url}")
-            display_qr_code(local_url)
-            
-            print("Press Ctrl+C to stop the server")
-            print(f"{'='*60}\n")
-            httpd.serve_forever()
+        if SERVER_WORKERS > 1 and workers.supported():
+            # Counters must live in shared memory before the workers fork
+            global rate_limiter
+            rate_limiter = workers.SharedRateLimiter()
+            workers.run_workers(SERVER_WORKERS, PORT, serve, on_ready=print_banner)
+        else:
+            if SERVER_WORKERS > 1:
+                print("Note: --workers needs fork(); running a single process.")
+            serve(on_ready=print_banner)
     except KeyboardInterrupt:
         print("\nServer stopped.")
     except Exception as e:
         print(f"Server error: {e}")
 
+def serve(sock=None, on_ready=None):
+    # Serves PORT, or an already listening socket handed over by a worker supervisor
+    try:
+        run_engine(sock, on_ready)
+    finally:
+        access_log.close()
+
+def run_engine(sock, on_ready):
+    if SEARCH_ENABLED:
+        search_index.start(os.getcwd())
+    if LIVE_UPDATES_ENABLED:
+        global file_watcher
+        max_watches = max(1, WATCH_MAX_DIRS // SERVER_WORKERS) if WATCH_MAX_DIRS else 0
+        file_watcher = FileWatcher(os.getcwd(), apply_fs_changes, event_hub.directories, max_watches)
+        file_watcher.start()
+    if SERVER_ENGINE == "asyncio":
+        import async_server
+        async_server.serve(PORT, on_ready=on_ready, sock=sock)
+        return
+    server_class = PooledTCPServer if WORKER_THREADS > 0 else ThreadedTCPServer
+    with server_class(("", PORT), ModernHandler, bind_and_activate=sock is None) as httpd:
+        if sock is not None:
+            httpd.socket.close()
+            httpd.socket = sock
+            httpd.server_address = sock.getsockname()
+        if on_ready:
+            on_ready()
+        httpd.serve_forever()
+
+def print_banner():
+    local_ip = get_local_ip()
+    local_url = f"http://{local_ip}:{PORT}"
+    
+    print(f"\n{'='*60}")
+    print("SERVER STARTING..")
+    print(f"Port: {PORT}")
+    print(f"Local URL: http://127.0.0.1:{PORT}")
+    print(f"Network URL: {local_url}")
+    display_qr_code(local_url)
+    
+    print("Press Ctrl+C to stop the server")
+    print(f"{'='*60}\n")
+
 if __name__ == "__main__":
     if segno is None:
         print("Warning: 'segno' library not installed. QR code feature will be disabled.")
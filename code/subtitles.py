@@ -0,0 +1,94 @@
+import re
+
+from config import *
+from cache import LRUCache
+
+try:
+    import charset_normalizer
+except ImportError:
+    charset_normalizer = None
+
+# Subtitles as WebVTT for the video player (/__vtt/<path>).
+# Browsers only take WebVTT in a <track>, so .srt files are converted here
+# instead of in every page that opens a video: the text is decoded (BOM,
+# then UTF-8, then charset_normalizer when it is installed, then
+# SUBTITLE_FALLBACK_ENCODINGS), timestamps are rewritten from "00:01:02,500"
+# to "00:01:02.500", and markup WebVTT doesn't know (<font>, {\an8}) is
+# dropped. .vtt files are only re-encoded as UTF-8. Results are kept in
+# subtitle_cache, keyed by path and versioned by mtime and size.
+
+SUBTITLE_EXTS = ('.srt', '.vtt')
+
+BOMS = (
+    (b'\xef\xbb\xbf', 'utf-8'),
+    (b'\xff\xfe', 'utf-16-le'),
+    (b'\xfe\xff', 'utf-16-be'),
+)
+
+TIMESTAMP = r'(\d+):(\d{1,2}):(\d{1,2})(?:[,.](\d{1,3}))?'
+TIMING_RE = re.compile(r'\s*' + TIMESTAMP + r'\s*-->\s*' + TIMESTAMP)
+FONT_TAG_RE = re.compile(r'</?font\b[^>]*>', re.IGNORECASE)
+ASS_TAG_RE = re.compile(r'\{\\[^}]*\}')
+CUE_BREAK_RE = re.compile(r'\n[ \t]*\n')
+
+# Converted subtitles, keyed by path
+subtitle_cache = LRUCache(SUBTITLE_CACHE_MB * 1024 * 1024)
+
+
+def decode(data):
+    for bom, encoding in BOMS:
+        if data.startswith(bom):
+            return data[len(bom):].decode(encoding, 'replace')
+    head = data[:1024]
+    if head.count(b'\0') > len(head) // 4:
+        # UTF-16 without a BOM: text is mostly ASCII, so half the bytes are zero
+        encoding = 'utf-16-le' if head[1::2].count(b'\0') > head[0::2].count(b'\0') else 'utf-16-be'
+        return data.decode(encoding, 'replace')
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        pass
+    if charset_normalizer is not None:
+        best = charset_normalizer.from_bytes(data).best()
+        if best is not None:
+            return str(best)
+    for encoding in SUBTITLE_FALLBACK_ENCODINGS:
+        try:
+            return data.decode(encoding)
+        except (UnicodeDecodeError, LookupError):
+            continue
+    return data.decode('latin-1')
+
+
+def format_timestamp(hours, minutes, seconds, fraction):
+    # "5" after the comma is half a second, not five milliseconds
+    return f"{int(hours):02d}:{int(minutes):02d}:{int(seconds):02d}.{(fraction or '0').ljust(3, '0')}"
+
+
+def srt_to_vtt(text):
+    cues = []
+    for block in CUE_BREAK_RE.split(text.strip()):
+        lines = block.split('\n')
+        # The cue number (if any) comes before the timing line
+        for i, line in enumerate(lines[:2]):
+            timing = TIMING_RE.match(line)
+            if timing:
+                break
+        else:
+            continue
+        start, end = timing.groups()[:4], timing.groups()[4:]
+        payload = [ASS_TAG_RE.sub('', FONT_TAG_RE.sub('', text)).replace('-->', '->') for text in lines[i + 1:]]
+        payload = [text for text in payload if text.strip()]
+        if payload:
+            cues.append(f"{format_timestamp(*start)} --> {format_timestamp(*end)}\n" + '\n'.join(payload))
+    return "WEBVTT\n\n" + '\n\n'.join(cues) + '\n'
+
+
+def to_vtt(data, ext):
+    """WebVTT text (UTF-8 bytes) for the raw contents of a .srt or .vtt file."""
+    text = decode(data).lstrip('\ufeff').replace('\r\n', '\n').replace('\r', '\n')
+    if ext == '.vtt':
+        if not text.startswith('WEBVTT'):
+            text = "WEBVTT\n\n" + text
+        return text.encode('utf-8')
+    return srt_to_vtt(text).encode('utf-8')
@@ -0,0 +1,347 @@
+import hashlib
+import multiprocessing
+import os
+import secrets
+import struct
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from config import *
+from cache import LRUCache
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Image thumbnails for the /__thumb/ endpoint.
+# With Pillow installed, thumbnails are rendered in a small process pool.
+# Without it, the JPEG thumbnail most cameras embed in the EXIF block is used
+# as-is (small widths only). Results live in a disk cache under
+# THUMB_CACHE_DIR, named by a hash of source path, mtime, size and width, so a
+# changed file simply gets a new entry and old ones age out.
+
+THUMBNAIL_EXTS = MEDIA_EXTS['image'] - {'.svg'}
+EXIF_SCAN_BYTES = 128 * 1024  # the EXIF APP1 segment sits at the start and is at most 64 KB
+EXIF_MAX_WIDTH = 320  # embedded thumbnails are ~160 px; don't pass them off as bigger ones
+TOUCH_INTERVAL = 3600  # seconds between mtime bumps of a cache file (coarse LRU)
+
+
+class ThumbnailBusy(Exception):
+    pass
+
+
+def pick_width(requested):
+    # Snap to a few fixed sizes so the cache can't be filled with arbitrary widths
+    for width in THUMB_WIDTHS:
+        if requested <= width:
+            return width
+    return THUMB_WIDTHS[-1]
+
+
+def backend_name():
+    return 'pillow' if Image is not None else 'exif'
+
+
+# --- Pure-Python EXIF thumbnail extraction ---
+
+def exif_thumbnail(path):
+    """The JPEG thumbnail embedded in a JPEG's EXIF data, or None.
+
+    Embedded thumbnails carry no orientation of their own, so portrait shots
+    from cameras that rely on the EXIF Orientation tag show up sideways.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(EXIF_SCAN_BYTES)
+    if head[:2] != b'\xff\xd8':
+        return None
+    pos = 2
+    while pos + 4 <= len(head):
+        if head[pos] != 0xFF:
+            return None
+        marker = head[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker in (0xD9, 0xDA):  # end of image / start of scan: no metadata after this
+            return None
+        segment_length = int.from_bytes(head[pos + 2:pos + 4], 'big')
+        if marker == 0xE1 and head[pos + 4:pos + 10] == b'Exif\x00\x00':
+            return _tiff_thumbnail(head[pos + 10:pos + 2 + segment_length])
+        pos += 2 + segment_length
+    return None
+
+
+def _tiff_thumbnail(tiff):
+    # IFD1 (the entry after IFD0) holds the thumbnail's offset and length
+    if tiff[:2] == b'II':
+        order = '<'
+    elif tiff[:2] == b'MM':
+        order = '>'
+    else:
+        return None
+    try:
+        ifd0 = struct.unpack_from(order + 'I', tiff, 4)[0]
+        count = struct.unpack_from(order + 'H', tiff, ifd0)[0]
+        ifd1 = struct.unpack_from(order + 'I', tiff, ifd0 + 2 + 12 * count)[0]
+        if not ifd1:
+            return None
+        offset = length = None
+        count = struct.unpack_from(order + 'H', tiff, ifd1)[0]
+        for i in range(count):
+            tag, kind, _, value = struct.unpack_from(order + 'HHII', tiff, ifd1 + 2 + 12 * i)
+            if kind == 3:  # SHORT: the value sits in the first two bytes of the field
+                value = struct.unpack_from(order + 'H', tiff, ifd1 + 2 + 12 * i + 8)[0]
+            if tag == 0x0201:
+                offset = value
+            elif tag == 0x0202:
+                length = value
+    except struct.error:
+        return None
+    if offset is None or not length:
+        return None
+    data = tiff[offset:offset + length]
+    if len(data) != length or data[:2] != b'\xff\xd8':
+        return None
+    return data
+
+
+# --- Pillow rendering (runs in the process pool) ---
+
+def render_thumbnail(source, dest, width):
+    with Image.open(source) as im:
+        # Let the JPEG decoder downscale while decoding; far cheaper than a full decode
+        im.draft('RGB', (width, width))
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail((width, width))
+        if im.mode in ('RGBA', 'LA', 'P'):
+            im = im.convert('RGBA')
+            background = Image.new('RGB', im.size, (30, 30, 30))
+            background.paste(im, mask=im.getchannel('A'))
+            im = background
+        elif im.mode != 'RGB':
+            im = im.convert('RGB')
+        tmp = f"{dest}.{secrets.token_hex(4)}.tmp"
+        im.save(tmp, 'JPEG', quality=THUMB_QUALITY, optimize=True)
+    os.replace(tmp, dest)
+    return True
+
+
+class ThumbnailCache:
+    """Size-capped directory of thumbnails with least-recently-used eviction.
+
+    Recency is the file mtime, bumped on use at most once per TOUCH_INTERVAL,
+    so the order survives restarts. The index is built on first use.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index = None  # path -> size, oldest first
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key[:2], key[2:] + '.jpg')
+
+    def load_index(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if name.endswith('.tmp'):
+                    # Left behind by an interrupted render
+                    if time.time() - st.st_mtime > 3600:
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            pass
+                    continue
+                entries.append((st.st_mtime, path, st.st_size))
+        entries.sort()
+        self.index = OrderedDict((path, size) for _, path, size in entries)
+        self.size = sum(self.index.values())
+
+    def lookup(self, key):
+        path = self.path_for(key)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if time.time() - st.st_mtime > TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        with self.lock:
+            if self.index is not None and path in self.index:
+                self.index.move_to_end(path)
+        return path
+
+    def prepare(self, key):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def write(self, key, data):
+        path = self.prepare(key)
+        tmp = f"{path}.{secrets.token_hex(4)}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self.added(path)
+        return path
+
+    def added(self, path):
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            return
+        with self.lock:
+            if self.index is None:
+                self.load_index()
+            old = self.index.pop(path, None)
+            if old is not None:
+                self.size -= old
+            self.index[path] = size
+            self.size += size
+            # Evict down to 90% so every new thumbnail doesn't trigger another sweep
+            if self.size > self.max_bytes:
+                while self.index and self.size > self.max_bytes * 0.9:
+                    victim, victim_size = self.index.popitem(last=False)
+                    self.size -= victim_size
+                    try:
+                        os.remove(victim)
+                    except OSError:
+                        pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.index) if self.index is not None else None,
+                'bytes': self.size if self.index is not None else None,
+                'max_bytes': self.max_bytes,
+            }
+
+
+class ThumbnailService:
+    def __init__(self):
+        self.cache = ThumbnailCache(THUMB_CACHE_DIR, THUMB_CACHE_MB * 1024 * 1024)
+        # Sources that yielded nothing (no backend, no EXIF thumbnail, undecodable)
+        self.failures = LRUCache(4096)
+        self.pool = None
+        self.lock = threading.Lock()
+        self.inflight = {}  # cache key -> Future, so concurrent requests share one render
+        self.max_queued = THUMB_WORKERS * 8  # renders queued or running at once
+        self.slots = threading.BoundedSemaphore(self.max_queued)
+        self.generated = 0
+        self.rejected = 0
+
+    def drop_pool(self):
+        # Called with the lock held, once the pool is broken
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def get_pool(self):
+        if self.pool is None:
+            # forkserver/spawn: forking a process that is running server threads is unsafe
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            self.pool = ProcessPoolExecutor(max_workers=THUMB_WORKERS, mp_context=context)
+        return self.pool
+
+    @staticmethod
+    def cache_key(source, fs, width):
+        ident = f"{os.path.abspath(source)}\0{fs.st_mtime_ns}\0{fs.st_size}\0{width}"
+        return hashlib.sha256(ident.encode('utf-8', 'surrogateescape')).hexdigest()
+
+    def get(self, source, fs, width):
+        """Path of the cached thumbnail, generating it first if needed.
+
+        Returns None when no thumbnail can be made and raises ThumbnailBusy
+        when the render queue stays full for THUMB_WAIT_SECONDS.
+        """
+        key = self.cache_key(source, fs, width)
+        path = self.cache.lookup(key)
+        if path is not None:
+            return path
+        if self.failures.get(key) is not None:
+            return None
+
+        if Image is not None and self.render(key, source, width):
+            return self.cache.path_for(key)
+        if width <= EXIF_MAX_WIDTH:
+            try:
+                data = exif_thumbnail(source)
+            except OSError:
+                data = None
+            if data:
+                return self.cache.write(key, data)
+        self.failures.put(key, True, 1)
+        return None
+
+    def render(self, key, source, width):
+        with self.lock:
+            future = self.inflight.get(key)
+        if future is None:
+            future = self.submit(key, source, width)
+        try:
+            return future.result(timeout=THUMB_RENDER_TIMEOUT)
+        except FutureTimeout:
+            raise ThumbnailBusy()
+        except BrokenProcessPool:
+            # A worker died (e.g. a decoder crash); start a fresh pool next time
+            with self.lock:
+                self.drop_pool()
+            return False
+        except Exception:
+            return False
+
+    def submit(self, key, source, width):
+        if not self.slots.acquire(timeout=THUMB_WAIT_SECONDS):
+            self.rejected += 1
+            raise ThumbnailBusy()
+        with self.lock:
+            future = self.inflight.get(key)
+            if future is not None:
+                # Someone else queued it while we waited for a slot
+                self.slots.release()
+                return future
+            dest = self.cache.prepare(key)
+            try:
+                future = self.get_pool().submit(render_thumbnail, source, dest, width)
+            except (BrokenProcessPool, RuntimeError):
+                self.drop_pool()
+                future = self.get_pool().submit(render_thumbnail, source, dest, width)
+            self.inflight[key] = future
+        future.add_done_callback(lambda done: self.finished(key, done))
+        return future
+
+    def finished(self, key, future):
+        with self.lock:
+            self.inflight.pop(key, None)
+        self.slots.release()
+        if not future.cancelled() and future.exception() is None and future.result():
+            self.generated += 1
+            self.cache.added(self.cache.path_for(key))
+
+    def stats(self):
+        return {
+            'backend': backend_name(),
+            'workers': THUMB_WORKERS,
+            'generated': self.generated,
+            'rejected': self.rejected,
+            'in_flight': len(self.inflight),
+            'cache': self.cache.stats(),
+        }
+
+
+thumbnail_service = ThumbnailService()
@@ -0,0 +1,300 @@
+import json
+import os
+import re
+import secrets
+import threading
+import time
+
+from config import *
+from multipart import UploadError, clean_filename
+
+# Resumable uploads (/__upload).
+# A client creates an upload with the file's name and size, then sends the
+# file in UPLOAD_RESUMABLE_CHUNK_MB chunks, in any order and over as many
+# connections as it likes. Asking for an upload's status tells it which
+# chunks have arrived, so after a dropped connection (or a page reload) only
+# the rest is sent again. The bytes go into a hidden '.parts' file next to
+# the destination, sized up front, and are renamed into place once every
+# chunk is in.
+#
+# The bookkeeping is kept in files under UPLOAD_STATE_DIR rather than in
+# memory, so every worker process sees the same uploads: <id>.json holds the
+# upload's description and <id>.chunks one byte per chunk, set once that
+# chunk is on disk. Uploads nobody touched for UPLOAD_EXPIRE_HOURS are
+# deleted along with their partial data.
+
+UPLOAD_ID_RE = re.compile(r'[0-9a-f]{32}')
+SWEEP_INTERVAL = 600  # seconds between looks for expired uploads
+O_BINARY = getattr(os, 'O_BINARY', 0)  # Windows translates newlines without it
+
+
+def received_ranges(marks):
+    # "0-4,6,9-11": indexes of the chunks that have arrived
+    ranges = []
+    start = None
+    for i, mark in enumerate(bytes(marks) + b'\0'):
+        if mark and start is None:
+            start = i
+        elif not mark and start is not None:
+            ranges.append(str(start) if start == i - 1 else f"{start}-{i - 1}")
+            start = None
+    return ','.join(ranges)
+
+
+def write_at(fd, data, offset):
+    # Every caller has its own fd, so without pwrite (Windows) a seek is safe
+    if hasattr(os, 'pwrite'):
+        return os.pwrite(fd, data, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.write(fd, data)
+
+
+def read_at(fd, size, offset):
+    if hasattr(os, 'pread'):
+        return os.pread(fd, size, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    chunks = []
+    while size > 0:
+        chunk = os.read(fd, size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def write_info(path, info):
+    # Readers in other processes must never see a half-written file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(info, f)
+    os.replace(tmp_path, path)
+
+
+class ChunkWriter:
+    """Receives one chunk's bytes: write() as they arrive, then finish()."""
+
+    def __init__(self, uploads, info, index, offset, length):
+        self.uploads = uploads
+        self.info = info
+        self.index = index
+        self.position = offset
+        self.remaining = length
+        self.fd = os.open(info['data'], os.O_WRONLY | O_BINARY)
+
+    def write(self, data):
+        if len(data) > self.remaining:
+            raise UploadError(400, "Upload failed: Chunk is longer than declared")
+        view = memoryview(data)
+        while view:
+            written = write_at(self.fd, view, self.position)
+            self.position += written
+            view = view[written:]
+        self.remaining -= len(data)
+
+    def finish(self):
+        """Record the chunk as received. Returns the upload's status."""
+        self.close()
+        if self.remaining:
+            raise UploadError(400, "Upload failed: Connection closed before upload completed")
+        return self.uploads.mark_received(self.info, self.index)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class ResumableUploads:
+    def __init__(self, state_dir=UPLOAD_STATE_DIR, chunk_size=UPLOAD_RESUMABLE_CHUNK_MB * 1024 * 1024,
+                 expire_seconds=UPLOAD_EXPIRE_HOURS * 3600):
+        self.state_dir = state_dir
+        self.chunk_size = chunk_size
+        self.expire_seconds = expire_seconds
+        self.lock = threading.Lock()
+        self.next_sweep = 0
+        self.created = 0
+        self.completed = 0
+        self.expired = 0
+
+    def paths(self, upload_id):
+        if not UPLOAD_ID_RE.fullmatch(upload_id):
+            raise UploadError(404, "Unknown upload")
+        base = os.path.join(self.state_dir, upload_id)
+        return base + '.json', base + '.chunks'
+
+    def load(self, upload_id):
+        info_path, _ = self.paths(upload_id)
+        try:
+            with open(info_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise UploadError(404, "Unknown or expired upload")
+
+    def create(self, target_dir, filename, size):
+        """Start an upload of size bytes saved as target_dir/filename."""
+        name = clean_filename(filename, EXCLUDED_UPLOAD_EXT)
+        if not name:
+            raise UploadError(400, "Upload failed: Missing file name")
+        if size < 0:
+            raise UploadError(400, "Upload failed: Invalid size")
+        if size > MAX_UPLOAD_MB * 1024 * 1024:
+            raise UploadError(413, f"Upload failed: File exceeds maximum size limit of {MAX_UPLOAD_MB} MB")
+        self.sweep()
+
+        os.makedirs(self.state_dir, exist_ok=True)
+        upload_id = secrets.token_hex(16)
+        info_path, chunks_path = self.paths(upload_id)
+        # Next to the destination, so the final rename stays on one filesystem
+        data_path = os.path.join(target_dir, f".upload-{upload_id}.parts")
+        with open(data_path, 'xb') as f:
+            f.truncate(size)
+        with open(chunks_path, 'wb') as f:
+            f.write(bytes(-(-size // self.chunk_size)))
+        info = {
+            'id': upload_id,
+            'name': name,
+            'dir': target_dir,
+            'data': data_path,
+            'size': size,
+            'chunk_size': self.chunk_size,
+            'created': time.time(),
+            'complete': False,
+        }
+        write_info(info_path, info)
+        with self.lock:
+            self.created += 1
+        if not size:
+            return self.mark_received(info, None)
+        return self.describe(info, bytes(-(-size // self.chunk_size)))
+
+    def status(self, upload_id):
+        info = self.load(upload_id)
+        if info['complete']:
+            return self.describe(info, None)
+        _, chunks_path = self.paths(upload_id)
+        try:
+            with open(chunks_path, 'rb') as f:
+                marks = f.read()
+        except OSError:
+            # Completed by another request between the two reads
+            return self.describe(self.load(upload_id), None)
+        return self.describe(info, marks)
+
+    def begin_chunk(self, upload_id, offset, length):
+        """A ChunkWriter for the chunk starting at byte offset; length must
+        be the chunk's full size (only the last chunk may be shorter)."""
+        info = self.load(upload_id)
+        if info['complete']:
+            raise UploadError(409, "Upload already complete")
+        chunk_size = info['chunk_size']
+        if offset < 0 or offset % chunk_size or offset >= info['size']:
+            raise UploadError(400, "Upload-Offset must be the start of a chunk")
+        if length != min(chunk_size, info['size'] - offset):
+            raise UploadError(400, f"Chunks must be {chunk_size} bytes (the last one may be shorter)")
+        try:
+            return ChunkWriter(self, info, offset // chunk_size, offset, length)
+        except FileNotFoundError:
+            raise UploadError(404, "Unknown or expired upload")
+
+    def mark_received(self, info, index):
+        info_path, chunks_path = self.paths(info['id'])
+        marks = b''
+        if index is not None:
+            try:
+                fd = os.open(chunks_path, os.O_RDWR | O_BINARY)
+            except FileNotFoundError:
+                return self.status(info['id'])
+            try:
+                # One byte per chunk: concurrent writers never touch the same byte
+                write_at(fd, b'\1', index)
+                marks = read_at(fd, os.fstat(fd).st_size, 0)
+            finally:
+                os.close(fd)
+            if not all(marks):
+                return self.describe(info, marks)
+
+        try:
+            os.replace(info['data'], os.path.join(info['dir'], info['name']))
+        except FileNotFoundError:
+            # The last two chunks landed together and the other request won
+            return self.status(info['id'])
+        info['complete'] = True
+        write_info(info_path, info)
+        try:
+            os.remove(chunks_path)
+        except OSError:
+            pass
+        with self.lock:
+            self.completed += 1
+        return self.describe(info, None)
+
+    def cancel(self, upload_id):
+        info = self.load(upload_id)
+        self.remove(info)
+
+    def remove(self, info):
+        info_path, chunks_path = self.paths(info['id'])
+        for path in (chunks_path, info_path) if info['complete'] else (info['data'], chunks_path, info_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def describe(self, info, marks):
+        if marks is None:
+            offset = info['size']
+            received = f"0-{-(-info['size'] // info['chunk_size']) - 1}" if info['size'] else ''
+        else:
+            missing = marks.find(b'\0')
+            offset = info['size'] if missing == -1 else missing * info['chunk_size']
+            received = received_ranges(marks)
+        return {
+            'id': info['id'],
+            'url': f"/__upload/{info['id']}",
+            'name': info['name'],
+            'size': info['size'],
+            'chunk_size': info['chunk_size'],
+            'offset': offset,  # every byte before this has arrived
+            'received': received,
+            'complete': marks is None,
+        }
+
+    def sweep(self):
+        # Drop uploads nobody has touched for expire_seconds
+        now = time.time()
+        with self.lock:
+            if now < self.next_sweep:
+                return
+            self.next_sweep = now + SWEEP_INTERVAL
+        try:
+            names = os.listdir(self.state_dir)
+        except OSError:
+            return
+        for name in names:
+            upload_id, ext = os.path.splitext(name)
+            if ext != '.json' or not UPLOAD_ID_RE.fullmatch(upload_id):
+                continue
+            info_path, chunks_path = self.paths(upload_id)
+            try:
+                touched = max(os.path.getmtime(path) for path in (info_path, chunks_path)
+                              if os.path.exists(path))
+                if now - touched < self.expire_seconds:
+                    continue
+                info = self.load(upload_id)
+            except (OSError, ValueError, UploadError):
+                continue
+            self.remove(info)
+            with self.lock:
+                self.expired += 1
+
+    def stats(self):
+        try:
+            active = sum(name.endswith('.chunks') for name in os.listdir(self.state_dir))
+        except OSError:
+            active = 0
+        return {'in_progress': active, 'created': self.created, 'completed': self.completed,
+                'expired': self.expired}
+
+
+resumable_uploads = ResumableUploads()
@@ -0,0 +1,269 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from config import *
+from accesslog import access_log
+
+# Filesystem change notification for the served tree.
+# On Linux every folder gets an inotify watch (through ctypes; no extra
+# package). Elsewhere, or for folders beyond the kernel's watch limit (or
+# this process's share of WATCH_MAX_DIRS), the folders someone is currently
+# viewing are polled instead. Changes are collected per folder and handed to
+# the callback in batches, at most one every WATCH_COALESCE_SECONDS, so a
+# burst (an upload, an unzip, a copy of a whole album) becomes one update
+# instead of thousands.
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0o2000000)
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+
+def load_inotify():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+def join(rel, name):
+    return f"{rel}/{name}" if rel else name
+
+
+class FileWatcher:
+    """Calls on_changes({folder: names}) from a background thread, where
+    folder is relative to root ('' for root itself) and names is the set of
+    changed entry names, or None when the changes are unknown (event queue
+    overflow) and the folder should be reread as a whole.
+
+    polled_dirs() returns the folders worth polling when inotify can't
+    cover them (typically the folders that have viewers).
+    """
+
+    def __init__(self, root, on_changes, polled_dirs=lambda: (), max_watches=0):
+        self.root = os.path.abspath(root)
+        self.on_changes = on_changes
+        self.polled_dirs = polled_dirs
+        self.max_watches = max_watches  # 0 = until the kernel refuses more
+        self.libc = load_inotify()
+        self.fd = None
+        self.wds = {}  # watch descriptor -> folder
+        self.watched = {}  # folder -> watch descriptor
+        self.limit_reached = False
+        self.errors = 0  # failed change callbacks
+        self.snapshots = {}  # polled folder -> {name: (is_dir, size, mtime_ns)}
+        self.pending = {}
+        self.pending_since = None
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.run, name='file-watcher', daemon=True)
+        self.thread.start()
+
+    def backend(self):
+        if self.fd is None:
+            return 'polling'
+        return 'inotify+polling' if self.limit_reached else 'inotify'
+
+    def stats(self):
+        return {
+            'backend': self.backend(),
+            'watched_dirs': len(self.watched),
+            'polled_dirs': len(self.snapshots),
+            'errors': self.errors,
+        }
+
+    # --- inotify ---
+
+    def open_inotify(self):
+        if self.libc is None:
+            return
+        fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            access_log.message(f"inotify unavailable ({os.strerror(ctypes.get_errno())}); polling instead",
+                               level='warning')
+            return
+        self.fd = fd
+        self.watch_tree('')
+
+    def watch_tree(self, rel):
+        stack = [rel]
+        while stack and not self.limit_reached:
+            rel = stack.pop()
+            path = os.path.join(self.root, rel) if rel else self.root
+            if self.max_watches and len(self.watched) >= self.max_watches:
+                self.limit_reached = True
+                access_log.message(f"WATCH_MAX_DIRS reached ({self.max_watches} folders in this process); "
+                                   "the remaining folders are polled while viewed", level='warning')
+                break
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                # Other workers (or programs) may hold the rest of the watches: fall back to polling
+                if err in (errno.ENOSPC, errno.ENOMEM):
+                    self.limit_reached = True
+                    access_log.message("inotify watch limit reached (fs.inotify.max_user_watches); "
+                                       "the remaining folders are polled while viewed", level='warning')
+                continue
+            self.wds[wd] = rel
+            self.watched[rel] = wd
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(join(rel, entry.name))
+                        except OSError:
+                            pass
+            except OSError:
+                pass
+
+    def unwatch_tree(self, rel):
+        prefix = rel + '/'
+        for folder in [f for f in self.watched if f == rel or f.startswith(prefix)]:
+            wd = self.watched.pop(folder)
+            self.wds.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        pos = 0
+        while pos + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, pos)
+            pos += EVENT_HEADER.size
+            name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+            pos += length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost: every folder may have changed
+                for folder in self.watched:
+                    self.add_pending(folder, None)
+                continue
+            folder = self.wds.get(wd)
+            if folder is None:
+                continue
+            if mask & IN_IGNORED:
+                # The folder itself is gone; its parent reports the removal
+                self.wds.pop(wd, None)
+                if self.watched.get(folder) == wd:
+                    del self.watched[folder]
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                continue
+            if mask & IN_ISDIR:
+                child = join(folder, name)
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.watch_tree(child)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self.unwatch_tree(child)
+            self.add_pending(folder, name)
+
+    # --- Polling ---
+
+    def read_snapshot(self, folder):
+        path = os.path.join(self.root, folder) if folder else self.root
+        snapshot = {}
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    st = entry.stat()
+                    snapshot[entry.name] = (entry.is_dir(), st.st_size, st.st_mtime_ns)
+                except OSError:
+                    continue
+        return snapshot
+
+    def poll(self):
+        folders = {folder for folder in self.polled_dirs() if folder not in self.watched}
+        for folder in list(self.snapshots):
+            if folder not in folders:
+                del self.snapshots[folder]
+        for folder in folders:
+            try:
+                current = self.read_snapshot(folder)
+            except OSError:
+                current = {}
+            previous = self.snapshots.get(folder)
+            self.snapshots[folder] = current
+            if previous is None:
+                continue  # first look: nothing to compare with yet
+            for name in previous.keys() | current.keys():
+                if previous.get(name) != current.get(name):
+                    self.add_pending(folder, name)
+
+    # --- Batching ---
+
+    def add_pending(self, folder, name):
+        if self.pending_since is None:
+            self.pending_since = time.monotonic()
+        if name is None:
+            self.pending[folder] = None
+        else:
+            names = self.pending.setdefault(folder, set())
+            if names is not None:
+                names.add(name)
+
+    def flush(self):
+        changes, self.pending, self.pending_since = self.pending, {}, None
+        try:
+            self.on_changes(changes)
+        except Exception as e:
+            self.errors += 1
+            access_log.message(f"Watcher callback error: {e}")
+
+    def run(self):
+        self.open_inotify()
+        next_poll = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now >= next_poll:
+                self.poll()
+                next_poll = now + WATCH_POLL_SECONDS
+            timeout = next_poll - now
+            if self.pending_since is not None:
+                timeout = min(timeout, self.pending_since + WATCH_COALESCE_SECONDS - now)
+            timeout = max(0, timeout)
+
+            if self.fd is not None:
+                ready, _, _ = select.select([self.fd], [], [], timeout)
+                if ready:
+                    self.read_events()
+            else:
+                time.sleep(timeout)
+
+            if self.pending_since is not None and time.monotonic() - self.pending_since >= WATCH_COALESCE_SECONDS:
+                self.flush()
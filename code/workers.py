@@ -0,0 +1,250 @@
+import hashlib
+import mmap
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+import sys
+import time
+
+from config import *
+from accesslog import access_log
+
+# Multi-process mode (SERVER_WORKERS > 1, POSIX only).
+# A supervisor forks the workers, restarts any that die and forwards signals.
+# Each worker binds the port itself with SO_REUSEPORT so the kernel spreads
+# connections across them; without SO_REUSEPORT they share one socket bound
+# by the supervisor. Workers are always forked from the supervisor, which
+# never starts threads, so they inherit a clean process.
+
+RESTART_BACKOFF_MAX = 10  # seconds between restarts of a worker that keeps crashing
+QUICK_EXIT_SECONDS = 5  # a worker dying sooner than this counts as a crash loop
+STOP_GRACE_SECONDS = 10  # how long stopping workers get before SIGKILL
+
+REUSE_PORT = getattr(socket, 'SO_REUSEPORT', None)
+
+
+def supported():
+    return hasattr(os, 'fork') and hasattr(os, 'waitpid')
+
+
+def create_listener(port, reuse_port=False, backlog=1024):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, REUSE_PORT, 1)
+        sock.bind(("", port))
+        sock.listen(backlog)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+class SharedRateLimiter:
+    """RateLimiter whose counters live in shared memory, so the limit holds
+    across all worker processes instead of per process.
+
+    Clients hash into a fixed table of RATE_LIMIT_SLOTS slots (open
+    addressing, short probe). Each slot keeps request counts for the current
+    and previous window, and the two are blended into a sliding-window
+    estimate. When every probed slot is live, the one with the oldest window
+    is taken over. Must be created before the workers are forked.
+    """
+
+    SLOT = struct.Struct('<QqII')  # client key, window number, current count, previous count
+    PROBES = 8
+
+    def __init__(self, slots=RATE_LIMIT_SLOTS, limit=RATE_LIMIT_MAX_REQUESTS, window=RATE_LIMIT_WINDOW):
+        self.slots = slots
+        self.limit = limit
+        self.window = window
+        self.table = mmap.mmap(-1, slots * self.SLOT.size)
+        self.lock = multiprocessing.Lock()
+
+    @staticmethod
+    def client_key(ip):
+        # hash() is salted per interpreter, so use a stable digest; 0 marks an empty slot
+        key = int.from_bytes(hashlib.blake2b(ip.encode(), digest_size=8).digest(), 'little')
+        return key or 1
+
+    def is_allowed(self, ip):
+        now = time.time()
+        current = int(now // self.window)
+        key = self.client_key(ip)
+        slot_size = self.SLOT.size
+        home = key % self.slots
+
+        with self.lock:
+            offset = victim = None
+            victim_window = None
+            for i in range(self.PROBES):
+                probe = ((home + i) % self.slots) * slot_size
+                slot_key, slot_window, _, _ = self.SLOT.unpack_from(self.table, probe)
+                if slot_key == key:
+                    offset = probe
+                    break
+                if victim_window is None or slot_window < victim_window:
+                    victim, victim_window = probe, slot_window
+
+            if offset is None:
+                offset = victim
+                self.SLOT.pack_into(self.table, offset, key, current, 0, 0)
+
+            _, slot_window, count, previous = self.SLOT.unpack_from(self.table, offset)
+            if slot_window != current:
+                previous = count if slot_window == current - 1 else 0
+                count = 0
+
+            elapsed = (now % self.window) / self.window
+            allowed = previous * (1 - elapsed) + count < self.limit
+            if allowed:
+                count += 1
+            self.SLOT.pack_into(self.table, offset, key, current, count, previous)
+            return allowed
+
+    def stats(self):
+        current = int(time.time() // self.window)
+        with self.lock:
+            clients = sum(1 for key, window, _, _ in self.SLOT.iter_unpack(self.table)
+                          if key and window >= current - 1)
+        return {'clients': clients, 'slots': self.slots}
+
+
+class Supervisor:
+    def __init__(self, count, port, serve, on_ready=None):
+        self.count = count
+        self.port = port
+        self.serve = serve
+        self.on_ready = on_ready
+        self.children = {}  # pid -> worker slot
+        self.started = {}  # slot -> start time
+        self.crashes = {}  # slot -> consecutive quick exits
+        self.retiring = set()  # pids asked to exit by a reload
+        self.stopping = False
+        self.shared_sock = None
+
+    def run(self):
+        if REUSE_PORT is not None:
+            # Fail early (port in use, no permission) instead of in every worker
+            create_listener(self.port, reuse_port=True).close()
+        else:
+            self.shared_sock = create_listener(self.port)
+            self.shared_sock.setblocking(False)
+
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, self.handle_stop)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self.handle_reload)
+
+        for slot in range(self.count):
+            self.spawn(slot)
+        if self.on_ready:
+            self.on_ready()
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            slot = self.children.pop(pid, None)
+            if slot is None:
+                continue
+            if self.stopping:
+                continue
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                self.spawn(slot)
+                continue
+            self.report_exit(slot, pid, status)
+            self.spawn(slot, delay=self.restart_delay(slot))
+
+        if self.shared_sock is not None:
+            self.shared_sock.close()
+
+    def spawn(self, slot, delay=0):
+        if delay:
+            time.sleep(delay)
+            if self.stopping:
+                return
+        pid = os.fork()
+        if pid == 0:
+            self.run_worker()
+        self.children[pid] = slot
+        self.started[slot] = time.monotonic()
+
+    def run_worker(self):
+        code = 0
+        try:
+            # The supervisor forwards Ctrl+C as SIGTERM; don't react to the terminal's SIGINT too
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+            if hasattr(signal, 'SIGHUP'):
+                signal.signal(signal.SIGHUP, signal.SIG_DFL)
+            sock = self.shared_sock or create_listener(self.port, reuse_port=True)
+            self.serve(sock)
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 0
+        except BaseException as e:
+            access_log.message(f"Worker {os.getpid()} crashed: {e}")
+            code = 1
+        finally:
+            # os._exit skips atexit: write out the log queue first
+            access_log.close()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def restart_delay(self, slot):
+        if time.monotonic() - self.started.get(slot, 0) >= QUICK_EXIT_SECONDS:
+            self.crashes[slot] = 0
+            return 0
+        self.crashes[slot] = self.crashes.get(slot, 0) + 1
+        return min(RESTART_BACKOFF_MAX, 0.5 * 2 ** self.crashes[slot])
+
+    def report_exit(self, slot, pid, status):
+        if os.WIFSIGNALED(status):
+            reason = f"killed by signal {os.WTERMSIG(status)}"
+        else:
+            reason = f"exited with status {os.WEXITSTATUS(status)}"
+        print(f"Worker {slot} (pid {pid}) {reason}, restarting")
+
+    def signal_children(self, signum):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def handle_stop(self, signum, frame):
+        if self.stopping:
+            return
+        self.stopping = True
+        self.signal_children(signal.SIGTERM)
+        deadline = time.monotonic() + STOP_GRACE_SECONDS
+        while self.children and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                break
+            if pid:
+                self.children.pop(pid, None)
+            else:
+                time.sleep(0.05)
+        self.signal_children(signal.SIGKILL)
+        raise KeyboardInterrupt
+
+    def handle_reload(self, signum, frame):
+        # SIGHUP: replace every worker; the wait loop respawns them as they exit
+        print("Reloading workers")
+        self.retiring.update(self.children)
+        self.signal_children(signal.SIGTERM)
+
+
+def run_workers(count, port, serve, on_ready=None):
+    Supervisor(count, port, serve, on_ready).run()